@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:41
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clients', '0004_customer_updated_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['distributor', '-created_at', '-id'], name='customer_distrib_created_idx'),
+        ),
+    ]
@@ -28,6 +28,13 @@ class Customer(models.Model):
     )
 
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Serves the keyset-paged customer lists of a distributor, newest first
+            models.Index(fields=['distributor', '-created_at', '-id'], name='customer_distrib_created_idx'),
+        ]
 
     def __str__(self):
         return f"{self.name} (owned by {self.distributor}, assigned to {self.assigned_agent})"
@@ -1,3 +1,78 @@
+from unittest import mock
+
+from django.contrib.auth import get_user_model
 from django.test import TestCase
+from rest_framework.test import APIClient
+
+from .models import Customer
+
+User = get_user_model()
+
+
+class CustomerAgentAssignmentTests(TestCase):
+
+    def setUp(self):
+        self.distributor = User.objects.create_user(
+            email='distributor@example.com', password='pass', user_type='DISTRIBUTOR'
+        )
+        other = User.objects.create_user(email='other@example.com', password='pass', user_type='DISTRIBUTOR')
+        self.agent = User.objects.create_user(
+            email='agent@example.com', password='pass', user_type='AGENT', distributor=self.distributor
+        )
+        self.other_agent = User.objects.create_user(
+            email='agent2@example.com', password='pass', user_type='AGENT', distributor=self.distributor
+        )
+        self.unassigned = self.customer(1, self.distributor)
+        self.assigned = self.customer(2, self.distributor, self.other_agent)
+        self.foreign = self.customer(3, other)
+        self.client = APIClient()
+        self.client.force_authenticate(self.distributor)
+
+    def customer(self, n, distributor, agent=None):
+        return Customer.objects.create(
+            name=f'Customer {n}', email=f'c{n}@example.com', phone_number=f'070000000{n}',
+            distributor=distributor, assigned_agent=agent
+        )
+
+    def agent_of(self, customer):
+        return Customer.objects.get(pk=customer.pk).assigned_agent_id
+
+    def test_assign_skips_foreign_and_already_assigned_customers(self):
+        response = self.client.post('/api/customers/assign_agent/', {
+            'agent_id': self.agent.id,
+            'customer_ids': [self.unassigned.id, self.assigned.id, self.foreign.id, 9999],
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['assigned'], [self.unassigned.id])
+        self.assertEqual(
+            [error['customer_id'] for error in response.data['errors']],
+            [self.assigned.id, self.foreign.id, 9999]
+        )
+        self.assertEqual(self.agent_of(self.unassigned), self.agent.id)
+        self.assertEqual(self.agent_of(self.assigned), self.other_agent.id)
+        self.assertIsNone(self.agent_of(self.foreign))
+
+    def test_reassign_reports_old_agents(self):
+        response = self.client.post('/api/customers/reassign_agent/', {
+            'new_agent_id': self.agent.id,
+            'customer_ids': [self.unassigned.id, self.assigned.id, self.foreign.id],
+        }, format='json')
+        self.assertEqual(response.data['reassigned'], [
+            {'customer_id': self.unassigned.id, 'old_agent_id': None},
+            {'customer_id': self.assigned.id, 'old_agent_id': self.other_agent.id},
+        ])
+        self.assertEqual([error['customer_id'] for error in response.data['errors']], [self.foreign.id])
+        self.assertEqual(self.agent_of(self.assigned), self.agent.id)
+        self.assertIsNone(self.agent_of(self.foreign))
 
-# Create your tests here.
+    def test_customer_assigned_after_classification_is_not_reported(self):
+        classified = {self.unassigned.id: {'id': self.unassigned.id, 'distributor_id': self.distributor.id,
+                                           'assigned_agent_id': None}}
+        Customer.objects.filter(pk=self.unassigned.pk).update(assigned_agent=self.other_agent)
+        with mock.patch('clients.views.fetch_rows', return_value=classified):
+            response = self.client.post('/api/customers/assign_agent/', {
+                'agent_id': self.agent.id, 'customer_ids': [self.unassigned.id],
+            }, format='json')
+        self.assertEqual(response.data['assigned'], [])
+        self.assertEqual([error['customer_id'] for error in response.data['errors']], [self.unassigned.id])
+        self.assertEqual(self.agent_of(self.unassigned), self.other_agent.id)
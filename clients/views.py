@@ -10,6 +10,9 @@ from django.shortcuts import get_object_or_404
 from .models import Customer
 from .serializers import CustomerSerializer
 from django.contrib.auth import get_user_model
+from django.db.models import Q
+from utils.bulk import CONCURRENT_CHANGE_ERROR, unique_pks, fetch_rows, update_rows
+from utils.pagination import keyset_response
 
 User = get_user_model()
 
@@ -41,8 +44,7 @@ def customer_list_create_view(request):
         else:
             queryset = Customer.objects.none()
 
-        serializer = CustomerSerializer(queryset, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return keyset_response(request, queryset, CustomerSerializer)
 
     elif request.method == 'POST':
         # Only distributor or agent can create
@@ -174,17 +176,20 @@ def assign_multiple_customers_view(request):
 
     assigned_successfully = []
     errors = []
+    eligible = []
+
+    # One query classifies every requested customer ID
+    requested = unique_pks(customer_ids)
+    rows = fetch_rows(Customer.objects.all(), [pk for _, pk in requested], 'distributor_id', 'assigned_agent_id')
 
-    # Loop over each customer ID to assign
-    for cid in customer_ids:
-        try:
-            customer = Customer.objects.get(pk=cid)
-        except Customer.DoesNotExist:
+    for cid, pk in requested:
+        row = rows.get(pk)
+        if row is None:
             errors.append({"customer_id": cid, "detail": "Customer does not exist."})
             continue
 
         # Ensure this distributor owns the customer
-        if customer.distributor != user:
+        if row['distributor_id'] != user.id:
             errors.append({
                 "customer_id": cid,
                 "detail": "You do not own this customer."
@@ -192,20 +197,25 @@ def assign_multiple_customers_view(request):
             continue
 
         # If the customer already has a different agent assigned, block reassign
-        if customer.assigned_agent and customer.assigned_agent != agent_user:
+        if row['assigned_agent_id'] is not None and row['assigned_agent_id'] != agent_user.id:
             errors.append({
                 "customer_id": cid,
-                "detail": (
-                    f"This customer is already assigned to "
-                    f"{customer.assigned_agent.username or 'another agent'}. "
-                )
+                "detail": "This customer is already assigned to another agent. "
             })
             continue
 
-        # Otherwise, assign this agent
-        customer.assigned_agent = agent_user
-        customer.save()
-        assigned_successfully.append(cid)
+        eligible.append((cid, pk))
+
+    # Otherwise, assign this agent to all eligible customers in one UPDATE
+    updated = update_rows(
+        Customer.objects.filter(Q(assigned_agent__isnull=True) | Q(assigned_agent=agent_user), distributor=user),
+        [pk for _, pk in eligible], assigned_agent=agent_user
+    )
+    for cid, pk in eligible:
+        if pk in updated:
+            assigned_successfully.append(cid)
+        else:
+            errors.append({"customer_id": cid, "detail": CONCURRENT_CHANGE_ERROR})
 
     response_data = {
         "assigned": assigned_successfully,
@@ -260,11 +270,15 @@ def reassign_multiple_customers_view(request):
 
     assigned_successfully = []
     errors = []
+    eligible = []
+
+    # One query classifies every requested customer ID and captures the old agents
+    requested = unique_pks(customer_ids)
+    rows = fetch_rows(Customer.objects.all(), [pk for _, pk in requested], 'distributor_id', 'assigned_agent_id')
 
-    for cid in customer_ids:
-        try:
-            customer = Customer.objects.get(pk=cid)
-        except Customer.DoesNotExist:
+    for cid, pk in requested:
+        row = rows.get(pk)
+        if row is None:
             errors.append({
                 "customer_id": cid,
                 "detail": "Customer does not exist."
@@ -272,7 +286,7 @@ def reassign_multiple_customers_view(request):
             continue
 
         # Must be owned by this distributor
-        if customer.distributor != user:
+        if row['distributor_id'] != user.id:
             errors.append({
                 "customer_id": cid,
                 "detail": "You do not own this customer."
@@ -280,22 +294,24 @@ def reassign_multiple_customers_view(request):
             continue
 
         # If you want to block reassigning from the same agent, uncomment:
-        # if customer.assigned_agent == new_agent_user:
+        # if row['assigned_agent_id'] == new_agent_user.id:
         #     errors.append({
         #         "customer_id": cid,
         #         "detail": "Customer is already assigned to this agent."
         #     })
         #     continue
 
-        # Reassign the customer to the new agent
-        old_agent = customer.assigned_agent
-        customer.assigned_agent = new_agent_user
-        customer.save()
+        eligible.append((cid, pk, row['assigned_agent_id']))
 
-        assigned_successfully.append({
-            "customer_id": cid,
-            "old_agent_id": old_agent.pk if old_agent else None
-        })
+    # Reassign all eligible customers to the new agent in one UPDATE
+    updated = update_rows(
+        Customer.objects.filter(distributor=user), [pk for _, pk, _ in eligible], assigned_agent=new_agent_user
+    )
+    for cid, pk, old_agent_id in eligible:
+        if pk in updated:
+            assigned_successfully.append({"customer_id": cid, "old_agent_id": old_agent_id})
+        else:
+            errors.append({"customer_id": cid, "detail": CONCURRENT_CHANGE_ERROR})
 
     response_data = {
         "reassigned": assigned_successfully,
@@ -83,6 +83,29 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Take the write lock when a transaction starts instead of on its
+            # first write, so concurrent payments queue on the busy timeout
+            # rather than failing with "database is locked".
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        # File based so the concurrency tests run against real SQLite locking
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
+    }
+}
+
+
+# Per-process cache, used for payment plans. Point this at Redis/Memcached
+# when running several processes so plan invalidations are seen by all of
+# them. The payment message catalogue checks the database instead (see
+# payments/messages.py), so the outbox worker sees admin edits either way.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'freecode4u',
     }
 }
 
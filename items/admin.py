@@ -1,6 +1,6 @@
 # admin.py
 from django.contrib import admin
-from .models import Manufacturer, Fleet, EncoderState, Item
+from .models import Manufacturer, Fleet, EncoderState, Item, ItemImport
 from django.utils import timezone
 
 
@@ -16,13 +16,15 @@ class SoftDeleteAdmin(admin.ModelAdmin):
 
     def soft_delete_selected(self, request, queryset):
         """Custom admin action for soft deletion"""
-        queryset.update(deleted_status=True, deleted_at=timezone.now())
+        now = timezone.now()
+        queryset.update(deleted_status=True, deleted_at=now, updated_at=now)
         self.message_user(request, f"Soft deleted {queryset.count()} items")
     soft_delete_selected.short_description = "Soft delete selected items"
 
     def delete_queryset(self, request, queryset):
         """Override bulk delete to use soft delete"""
-        queryset.update(deleted_status=True, deleted_at=timezone.now())
+        now = timezone.now()
+        queryset.update(deleted_status=True, deleted_at=now, updated_at=now)
 
     def delete_model(self, request, obj):
         """Override single object delete to use soft delete"""
@@ -52,4 +54,10 @@ class EncoderStateAdmin(SoftDeleteAdmin):
 class ItemAdmin(SoftDeleteAdmin):
     list_display = ('id', 'serial_number', 'fleet', 'customer', 'status', 'deleted_status', 'deleted_at')
     list_filter = ('status', 'deleted_status')
-    search_fields = ('serial_number', 'fleet__name')
\ No newline at end of file
+    search_fields = ('serial_number', 'fleet__name')
+
+@admin.register(ItemImport)
+class ItemImportAdmin(SoftDeleteAdmin):
+    list_display = ('id', 'file_name', 'distributor', 'status', 'rows_committed', 'created_count', 'error_count', 'created_at')
+    list_filter = ('status', 'file_format')
+    search_fields = ('file_name', 'distributor__email')
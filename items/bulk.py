@@ -0,0 +1,212 @@
+# bulk.py
+"""
+Set-based item creation shared by the bulk JSON endpoint and file imports.
+
+Validation runs fully in memory against one prefetch of the fleets,
+manufacturers, customers, payment plans and serial numbers a batch
+references, then rows are written with bulk_create in fixed-size chunks.
+"""
+from django.db import transaction, IntegrityError
+
+from clients.models import Customer
+from payments.models import PaymentPlan
+from utils.bulk import to_pk
+
+from .models import Manufacturer, Fleet, Item, EncoderState
+from .serializers import EncoderStateSerializer, ItemSerializer
+
+BULK_CREATE_CHUNK_SIZE = 500
+SERIAL_NUMBER_MAX_LENGTH = Item._meta.get_field('serial_number').max_length
+STATUS_VALUES = {value for value, _ in Item.STATUS_CHOICES}
+DUPLICATE_SERIAL_MESSAGE = "item with this serial number already exists."
+
+
+def prefetch_bulk_context(rows):
+    """
+    Load everything the rows reference in five queries.
+
+    Returns (fleets_by_id, manufacturers_by_id, customers_by_id,
+    payment_plans_by_id, existing_serial_numbers).
+    """
+    fleet_ids = set()
+    manufacturer_ids = set()
+    customer_ids = set()
+    payment_plan_ids = set()
+    serial_numbers = set()
+    for _, item_data in rows:
+        if not isinstance(item_data, dict):
+            continue
+        fleet_id = to_pk(item_data.get('fleet_id', item_data.get('fleet')))
+        if fleet_id is not None:
+            fleet_ids.add(fleet_id)
+        manufacturer_id = to_pk(item_data.get('manufacturers'))
+        if manufacturer_id is not None:
+            manufacturer_ids.add(manufacturer_id)
+        customer_id = to_pk(item_data.get('customer'))
+        if customer_id is not None:
+            customer_ids.add(customer_id)
+        payment_plan_id = to_pk(item_data.get('payment_plan'))
+        if payment_plan_id is not None:
+            payment_plan_ids.add(payment_plan_id)
+        serial_number = item_data.get('serial_number')
+        if isinstance(serial_number, str):
+            serial_numbers.add(serial_number)
+
+    fleets = Fleet.objects.select_related('assigned_agent').in_bulk(fleet_ids)
+    manufacturers = Manufacturer.objects.in_bulk(manufacturer_ids)
+    customers = Customer.objects.in_bulk(customer_ids)
+    payment_plans = PaymentPlan.objects.in_bulk(payment_plan_ids)
+    # The unique constraint also covers soft-deleted items.
+    existing = set(
+        Item.all_objects.filter(serial_number__in=serial_numbers)
+        .values_list('serial_number', flat=True)
+    )
+    return fleets, manufacturers, customers, payment_plans, existing
+
+
+def related_or_error(item_data, field, objects_by_id, field_errors):
+    """The prefetched object `item_data[field]` points at, recording an error if there is none."""
+    raw = item_data.get(field)
+    if raw in (None, ''):
+        return None
+    obj = objects_by_id.get(to_pk(raw))
+    if obj is None:
+        field_errors[field] = [f'Invalid pk "{raw}" - object does not exist.']
+    return obj
+
+
+def validate_item_rows(user, rows):
+    """
+    Validate (index, item_data) pairs for `user` without touching the database
+    per row.
+
+    Returns (valid, errors) where valid is a list of
+    (index, Item, encoder_state_data) and errors mirrors the per-index report
+    of the bulk endpoint: [{"index": <int>, "error": <str|dict>}].
+    """
+    fleets, manufacturers, customers, payment_plans, existing = prefetch_bulk_context(rows)
+    seen_serial_numbers = set()
+    valid = []
+    errors = []
+
+    for idx, item_data in rows:
+        if not isinstance(item_data, dict):
+            errors.append({"index": idx, "error": {"non_field_errors": ["Invalid data. Expected a dictionary."]}})
+            continue
+
+        field_errors = {}
+
+        serial_number = item_data.get('serial_number')
+        if serial_number is None or (isinstance(serial_number, str) and not serial_number.strip()):
+            field_errors['serial_number'] = ["This field is required."]
+        elif not isinstance(serial_number, str):
+            field_errors['serial_number'] = ["Not a valid string."]
+        elif len(serial_number) > SERIAL_NUMBER_MAX_LENGTH:
+            field_errors['serial_number'] = [
+                f"Ensure this field has no more than {SERIAL_NUMBER_MAX_LENGTH} characters."
+            ]
+        elif serial_number in existing:
+            field_errors['serial_number'] = [DUPLICATE_SERIAL_MESSAGE]
+        elif serial_number in seen_serial_numbers:
+            field_errors['serial_number'] = ["Duplicate serial_number in this upload."]
+
+        manufacturer = related_or_error(item_data, 'manufacturers', manufacturers, field_errors)
+        customer = related_or_error(item_data, 'customer', customers, field_errors)
+        payment_plan = related_or_error(item_data, 'payment_plan', payment_plans, field_errors)
+
+        item_status = item_data.get('status', 'pending')
+        if item_status not in STATUS_VALUES:
+            field_errors['status'] = [f'"{item_status}" is not a valid choice.']
+
+        encoder_state_data = item_data.get('encoder_state')
+        if encoder_state_data is not None:
+            encoder_serializer = EncoderStateSerializer(data=encoder_state_data)
+            if encoder_serializer.is_valid():
+                encoder_state_data = encoder_serializer.validated_data
+            else:
+                field_errors['encoder_state'] = encoder_serializer.errors
+
+        if field_errors:
+            errors.append({"index": idx, "error": field_errors})
+            continue
+
+        fleet = None
+        raw_fleet = item_data.get('fleet_id', item_data.get('fleet'))
+        if raw_fleet not in (None, ''):
+            fleet = fleets.get(to_pk(raw_fleet))
+            if fleet is None:
+                errors.append({"index": idx, "error": "No Fleet matches the given query."})
+                continue
+            if fleet.distributor_id != user.id:
+                errors.append({"index": idx, "error": f"You do not own fleet_id={raw_fleet}"})
+                continue
+
+        seen_serial_numbers.add(serial_number)
+        item = Item(
+            serial_number=serial_number, fleet=fleet, manufacturers=manufacturer,
+            customer=customer, payment_plan=payment_plan, status=item_status,
+        )
+        valid.append((idx, item, encoder_state_data))
+
+    return valid, errors
+
+
+def insert_item(item, encoder_state_data):
+    with transaction.atomic():
+        item.save()
+        if encoder_state_data:
+            EncoderState.objects.create(item=item, **encoder_state_data)
+
+
+def bulk_insert_items(valid, chunk_size=BULK_CREATE_CHUNK_SIZE):
+    """
+    Write validated rows with one Item and one EncoderState bulk_create per
+    chunk. A chunk that fails (e.g. a serial number inserted concurrently)
+    is rolled back and retried row by row, so only the offending rows are
+    reported.
+
+    Returns (created_ids, errors).
+    """
+    created_ids = []
+    errors = []
+
+    for start in range(0, len(valid), chunk_size):
+        chunk = valid[start:start + chunk_size]
+        try:
+            with transaction.atomic():
+                items = Item.objects.bulk_create([item for _, item, _ in chunk])
+                EncoderState.objects.bulk_create([
+                    EncoderState(item=item, **encoder_state_data)
+                    for item, (_, _, encoder_state_data) in zip(items, chunk)
+                    if encoder_state_data
+                ])
+        except IntegrityError:
+            for idx, item, encoder_state_data in chunk:
+                # Undo what the rolled back bulk_create set on the instance
+                item.pk = None
+                item._state.adding = True
+                try:
+                    insert_item(item, encoder_state_data)
+                except IntegrityError:
+                    item.pk = None
+                    if Item.all_objects.filter(serial_number=item.serial_number).exists():
+                        error = {"serial_number": [DUPLICATE_SERIAL_MESSAGE]}
+                    else:
+                        error = {"non_field_errors": ["The item could not be saved."]}
+                    errors.append({"index": idx, "error": error})
+                    continue
+                created_ids.append(item.pk)
+            continue
+        created_ids.extend(item.pk for item in items)
+
+    return created_ids, errors
+
+
+def serialize_created_items(created_ids, chunk_size=BULK_CREATE_CHUNK_SIZE):
+    """Serialize freshly created items with a constant number of queries per chunk."""
+    data = []
+    for start in range(0, len(created_ids), chunk_size):
+        ids = created_ids[start:start + chunk_size]
+        items = ItemSerializer.setup_eager_loading(Item.objects.filter(pk__in=ids)).order_by('pk')
+        data.extend(ItemSerializer(items, many=True).data)
+    return data
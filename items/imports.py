@@ -0,0 +1,254 @@
+# imports.py
+"""
+Streaming item manifest imports.
+
+The upload endpoint only stores the file under IMPORT_UPLOAD_DIR (with its
+SHA-256) and queues an ItemImport; `manage.py process_item_imports` claims
+queued imports with a conditional UPDATE and runs them outside any HTTP
+request. Files are read row by row, validated and inserted one chunk at a
+time via items.bulk, and the ItemImport progress row is updated in the same
+transaction as each chunk so an interrupted import can be resumed.
+"""
+import csv
+import hashlib
+import io
+import json
+import os
+import uuid
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .bulk import validate_item_rows, bulk_insert_items
+from .models import ItemImport
+
+IMPORT_CHUNK_SIZE = 1000
+MAX_IMPORT_CHUNK_SIZE = 5000
+# Only the first errors are stored on the import; error_count keeps the total.
+MAX_STORED_IMPORT_ERRORS = 1000
+
+ENCODER_STATE_COLUMNS = ['token_type', 'token_value', 'secret_key', 'starting_code', 'max_count', 'token']
+
+# Must be shared by the web and worker processes
+IMPORT_UPLOAD_DIR = Path(getattr(settings, 'ITEM_IMPORT_UPLOAD_DIR', settings.BASE_DIR / 'imports'))
+# An in_progress import not touched for this long has lost its worker;
+# every committed chunk refreshes updated_at
+IMPORT_STALE_AFTER = timedelta(minutes=10)
+
+
+class ImportFileError(Exception):
+    pass
+
+
+class ImportBusy(Exception):
+    """The import is already queued or being processed."""
+
+
+def detect_file_format(file_name, requested_format=None):
+    if requested_format:
+        requested_format = requested_format.lower()
+        if requested_format not in dict(ItemImport.FORMAT_CHOICES):
+            raise ImportFileError("format must be either 'csv' or 'ndjson'.")
+        return requested_format
+    name = (file_name or '').lower()
+    if name.endswith('.csv'):
+        return 'csv'
+    if name.endswith(('.ndjson', '.jsonl')):
+        return 'ndjson'
+    raise ImportFileError("Could not detect file format. Pass format=csv or format=ndjson.")
+
+
+def csv_row_to_item_data(row):
+    """Map a flat manifest row onto the nested shape the bulk endpoint accepts."""
+    row = {key.strip(): (value.strip() if isinstance(value, str) else value)
+           for key, value in row.items() if key}
+    item_data = {'serial_number': row.get('serial_number') or None}
+    if row.get('fleet_id'):
+        item_data['fleet_id'] = row['fleet_id']
+    manufacturer = row.get('manufacturers') or row.get('manufacturer_id')
+    if manufacturer:
+        item_data['manufacturers'] = manufacturer
+    encoder_state = {
+        column: row[column] for column in ENCODER_STATE_COLUMNS if row.get(column)
+    }
+    if encoder_state:
+        item_data['encoder_state'] = encoder_state
+    return item_data
+
+
+def iter_rows(path, file_format):
+    """
+    Yield (index, item_data) for every data row without reading the whole
+    file. Rows that cannot be parsed yield an ImportFileError as item_data.
+    """
+    with open(path, encoding='utf-8-sig', newline='') as text:
+        if file_format == 'csv':
+            reader = csv.DictReader(text)
+            if not reader.fieldnames or 'serial_number' not in [f.strip() for f in reader.fieldnames]:
+                raise ImportFileError("CSV header must include a serial_number column.")
+            for index, row in enumerate(reader):
+                yield index, csv_row_to_item_data(row)
+        else:
+            index = 0
+            for line in text:
+                if not line.strip():
+                    continue
+                try:
+                    yield index, json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield index, ImportFileError(f"Invalid JSON: {e.msg}")
+                index += 1
+
+
+def import_file_path(item_import):
+    return IMPORT_UPLOAD_DIR / f"{item_import.pk}.{item_import.file_format}"
+
+
+def store_upload(uploaded_file):
+    """Copy `uploaded_file` to a temporary file in IMPORT_UPLOAD_DIR. Returns (path, sha256)."""
+    IMPORT_UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+    path = IMPORT_UPLOAD_DIR / f"upload-{uuid.uuid4().hex}.tmp"
+    digest = hashlib.sha256()
+    with open(path, 'wb') as f:
+        for data in uploaded_file.chunks():
+            digest.update(data)
+            f.write(data)
+    return path, digest.hexdigest()
+
+
+def queue_import(distributor, uploaded_file, file_format, chunk_size):
+    """Store `uploaded_file` and queue a new import of it."""
+    tmp_path, sha256 = store_upload(uploaded_file)
+    try:
+        # The worker can't see the row before its file is in place
+        with transaction.atomic():
+            item_import = ItemImport.objects.create(
+                distributor=distributor,
+                file_name=uploaded_file.name[:255],
+                file_format=file_format,
+                file_sha256=sha256,
+                chunk_size=chunk_size,
+            )
+            os.replace(tmp_path, import_file_path(item_import))
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    return item_import
+
+
+def abandoned(now=None):
+    return Q(status='in_progress', updated_at__lt=(now or timezone.now()) - IMPORT_STALE_AFTER)
+
+
+def requeue_import(item_import, uploaded_file):
+    """
+    Queue a failed or abandoned import again with its re-uploaded file.
+    Raises ImportFileError if the file differs from the original upload
+    and ImportBusy if the import is already queued or running.
+    """
+    tmp_path, sha256 = store_upload(uploaded_file)
+    try:
+        if sha256 != item_import.file_sha256:
+            raise ImportFileError("The file does not match the one originally uploaded for this import.")
+        # Same content, so replacing it under a running worker is harmless
+        os.replace(tmp_path, import_file_path(item_import))
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+    now = timezone.now()
+    requeued = ItemImport.objects.filter(Q(status='failed') | abandoned(now), pk=item_import.pk).update(
+        status='queued', detail='', updated_at=now
+    )
+    if not requeued:
+        raise ImportBusy("This import is already queued or running.")
+    item_import.refresh_from_db()
+    return item_import
+
+
+def commit_chunk(item_import, user, chunk):
+    """Validate, insert and record progress for one chunk atomically."""
+    errors = [
+        {"index": idx, "error": str(item_data)}
+        for idx, item_data in chunk if isinstance(item_data, ImportFileError)
+    ]
+    rows = [(idx, item_data) for idx, item_data in chunk if not isinstance(item_data, ImportFileError)]
+
+    with transaction.atomic():
+        valid, validation_errors = validate_item_rows(user, rows)
+        created_ids, insert_errors = bulk_insert_items(valid, chunk_size=max(len(valid), 1))
+        errors = sorted(errors + validation_errors + insert_errors, key=lambda error: error["index"])
+
+        item_import.rows_committed = chunk[-1][0] + 1
+        item_import.created_count += len(created_ids)
+        item_import.error_count += len(errors)
+        room = MAX_STORED_IMPORT_ERRORS - len(item_import.errors)
+        if room > 0:
+            item_import.errors = item_import.errors + errors[:room]
+        item_import.save(update_fields=[
+            'rows_committed', 'created_count', 'error_count', 'errors', 'updated_at'
+        ])
+
+
+def run_import(item_import):
+    """
+    Stream the stored file of `item_import` into items, skipping rows
+    already committed by a previous attempt.
+    """
+    path = import_file_path(item_import)
+    chunk = []
+    try:
+        if not path.exists():
+            raise ImportFileError("The uploaded file is no longer available. Start a new import.")
+        for index, item_data in iter_rows(path, item_import.file_format):
+            if index < item_import.rows_committed:
+                continue
+            chunk.append((index, item_data))
+            if len(chunk) >= item_import.chunk_size:
+                commit_chunk(item_import, item_import.distributor, chunk)
+                chunk = []
+        if chunk:
+            commit_chunk(item_import, item_import.distributor, chunk)
+    except (ImportFileError, UnicodeDecodeError, csv.Error) as e:
+        item_import.status = 'failed'
+        item_import.detail = str(e)
+    except Exception as e:
+        # Committed chunks stay; the import can be resumed with the same file
+        item_import.status = 'failed'
+        item_import.detail = f"Stopped after {item_import.rows_committed} rows: {e}"
+    else:
+        item_import.status = 'completed'
+        item_import.detail = ''
+        path.unlink(missing_ok=True)
+    item_import.save(update_fields=['status', 'detail', 'updated_at'])
+    return item_import
+
+
+def claim_import(item_import):
+    """Move a queued or abandoned import to in_progress. False if another worker got it first."""
+    now = timezone.now()
+    return bool(
+        ItemImport.objects.filter(Q(status='queued') | abandoned(now), pk=item_import.pk)
+        .update(status='in_progress', updated_at=now)
+    )
+
+
+def process_queued_imports(limit=None):
+    """Run queued (and abandoned) imports oldest first. Returns how many were run."""
+    pending = (
+        ItemImport.objects.filter(Q(status='queued') | abandoned())
+        .select_related('distributor').order_by('pk')
+    )
+    if limit is not None:
+        pending = pending[:limit]
+
+    processed = 0
+    for item_import in list(pending):
+        if not claim_import(item_import):
+            continue
+        item_import.refresh_from_db()
+        run_import(item_import)
+        processed += 1
+    return processed
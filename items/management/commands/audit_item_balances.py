@@ -0,0 +1,145 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import (
+    Case, DecimalField, Exists, ExpressionWrapper, F, FloatField, OuterRef, Q, Subquery, Sum, Value, When,
+)
+from django.db.models.functions import Coalesce, Round
+from django.utils import timezone
+
+from items.models import Fleet, Item
+from items.status import items_in_scope, ledger_total_paid
+from payments.models import GeneratedCode, PaymentPlan, TokenRequest
+
+# Balances are compared with this tolerance, as SQLite sums decimals as floats
+DRIFT_TOLERANCE = Decimal('0.005')
+MONEY = DecimalField(max_digits=12, decimal_places=2)
+
+
+def interval_debit(plan):
+    """
+    Amount an interval token debited from the balance: its days converted
+    back to whole intervals of the plan at `plan` (a relation path), times
+    the plan's interval amount (see handle_interval_payment).
+    """
+    days = Case(
+        *[When(**{f'{plan}__interval_type__iexact': interval_type}, then=Value(float(days)))
+          for interval_type, days in PaymentPlan.INTERVAL_DAYS.items()],
+        default=Value(1.0),
+        output_field=FloatField(),
+    )
+    return ExpressionWrapper(
+        F(f'{plan}__interval_amount') * Round(F('token_value') / days),
+        output_field=MONEY,
+    )
+
+
+def legacy_codes():
+    """
+    ADD_TIME codes issued before the TokenRequest outbox, which debited the
+    balance without recording which payment (or manual request) they were for.
+    """
+    return GeneratedCode.objects.filter(item=OuterRef('pk'), token_type='ADD_TIME', token_requests__isnull=True)
+
+
+def ledger_balance_annotations():
+    """
+    Subqueries deriving each item's expected balance from its history.
+    Legacy codes are counted as interval debits on the item's current plan,
+    which is only an estimate; has_legacy_codes marks the items concerned.
+    """
+    debits = (
+        TokenRequest.objects.filter(
+            item=OuterRef('pk'), payment__isnull=False, is_completion=False, token_type='ADD_TIME'
+        )
+        # Failed requests were credited back (refund_token_debit)
+        .exclude(status='failed')
+        .order_by().values('item')
+        .annotate(total=Sum(interval_debit('payment__payment_plan'))).values('total')
+    )
+    legacy_debits = (
+        legacy_codes().order_by().values('item')
+        .annotate(total=Sum(interval_debit('item__payment_plan'))).values('total')
+    )
+    ledger_paid = ledger_total_paid()
+    ledger_debited = ExpressionWrapper(
+        Coalesce(Subquery(debits), Value(Decimal('0.00')), output_field=MONEY)
+        + Coalesce(Subquery(legacy_debits), Value(Decimal('0.00')), output_field=MONEY),
+        output_field=MONEY,
+    )
+    return {
+        'ledger_paid': ledger_paid,
+        'ledger_debited': ledger_debited,
+        'expected_balance': ExpressionWrapper(ledger_paid - ledger_debited, output_field=MONEY),
+        'has_legacy_codes': Exists(legacy_codes()),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Check Item.balance against the balance implied by the item's payments "
+        "less the intervals debited for its payment tokens, and optionally repair it."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fleet', type=int, help="Only audit items in this fleet.")
+        parser.add_argument('--distributor', type=int, help="Only audit items in this distributor's fleets.")
+        parser.add_argument(
+            '--limit', type=int, default=50,
+            help="Maximum number of drifted items to print."
+        )
+        parser.add_argument(
+            '--repair', action='store_true',
+            help="Set the balance of drifted items to the expected balance. Items with codes issued "
+                 "before the token outbox are only reported."
+        )
+
+    def handle(self, *args, **options):
+        scope = {}
+        if options['fleet'] is not None:
+            if not Fleet.objects.filter(pk=options['fleet']).exists():
+                raise CommandError(f"Fleet {options['fleet']} does not exist.")
+            scope['fleet'] = options['fleet']
+        if options['distributor'] is not None:
+            scope['distributor'] = options['distributor']
+
+        drifted = (
+            items_in_scope(**scope)
+            .annotate(**ledger_balance_annotations())
+            .annotate(drift=ExpressionWrapper(F('balance') - F('expected_balance'), output_field=MONEY))
+            .filter(Q(drift__gt=DRIFT_TOLERANCE) | Q(drift__lt=-DRIFT_TOLERANCE))
+            .order_by('pk')
+        )
+
+        count = legacy = 0
+        for item in drifted.values(
+            'pk', 'serial_number', 'balance', 'expected_balance', 'ledger_paid', 'ledger_debited', 'has_legacy_codes'
+        ).iterator(chunk_size=2000):
+            count += 1
+            legacy += item['has_legacy_codes']
+            if count <= options['limit']:
+                self.stdout.write(
+                    f"Item {item['pk']} ({item['serial_number']}): balance={item['balance']} "
+                    f"expected={item['expected_balance']} (paid {item['ledger_paid']}, "
+                    f"debited {item['ledger_debited']})"
+                    + (" [pre-outbox codes, estimated]" if item['has_legacy_codes'] else "")
+                )
+
+        if not count:
+            self.stdout.write(self.style.SUCCESS("All item balances match the payment ledger."))
+            return
+        if not options['repair']:
+            raise CommandError(f"{count} items have drifted balances. Run with --repair to fix.")
+
+        # Codes issued before the outbox may have been manual tokens that
+        # debited nothing, so those balances are only reported
+        with transaction.atomic():
+            repaired = Item.objects.filter(
+                pk__in=Subquery(drifted.filter(has_legacy_codes=False).values('pk'))
+            ).update(balance=ledger_balance_annotations()['expected_balance'], updated_at=timezone.now())
+        self.stdout.write(self.style.SUCCESS(f"Repaired the balance of {repaired} items."))
+        if legacy:
+            self.stdout.write(self.style.WARNING(
+                f"Skipped {legacy} items with codes issued before the token outbox; check them by hand."
+            ))
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from items.imports import process_queued_imports
+
+
+class Command(BaseCommand):
+    help = (
+        "Run queued item manifest imports (and resume ones whose worker died). "
+        "Run once (e.g. from cron) or with --loop."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help="Keep polling for queued imports.")
+        parser.add_argument('--interval', type=float, default=5.0, help="Seconds between polls with --loop.")
+        parser.add_argument('--limit', type=int, default=None, help="Process at most this many imports per pass.")
+
+    def handle(self, *args, **options):
+        while True:
+            processed = process_queued_imports(limit=options['limit'])
+            if processed or not options['loop']:
+                self.stdout.write(f"Processed {processed} import(s).")
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,46 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from items.models import Fleet
+from items.status import recompute_statuses_for
+from payments.models import PaymentPlan
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute Item.status for every item of a payment plan, fleet or "
+        "distributor (or all items) with a single UPDATE."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--plan', type=int, help="Only items on this payment plan.")
+        parser.add_argument('--fleet', type=int, help="Only items in this fleet.")
+        parser.add_argument('--distributor', type=int, help="Only items in this distributor's fleets.")
+        parser.add_argument(
+            '--from-ledger', action='store_true',
+            help="Sum each item's payments instead of trusting Item.total_paid."
+        )
+
+    def handle(self, *args, **options):
+        scope = {}
+        if options['plan'] is not None:
+            scope['plan'] = self.lookup(PaymentPlan.all_objects, options['plan'], 'Payment plan')
+        if options['fleet'] is not None:
+            scope['fleet'] = self.lookup(Fleet.objects, options['fleet'], 'Fleet')
+        if options['distributor'] is not None:
+            scope['distributor'] = self.lookup(
+                get_user_model().objects.filter(user_type='DISTRIBUTOR'), options['distributor'], 'Distributor'
+            )
+
+        started = time.monotonic()
+        changed = recompute_statuses_for(from_ledger=options['from_ledger'], **scope)
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(f"Updated the status of {changed} items in {elapsed:.2f}s."))
+
+    def lookup(self, queryset, pk, label):
+        try:
+            return queryset.get(pk=pk)
+        except queryset.model.DoesNotExist:
+            raise CommandError(f"{label} {pk} does not exist.")
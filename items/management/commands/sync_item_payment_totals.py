@@ -0,0 +1,80 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, F, Max, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from items.models import Item
+from items.status import ledger_total_paid
+from payments.models import Payment
+
+
+def payment_history_annotations():
+    """Subqueries recomputing Item.total_paid/payments_count/last_payment_at from payments."""
+    payments = Payment.objects.filter(item=OuterRef('pk')).order_by().values('item')
+    return {
+        'expected_total_paid': ledger_total_paid(),
+        'expected_payments_count': Coalesce(
+            Subquery(payments.annotate(total=Count('pk')).values('total')),
+            Value(0),
+        ),
+        'expected_last_payment_at': Subquery(payments.annotate(last=Max('paid_at')).values('last')),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Backfill Item.total_paid, payments_count and last_payment_at from the "
+        "payment history, or check them with --verify."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify', action='store_true',
+            help="Only report items whose running totals disagree with their payments."
+        )
+        parser.add_argument(
+            '--limit', type=int, default=50,
+            help="Maximum number of drifted items to print with --verify."
+        )
+
+    def handle(self, *args, **options):
+        if options['verify']:
+            return self.verify(options['limit'])
+
+        annotations = payment_history_annotations()
+        updated = Item.objects.update(
+            total_paid=annotations['expected_total_paid'],
+            payments_count=annotations['expected_payments_count'],
+            last_payment_at=annotations['expected_last_payment_at'],
+            updated_at=timezone.now(),
+        )
+        self.stdout.write(self.style.SUCCESS(f"Recomputed payment totals for {updated} items."))
+
+    def verify(self, limit):
+        drifted = (
+            Item.objects.annotate(**payment_history_annotations())
+            .filter(
+                ~Q(total_paid=F('expected_total_paid')) |
+                ~Q(payments_count=F('expected_payments_count')) |
+                # Negating an equality would also match NULL = NULL, so
+                # compare both ways and check the NULL mismatches on their own
+                Q(last_payment_at__lt=F('expected_last_payment_at')) |
+                Q(last_payment_at__gt=F('expected_last_payment_at')) |
+                Q(last_payment_at__isnull=True, expected_last_payment_at__isnull=False) |
+                Q(last_payment_at__isnull=False, expected_last_payment_at__isnull=True)
+            )
+            .order_by('pk')
+        )
+        count = 0
+        for item in drifted.iterator(chunk_size=2000):
+            count += 1
+            if count <= limit:
+                self.stdout.write(
+                    f"Item {item.pk} ({item.serial_number}): total_paid={item.total_paid} "
+                    f"expected={item.expected_total_paid}, payments_count={item.payments_count} "
+                    f"expected={item.expected_payments_count}, last_payment_at={item.last_payment_at} "
+                    f"expected={item.expected_last_payment_at}"
+                )
+        if count:
+            raise CommandError(f"{count} items have drifted payment totals. Run without --verify to fix.")
+        self.stdout.write(self.style.SUCCESS("All item payment totals match the payment history."))
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:29
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Count, DecimalField, Max, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_payment_totals(apps, schema_editor):
+    Item = apps.get_model('items', 'Item')
+    Payment = apps.get_model('payments', 'Payment')
+
+    payments = Payment.objects.filter(item=OuterRef('pk'), deleted_status=False).order_by().values('item')
+    Item.objects.update(
+        total_paid=Coalesce(
+            Subquery(payments.annotate(total=Sum('amount_paid')).values('total')),
+            Value(Decimal('0.00')),
+            output_field=DecimalField(max_digits=12, decimal_places=2),
+        ),
+        payments_count=Coalesce(Subquery(payments.annotate(total=Count('pk')).values('total')), Value(0)),
+        last_payment_at=Subquery(payments.annotate(last=Max('paid_at')).values('last')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('items', '0014_itemimport'),
+        ('payments', '0008_generatedcode_deleted_at_payment_deleted_at_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='last_payment_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='payments_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='total_paid',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12),
+        ),
+        migrations.RunPython(backfill_payment_totals, migrations.RunPython.noop),
+    ]
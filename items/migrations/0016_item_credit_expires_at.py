@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:57
+
+from datetime import timedelta
+
+from django.db import migrations, models
+
+
+def backfill_credit_expiry(apps, schema_editor):
+    """Replay each item's issued codes once, oldest first."""
+    Item = apps.get_model('items', 'Item')
+    GeneratedCode = apps.get_model('payments', 'GeneratedCode')
+
+    expiries = {}
+    codes = (
+        GeneratedCode.objects.filter(deleted_status=False)
+        .order_by('item_id', 'created_at', 'id')
+        .values_list('item_id', 'token_type', 'token_value', 'created_at')
+    )
+    for item_id, token_type, token_value, issued_at in codes.iterator(chunk_size=2000):
+        current = expiries.get(item_id)
+        if token_type == 'ADD_TIME':
+            expiries[item_id] = max(current or issued_at, issued_at) + timedelta(days=token_value or 0)
+        elif token_type == 'SET_TIME':
+            expiries[item_id] = issued_at + timedelta(days=token_value or 0)
+        elif token_type == 'DISABLE_PAYG':
+            expiries[item_id] = None
+
+    items = [Item(pk=item_id, credit_expires_at=expiry) for item_id, expiry in expiries.items() if expiry]
+    Item.objects.bulk_update(items, ['credit_expires_at'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clients', '0004_customer_updated_at'),
+        ('items', '0015_item_payment_totals'),
+        ('payments', '0013_dailyrevenuerollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='credit_expires_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['fleet', 'credit_expires_at'], name='items_item_fleet_i_649941_idx'),
+        ),
+        migrations.RunPython(backfill_credit_expiry, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('items', '0016_item_credit_expires_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='itemimport',
+            name='file_sha256',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AlterField(
+            model_name='itemimport',
+            name='status',
+            field=models.CharField(choices=[('queued', 'Queued'), ('in_progress', 'In Progress'), ('completed', 'Completed'), ('failed', 'Failed')], default='queued', max_length=20),
+        ),
+    ]
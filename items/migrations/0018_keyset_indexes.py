@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clients', '0005_keyset_indexes'),
+        ('items', '0017_itemimport_file_sha256'),
+        ('payments', '0014_payment_fleet'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['fleet', '-created_at', '-id'], name='item_fleet_created_idx'),
+        ),
+    ]
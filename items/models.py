@@ -109,16 +109,38 @@ class Item(BaseModel):
         on_delete=models.SET_NULL,
         related_name='item_payment_plan'
     )
+    # Running totals maintained by payments.views.create_payment_record,
+    # so the payment path never has to aggregate the payment history.
+    # Backfill/verify with `manage.py sync_item_payment_totals`.
+    total_paid = models.DecimalField(
+        max_digits=12,
+        decimal_places=2,
+        default=Decimal('0.00')
+    )
+    payments_count = models.PositiveIntegerField(default=0)
+    last_payment_at = models.DateTimeField(null=True, blank=True)
+    # When the unit's credit runs out, maintained by payments.tokens as
+    # tokens are issued: ADD_TIME extends it, SET_TIME resets it and
+    # DISABLE_PAYG clears it (the unit never locks again).
+    credit_expires_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['fleet', 'credit_expires_at']),
+            # Serves the keyset-paged item lists of a fleet, newest first
+            models.Index(fields=['fleet', '-created_at', '-id'], name='item_fleet_created_idx'),
+        ]
 
 
     def __str__(self):
         return f"Item {self.serial_number}"
     
     def calculate_total_paid(self):
+        """Aggregate the payment history. Use `total_paid` on hot paths."""
         return self.payments.aggregate(total_paid=models.Sum('amount_paid'))['total_paid'] or Decimal('0.00')
 
     def update_status(self):
-        total_paid = self.calculate_total_paid()
+        total_paid = self.total_paid
         if self.payment_plan:
             if total_paid >= self.payment_plan.total_amount:
                 self.status = 'fully_paid'
@@ -126,4 +148,44 @@ class Item(BaseModel):
                 self.status = 'partially_paid'
             else:
                 self.status = 'pending'
-            self.save()
\ No newline at end of file
+            self.save(update_fields=['status', 'updated_at'])
+
+class ItemImport(BaseModel):
+    """
+    Progress of a streamed item manifest upload (CSV or NDJSON).
+
+    Uploads are stored and queued; `manage.py process_item_imports` claims
+    and runs them outside the request. `rows_committed` only moves forward
+    together with the chunk it covers, so re-uploading the same file (checked
+    against `file_sha256`) with this import's id resumes right after the
+    last committed chunk.
+    """
+    FORMAT_CHOICES = [
+        ('csv', 'CSV'),
+        ('ndjson', 'NDJSON'),
+    ]
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('in_progress', 'In Progress'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+
+    distributor = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='item_imports'
+    )
+    file_name = models.CharField(max_length=255, blank=True)
+    file_format = models.CharField(max_length=10, choices=FORMAT_CHOICES)
+    file_sha256 = models.CharField(max_length=64, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    chunk_size = models.PositiveIntegerField(default=1000)
+    rows_committed = models.PositiveIntegerField(default=0)
+    created_count = models.PositiveIntegerField(default=0)
+    error_count = models.PositiveIntegerField(default=0)
+    errors = models.JSONField(default=list, blank=True)
+    detail = models.TextField(blank=True)
+
+    def __str__(self):
+        return f"Import {self.pk} ({self.file_name}) by {self.distributor}"
@@ -1,6 +1,6 @@
 # serializers.py
 from rest_framework import serializers
-from .models import Manufacturer, Fleet, Item, EncoderState
+from .models import Manufacturer, Fleet, Item, EncoderState, ItemImport
 from users.serializers import UserSerializer
 from django.contrib.auth import get_user_model
 from clients.serializers import CustomerSerializer
@@ -62,10 +62,27 @@ class ItemSerializer(serializers.ModelSerializer):
             'customer',
             'status',
             'payment_plan',
+            'credit_expires_at',
             'created_at', 
             'updated_at'
             ]
+        # Maintained as tokens are issued
+        read_only_fields = ['credit_expires_at']
     
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """
+        Join every relation to_representation() touches so a list costs one
+        query instead of one per nested serializer per row.
+        """
+        return queryset.select_related(
+            'manufacturers',
+            'customer',
+            'payment_plan',
+            'fleet__assigned_agent',
+            'encoder_state',
+        )
+
     def validate_fleet(self, value):
         """Ensure the user owns the fleet if provided"""
         user = self.context['request'].user
@@ -122,4 +139,14 @@ class ItemSerializer(serializers.ModelSerializer):
                 # Create new encoder state if none exists
                 EncoderState.objects.create(item=instance, **encoder_state_data)
 
-        return instance
\ No newline at end of file
+        return instance
+
+class ItemImportSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ItemImport
+        fields = [
+            'id', 'file_name', 'file_format', 'status', 'chunk_size',
+            'rows_committed', 'created_count', 'error_count', 'errors',
+            'detail', 'created_at', 'updated_at'
+        ]
+        read_only_fields = fields
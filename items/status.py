@@ -0,0 +1,86 @@
+# status.py
+"""
+Set-based Item.status recomputation.
+
+Mirrors Item.update_status() for many items in one UPDATE: items with a
+payment plan are fully_paid once total_paid reaches the plan's
+total_amount, partially_paid with any payment, pending otherwise. Items
+without a plan are left alone, as update_status() does.
+
+By default the running Item.total_paid is compared; ledger_total_paid()
+derives the total from the payments themselves instead, for repairs.
+"""
+from decimal import Decimal
+
+from django.db.models import Case, CharField, DecimalField, F, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.db.models.lookups import GreaterThan, GreaterThanOrEqual
+from django.utils import timezone
+
+from payments.models import Payment, PaymentPlan
+
+from .models import Item
+
+
+def ledger_total_paid():
+    """Sum of the item's payments, as a correlated subquery on the item's pk."""
+    payments = Payment.objects.filter(item=OuterRef('pk')).order_by().values('item')
+    return Coalesce(
+        Subquery(payments.annotate(total=Sum('amount_paid')).values('total')),
+        Value(Decimal('0.00')),
+        output_field=DecimalField(max_digits=12, decimal_places=2),
+    )
+
+
+def status_expression(total_paid):
+    """CASE expression deriving the status from `total_paid` (an expression)."""
+    plan_total = Subquery(
+        PaymentPlan.all_objects.filter(pk=OuterRef('payment_plan_id')).values('total_amount')[:1]
+    )
+    return Case(
+        When(GreaterThanOrEqual(total_paid, plan_total), then=Value('fully_paid')),
+        When(GreaterThan(total_paid, Value(Decimal('0.00'))), then=Value('partially_paid')),
+        default=Value('pending'),
+        output_field=CharField(),
+    )
+
+
+def recompute_item_statuses(items, total_paid=None):
+    """
+    Recompute the status of every item in the `items` queryset with one
+    UPDATE, touching only rows whose status changes. `total_paid` defaults
+    to the running total kept on the item. Returns the number of items
+    whose status changed.
+    """
+    status = status_expression(total_paid if total_paid is not None else F('total_paid'))
+    changed = (
+        items.order_by().filter(payment_plan__isnull=False)
+        .annotate(new_status=status)
+        .exclude(status=F('new_status'))
+        .values('pk')
+    )
+    return Item.all_objects.filter(pk__in=Subquery(changed)).update(
+        status=status, updated_at=timezone.now()
+    )
+
+
+def items_in_scope(plan=None, fleet=None, distributor=None):
+    """Live items on a payment plan, in a fleet and/or of a distributor's fleets."""
+    items = Item.objects.all()
+    if plan is not None:
+        items = items.filter(payment_plan=plan)
+    if fleet is not None:
+        items = items.filter(fleet=fleet)
+    if distributor is not None:
+        items = items.filter(fleet__distributor=distributor)
+    return items
+
+
+def recompute_statuses_for(plan=None, fleet=None, distributor=None, from_ledger=False):
+    """
+    Recompute the statuses of every item of a plan, fleet or distributor.
+    With `from_ledger`, totals are summed from the payments rather than read
+    from Item.total_paid. Returns the number of items whose status changed.
+    """
+    items = items_in_scope(plan=plan, fleet=fleet, distributor=distributor)
+    return recompute_item_statuses(items, total_paid=ledger_total_paid() if from_ledger else None)
@@ -1,3 +1,423 @@
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from clients.models import Customer
+from payments.models import PaymentPlan
+from .bulk import bulk_insert_items, validate_item_rows
+from .imports import commit_chunk
+from .models import Manufacturer, Fleet, Item, EncoderState, ItemImport
+
+User = get_user_model()
+
+
+class ItemListQueryCountTests(TestCase):
+    """
+    Listing items must cost a constant number of queries no matter how many
+    rows come back (no per-row lookups for nested serializers).
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.distributor = User.objects.create_user(
+            email='distributor@example.com', password='pass', user_type='DISTRIBUTOR'
+        )
+        cls.agent = User.objects.create_user(
+            email='agent@example.com', password='pass', user_type='AGENT',
+            distributor=cls.distributor
+        )
+        cls.fleet = Fleet.objects.create(
+            name='Fleet A', distributor=cls.distributor, assigned_agent=cls.agent
+        )
+        cls.manufacturer = Manufacturer.objects.create(name='Maker', distributor=cls.distributor)
+        cls.plan = PaymentPlan.objects.create(
+            distributor=cls.distributor, name='Daily', total_amount=Decimal('1000.00'),
+            interval_type='daily', interval_amount=Decimal('10.00')
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def create_items(self, count):
+        for _ in range(count):
+            n = Item.all_objects.count()
+            customer = Customer.objects.create(
+                name=f'Customer {n}', email=f'c{n}@example.com', phone_number=f'0700{n:06d}',
+                distributor=self.distributor, assigned_agent=self.agent
+            )
+            item = Item.objects.create(
+                serial_number=f'SN{n:06d}', fleet=self.fleet, customer=customer,
+                manufacturers=self.manufacturer, payment_plan=self.plan
+            )
+            EncoderState.objects.create(item=item, secret_key='key', starting_code='123', max_count=1)
+
+    def count_list_queries(self, user, url):
+        self.client.force_authenticate(user)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries), response
+
+    def assert_constant_queries(self, user, url):
+        self.create_items(2)
+        small, response = self.count_list_queries(user, url)
+        self.assertEqual(len(response.data), 2)
+
+        self.create_items(20)
+        large, response = self.count_list_queries(user, url)
+        self.assertEqual(len(response.data), 22)
+        self.assertEqual(small, large)
+
+        row = response.data[0]
+        self.assertEqual(row['fleet']['assigned_agent']['id'], self.agent.id)
+        self.assertEqual(row['payment_plan']['id'], self.plan.id)
+        self.assertEqual(row['manufacturers']['id'], self.manufacturer.id)
+        self.assertIsNotNone(row['customer'])
+        self.assertIsNotNone(row['encoder_state'])
+
+    def test_distributor_item_list(self):
+        self.assert_constant_queries(self.distributor, '/api/items/')
+
+    def test_agent_item_list(self):
+        self.assert_constant_queries(self.agent, '/api/items/')
+
+    def test_fleet_item_list(self):
+        self.assert_constant_queries(self.distributor, f'/api/fleets/{self.fleet.id}/items/')
+
+
+class ExpiringItemsTests(TestCase):
+
+    def setUp(self):
+        self.distributor = User.objects.create_user(
+            email='distributor@example.com', password='pass', user_type='DISTRIBUTOR'
+        )
+        self.agent = User.objects.create_user(
+            email='agent@example.com', password='pass', user_type='AGENT', distributor=self.distributor
+        )
+        agent_fleet = Fleet.objects.create(name='Fleet A', distributor=self.distributor, assigned_agent=self.agent)
+        self.other_fleet = Fleet.objects.create(name='Fleet B', distributor=self.distributor)
+        now = timezone.now()
+        self.soon = Item.objects.create(
+            serial_number='SN000001', fleet=agent_fleet, credit_expires_at=now + timedelta(days=2)
+        )
+        self.sooner = Item.objects.create(
+            serial_number='SN000002', fleet=self.other_fleet, credit_expires_at=now + timedelta(hours=5)
+        )
+        Item.objects.create(serial_number='SN000003', fleet=agent_fleet, credit_expires_at=now + timedelta(days=10))
+        Item.objects.create(serial_number='SN000004', fleet=agent_fleet, credit_expires_at=now - timedelta(days=1))
+        Item.objects.create(serial_number='SN000005', fleet=agent_fleet)
+        self.client = APIClient()
+
+    def ids(self, user, params=None):
+        self.client.force_authenticate(user)
+        response = self.client.get('/api/items/expiring/', params or {})
+        self.assertEqual(response.status_code, 200)
+        rows = response.data['results'] if 'results' in response.data else response.data
+        return [row['id'] for row in rows]
+
+    def test_lists_upcoming_expiries_soonest_first(self):
+        self.assertEqual(self.ids(self.distributor), [self.sooner.id, self.soon.id])
+        self.assertEqual(self.ids(self.distributor, {'fleet_id': self.other_fleet.id}), [self.sooner.id])
+        self.assertEqual(self.ids(self.distributor, {'agent_id': self.agent.id}), [self.soon.id])
+        self.assertEqual(self.ids(self.agent), [self.soon.id])
+        self.assertEqual(len(self.ids(self.distributor, {'days': 30})), 3)
+
+    def test_pages_in_expiry_order(self):
+        self.client.force_authenticate(self.distributor)
+        first = self.client.get('/api/items/expiring/', {'page_size': 1})
+        self.assertEqual([row['id'] for row in first.data['results']], [self.sooner.id])
+        second = self.client.get('/api/items/expiring/', {'page_size': 1, 'cursor': first.data['next_cursor']})
+        self.assertEqual([row['id'] for row in second.data['results']], [self.soon.id])
+        self.assertEqual(self.client.get('/api/items/expiring/', {'days': 0}).status_code, 400)
+
+
+class BulkCreateItemsTests(TestCase):
+
+    def setUp(self):
+        self.distributor = User.objects.create_user(
+            email='distributor@example.com', password='pass', user_type='DISTRIBUTOR'
+        )
+        other = User.objects.create_user(email='other@example.com', password='pass', user_type='DISTRIBUTOR')
+        self.fleet = Fleet.objects.create(name='Fleet A', distributor=self.distributor)
+        self.foreign_fleet = Fleet.objects.create(name='Fleet B', distributor=other)
+        self.customer = Customer.objects.create(
+            name='Customer', email='c@example.com', phone_number='0700000001', distributor=self.distributor
+        )
+        self.plan = PaymentPlan.objects.create(
+            distributor=self.distributor, name='Daily', total_amount=Decimal('1000.00'),
+            interval_type='daily', interval_amount=Decimal('10.00')
+        )
+        Item.objects.create(serial_number='EXISTING', fleet=self.fleet)
+        self.client = APIClient()
+        self.client.force_authenticate(self.distributor)
+
+    def post(self, items):
+        return self.client.post('/api/items/bulk_create/', {'items': items}, format='json')
+
+    def test_keeps_every_validated_field(self):
+        response = self.post([{
+            'serial_number': 'SN1', 'fleet_id': self.fleet.id, 'customer': self.customer.id,
+            'payment_plan': self.plan.id, 'status': 'partially_paid',
+            'encoder_state': {'secret_key': 'key', 'starting_code': '123', 'max_count': 1},
+        }])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['errors'], [])
+        item = Item.objects.get(serial_number='SN1')
+        self.assertEqual(
+            (item.fleet_id, item.customer_id, item.payment_plan_id, item.status),
+            (self.fleet.id, self.customer.id, self.plan.id, 'partially_paid')
+        )
+        self.assertEqual(item.encoder_state.secret_key, 'key')
+        self.assertEqual(Item.objects.get(serial_number='EXISTING').status, 'pending')
+
+    def test_reports_invalid_rows_by_index(self):
+        response = self.post([
+            {'serial_number': 'SN1', 'fleet_id': self.fleet.id},
+            {'serial_number': '', 'fleet_id': self.fleet.id},
+            {'serial_number': 'EXISTING', 'fleet_id': self.fleet.id},
+            {'serial_number': 'SN1', 'fleet_id': self.fleet.id},
+            {'serial_number': 'SN2', 'fleet_id': self.fleet.id, 'customer': 9999, 'payment_plan': 9999},
+            {'serial_number': 'SN3', 'fleet_id': self.fleet.id, 'status': 'stolen'},
+            {'serial_number': 'SN4', 'fleet_id': self.foreign_fleet.id},
+            'not a row',
+        ])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([item['serial_number'] for item in response.data['created_items']], ['SN1'])
+        errors = {error['index']: error['error'] for error in response.data['errors']}
+        self.assertEqual(sorted(errors), [1, 2, 3, 4, 5, 6, 7])
+        self.assertIn('serial_number', errors[1])
+        self.assertEqual(errors[2], {'serial_number': ['item with this serial number already exists.']})
+        self.assertEqual(errors[3], {'serial_number': ['Duplicate serial_number in this upload.']})
+        self.assertEqual(set(errors[4]), {'customer', 'payment_plan'})
+        self.assertIn('status', errors[5])
+        self.assertEqual(errors[6], f"You do not own fleet_id={self.foreign_fleet.id}")
+
+    def test_failed_chunk_is_retried_row_by_row(self):
+        rows = [(n, {'serial_number': f'SN{n}', 'fleet_id': self.fleet.id}) for n in range(4)]
+        valid, errors = validate_item_rows(self.distributor, rows)
+        self.assertEqual(errors, [])
+        # Inserted by someone else between validation and insert
+        Item.objects.create(serial_number='SN2', fleet=self.fleet)
+
+        created_ids, errors = bulk_insert_items(valid, chunk_size=10)
+        self.assertEqual(
+            sorted(Item.objects.filter(pk__in=created_ids).values_list('serial_number', flat=True)),
+            ['SN0', 'SN1', 'SN3']
+        )
+        self.assertEqual(errors, [{'index': 2, 'error': {'serial_number': ['item with this serial number already exists.']}}])
+
+
+class ItemImportTests(TestCase):
+
+    def setUp(self):
+        self.distributor = User.objects.create_user(
+            email='distributor@example.com', password='pass', user_type='DISTRIBUTOR'
+        )
+        self.fleet = Fleet.objects.create(name='Fleet A', distributor=self.distributor)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        patcher = mock.patch('items.imports.IMPORT_UPLOAD_DIR', Path(tmp.name))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = APIClient()
+        self.client.force_authenticate(self.distributor)
+
+    def manifest(self, serials):
+        rows = ['serial_number,fleet_id'] + [f'{serial},{self.fleet.id}' for serial in serials]
+        return ('\n'.join(rows) + '\n').encode()
+
+    def upload(self, content, **data):
+        data['file'] = SimpleUploadedFile('manifest.csv', content, content_type='text/csv')
+        return self.client.post('/api/items/import/', data, format='multipart')
+
+    def process(self):
+        call_command('process_item_imports', stdout=StringIO())
+
+    def test_upload_is_queued_and_processed_by_the_worker(self):
+        Item.objects.create(serial_number='SN1', fleet=self.fleet)
+        response = self.upload(self.manifest(['SN0', 'SN1', 'SN2', 'SN0', 'SN3']), chunk_size=2)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['status'], 'queued')
+        self.assertFalse(Item.objects.filter(serial_number='SN0').exists())
+
+        self.process()
+        item_import = ItemImport.objects.get(pk=response.data['id'])
+        self.assertEqual(item_import.status, 'completed')
+        self.assertEqual((item_import.rows_committed, item_import.created_count, item_import.error_count), (5, 3, 2))
+        self.assertEqual([error['index'] for error in item_import.errors], [1, 3])
+        self.assertEqual(Item.objects.filter(serial_number__in=['SN0', 'SN2', 'SN3']).count(), 3)
+
+    def test_failed_chunk_is_resumed_with_the_same_file(self):
+        content = self.manifest([f'SN{n}' for n in range(6)])
+        import_id = self.upload(content, chunk_size=2).data['id']
+
+        calls = []
+
+        def fail_second_chunk(item_import, user, chunk):
+            calls.append(chunk)
+            if len(calls) == 2:
+                raise RuntimeError("database went away")
+            commit_chunk(item_import, user, chunk)
+
+        with mock.patch('items.imports.commit_chunk', side_effect=fail_second_chunk):
+            self.process()
+        item_import = ItemImport.objects.get(pk=import_id)
+        self.assertEqual((item_import.status, item_import.rows_committed, item_import.created_count), ('failed', 2, 2))
+
+        response = self.upload(content, import_id=import_id)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['status'], 'queued')
+        self.assertEqual(self.upload(content, import_id=import_id).status_code, 409)
+
+        self.process()
+        item_import.refresh_from_db()
+        self.assertEqual((item_import.status, item_import.rows_committed, item_import.created_count), ('completed', 6, 6))
+        self.assertEqual(item_import.error_count, 0)
+        self.assertEqual(self.upload(content, import_id=import_id).status_code, 400)
+
+    def test_resume_rejects_a_different_file(self):
+        import_id = self.upload(self.manifest(['SN0', 'SN1'])).data['id']
+        ItemImport.objects.filter(pk=import_id).update(status='failed')
+
+        response = self.upload(self.manifest(['SN0', 'SN2']), import_id=import_id)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(ItemImport.objects.get(pk=import_id).status, 'failed')
+
+    def test_running_import_is_claimed_once(self):
+        import_id = self.upload(self.manifest(['SN0'])).data['id']
+        ItemImport.objects.filter(pk=import_id).update(status='in_progress', updated_at=timezone.now())
+        self.process()
+        self.assertEqual(ItemImport.objects.get(pk=import_id).created_count, 0)
+        self.assertEqual(self.upload(self.manifest(['SN0']), import_id=import_id).status_code, 409)
+
+        # Abandoned by its worker
+        ItemImport.objects.filter(pk=import_id).update(updated_at=timezone.now() - timedelta(hours=1))
+        self.process()
+        self.assertEqual(ItemImport.objects.get(pk=import_id).status, 'completed')
+
+
+class ItemFleetAssignmentTests(TestCase):
+
+    def setUp(self):
+        self.distributor = User.objects.create_user(
+            email='distributor@example.com', password='pass', user_type='DISTRIBUTOR'
+        )
+        other = User.objects.create_user(email='other@example.com', password='pass', user_type='DISTRIBUTOR')
+        self.fleet = Fleet.objects.create(name='Fleet A', distributor=self.distributor)
+        self.second_fleet = Fleet.objects.create(name='Fleet B', distributor=self.distributor)
+        self.foreign_fleet = Fleet.objects.create(name='Fleet C', distributor=other)
+        self.unassigned = Item.objects.create(serial_number='SN1')
+        self.assigned = Item.objects.create(serial_number='SN2', fleet=self.fleet)
+        self.foreign = Item.objects.create(serial_number='SN3', fleet=self.foreign_fleet)
+        self.client = APIClient()
+        self.client.force_authenticate(self.distributor)
+
+    def errors(self, response):
+        return {error['item_id']: error['error'] for error in response.data['errors']}
+
+    def test_assign_only_unassigned_items(self):
+        response = self.client.post('/api/items/assign_fleet/', {
+            'fleet_id': self.second_fleet.id,
+            'item_ids': [self.unassigned.id, self.assigned.id, self.foreign.id, 9999],
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['assigned_items'], [self.unassigned.id])
+        self.assertEqual(set(self.errors(response)), {self.assigned.id, self.foreign.id, 9999})
+        self.assertEqual(Item.objects.get(pk=self.unassigned.pk).fleet_id, self.second_fleet.id)
+        self.assertEqual(Item.objects.get(pk=self.assigned.pk).fleet_id, self.fleet.id)
+        self.assertEqual(Item.objects.get(pk=self.foreign.pk).fleet_id, self.foreign_fleet.id)
+
+    def test_reassign_only_own_assigned_items(self):
+        response = self.client.post('/api/items/reassign_fleet/', {
+            'fleet_id': self.second_fleet.id,
+            'item_ids': [self.unassigned.id, self.assigned.id, self.foreign.id],
+        }, format='json')
+        self.assertEqual(response.data['reassigned_items'], [self.assigned.id])
+        self.assertEqual(set(self.errors(response)), {self.unassigned.id, self.foreign.id})
+        self.assertEqual(Item.objects.get(pk=self.assigned.pk).fleet_id, self.second_fleet.id)
+        self.assertEqual(Item.objects.get(pk=self.foreign.pk).fleet_id, self.foreign_fleet.id)
+        self.assertIsNone(Item.objects.get(pk=self.unassigned.pk).fleet_id)
+
+    def test_items_changed_after_classification_are_not_reported_assigned(self):
+        classified = {self.unassigned.id: {'id': self.unassigned.id, 'fleet_id': None}}
+        # Another request assigns the item between the check and the UPDATE
+        Item.objects.filter(pk=self.unassigned.pk).update(fleet=self.fleet)
+        with mock.patch('items.views.fetch_rows', return_value=classified):
+            response = self.client.post('/api/items/assign_fleet/', {
+                'fleet_id': self.second_fleet.id, 'item_ids': [self.unassigned.id],
+            }, format='json')
+        self.assertEqual(response.data['assigned_items'], [])
+        self.assertEqual(list(self.errors(response)), [self.unassigned.id])
+        self.assertEqual(Item.objects.get(pk=self.unassigned.pk).fleet_id, self.fleet.id)
+
+
+class FleetAgentAssignmentTests(TestCase):
+
+    def setUp(self):
+        self.distributor = User.objects.create_user(
+            email='distributor@example.com', password='pass', user_type='DISTRIBUTOR'
+        )
+        other = User.objects.create_user(email='other@example.com', password='pass', user_type='DISTRIBUTOR')
+        self.agent = User.objects.create_user(
+            email='agent@example.com', password='pass', user_type='AGENT', distributor=self.distributor
+        )
+        self.other_agent = User.objects.create_user(
+            email='agent2@example.com', password='pass', user_type='AGENT', distributor=self.distributor
+        )
+        self.unassigned = Fleet.objects.create(name='Fleet A', distributor=self.distributor)
+        self.assigned = Fleet.objects.create(name='Fleet B', distributor=self.distributor, assigned_agent=self.other_agent)
+        self.foreign = Fleet.objects.create(name='Fleet C', distributor=other)
+        self.client = APIClient()
+        self.client.force_authenticate(self.distributor)
+
+    def agent_of(self, fleet):
+        return Fleet.objects.get(pk=fleet.pk).assigned_agent_id
+
+    def test_assign_only_unassigned_own_fleets(self):
+        response = self.client.post('/api/fleets/assign/', {
+            'agent_id': self.agent.id,
+            'fleet_ids': [self.unassigned.id, self.assigned.id, self.foreign.id, 9999],
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['assigned_fleet_ids'], [self.unassigned.id])
+        self.assertEqual(
+            [error['fleet_id'] for error in response.data['errors']],
+            [self.assigned.id, self.foreign.id, 9999]
+        )
+        self.assertEqual(self.agent_of(self.unassigned), self.agent.id)
+        self.assertEqual(self.agent_of(self.assigned), self.other_agent.id)
+        self.assertIsNone(self.agent_of(self.foreign))
+
+    def test_reassign_only_assigned_own_fleets(self):
+        response = self.client.post('/api/fleets/reassign/', {
+            'new_agent_id': self.agent.id,
+            'fleet_ids': [self.unassigned.id, self.assigned.id, self.foreign.id],
+        }, format='json')
+        self.assertEqual(response.data['reassigned'], [{'fleet_id': self.assigned.id, 'old_agent_id': self.other_agent.id}])
+        self.assertEqual([error['fleet_id'] for error in response.data['errors']], [self.unassigned.id, self.foreign.id])
+        self.assertEqual(self.agent_of(self.assigned), self.agent.id)
+        self.assertIsNone(self.agent_of(self.unassigned))
 
-# Create your tests here.
+    def test_fleet_assigned_after_classification_is_not_reported(self):
+        classified = {self.unassigned.id: {'id': self.unassigned.id, 'distributor_id': self.distributor.id,
+                                           'assigned_agent_id': None}}
+        Fleet.objects.filter(pk=self.unassigned.pk).update(assigned_agent=self.other_agent)
+        with mock.patch('items.views.fetch_rows', return_value=classified):
+            response = self.client.post('/api/fleets/assign/', {
+                'agent_id': self.agent.id, 'fleet_ids': [self.unassigned.id],
+            }, format='json')
+        self.assertEqual(response.data['assigned_fleet_ids'], [])
+        self.assertEqual([error['fleet_id'] for error in response.data['errors']], [self.unassigned.id])
+        self.assertEqual(self.agent_of(self.unassigned), self.other_agent.id)
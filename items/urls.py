@@ -16,7 +16,10 @@ urlpatterns = [
     # Items
     path('items/', views.items_view, name='items-item'),
     path('items/<int:pk>/', views.item_detail_view, name='item-detail'),
+    path('items/expiring/', views.expiring_items_view, name='expiring-items'),
     path('items/bulk_create/', views.create_items_bulk_view, name='create-items-bulk'),
+    path('items/import/', views.import_items_view, name='import-items'),
+    path('items/import/<int:pk>/', views.item_import_detail_view, name='item-import-detail'),
     path('items/assign_fleet/', views.assign_item_to_fleet_view, name='assign-item-fleet'),
     path('items/reassign_fleet/', views.reassign_item_to_fleet_view, name='reassign-item-fleet'),
     path('fleets/<int:fleet_id>/items/', views.get_items_in_fleet_view, name='fleet-items'),
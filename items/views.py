@@ -6,12 +6,21 @@ from rest_framework.response import Response
 from rest_framework.exceptions import PermissionDenied
 from django.shortcuts import get_object_or_404
 
-from .models import Manufacturer, Fleet, EncoderState
-from .serializers import ManufacturerSerializer, FleetSerializer, Item, ItemSerializer
+from .models import Manufacturer, Fleet, EncoderState, ItemImport
+from .serializers import ManufacturerSerializer, FleetSerializer, Item, ItemSerializer, ItemImportSerializer
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ObjectDoesNotExist
 from .models import Customer
 from django.db import transaction
+from django.utils import timezone
+from datetime import timedelta
+from utils.bulk import CONCURRENT_CHANGE_ERROR, unique_pks, fetch_rows, update_rows
+from utils.pagination import keyset_response
+from .bulk import validate_item_rows, bulk_insert_items, serialize_created_items
+from .imports import (
+    IMPORT_CHUNK_SIZE, MAX_IMPORT_CHUNK_SIZE, ImportBusy, ImportFileError, detect_file_format,
+    queue_import, requeue_import,
+)
 User = get_user_model()
 
 @api_view(['GET', 'POST'])
@@ -263,7 +272,6 @@ def assign_fleets_view(request):
     # Verify agent_id references a valid AGENT user
     try:
         agent_user = User.objects.get(pk=agent_id, user_type='AGENT')
-        print(agent_user, "Agent User--")
     except ObjectDoesNotExist:
         return Response(
             {"detail": "Invalid agent_id or user is not an AGENT."},
@@ -272,11 +280,15 @@ def assign_fleets_view(request):
 
     assigned_fleets = []
     errors = []
+    eligible = []
 
-    for fid in fleet_ids:
-        try:
-            fleet = Fleet.objects.get(pk=fid)
-        except Fleet.DoesNotExist:
+    # One query classifies every requested id
+    requested = unique_pks(fleet_ids)
+    rows = fetch_rows(Fleet.objects.all(), [pk for _, pk in requested], 'distributor_id', 'assigned_agent_id')
+
+    for fid, pk in requested:
+        row = rows.get(pk)
+        if row is None:
             errors.append({
                 "fleet_id": fid,
                 "detail": "Fleet does not exist."
@@ -284,7 +296,7 @@ def assign_fleets_view(request):
             continue
 
         # Must belong to this distributor
-        if fleet.distributor != user:
+        if row['distributor_id'] != user.id:
             errors.append({
                 "fleet_id": fid,
                 "detail": "You do not own this fleet."
@@ -292,18 +304,25 @@ def assign_fleets_view(request):
             continue
 
         # Must not be already assigned
-        if fleet.assigned_agent is not None:
+        if row['assigned_agent_id'] is not None:
             errors.append({
                 "fleet_id": fid,
                 "detail": "Fleet is already assigned. Use the reassign endpoint."
             })
             continue
 
-        # Assign fleet
-        fleet.assigned_agent = agent_user
-        print(fleet, "Fleet----")
-        fleet.save()
-        assigned_fleets.append(fid)
+        eligible.append((fid, pk))
+
+    # Assign all eligible fleets in a single UPDATE
+    updated = update_rows(
+        Fleet.objects.filter(distributor=user, assigned_agent__isnull=True),
+        [pk for _, pk in eligible], assigned_agent=agent_user
+    )
+    for fid, pk in eligible:
+        if pk in updated:
+            assigned_fleets.append(fid)
+        else:
+            errors.append({"fleet_id": fid, "detail": CONCURRENT_CHANGE_ERROR})
 
     response_data = {
         "assigned_fleet_ids": assigned_fleets,
@@ -353,11 +372,15 @@ def reassign_fleets_view(request):
 
     reassigned_fleets = []
     errors = []
+    eligible = []
 
-    for fid in fleet_ids:
-        try:
-            fleet = Fleet.objects.get(pk=fid)
-        except Fleet.DoesNotExist:
+    # One query classifies every requested id and captures the old agents
+    requested = unique_pks(fleet_ids)
+    rows = fetch_rows(Fleet.objects.all(), [pk for _, pk in requested], 'distributor_id', 'assigned_agent_id')
+
+    for fid, pk in requested:
+        row = rows.get(pk)
+        if row is None:
             errors.append({
                 "fleet_id": fid,
                 "detail": "Fleet does not exist."
@@ -365,7 +388,7 @@ def reassign_fleets_view(request):
             continue
 
         # Must belong to this distributor
-        if fleet.distributor != user:
+        if row['distributor_id'] != user.id:
             errors.append({
                 "fleet_id": fid,
                 "detail": "You do not own this fleet."
@@ -373,22 +396,25 @@ def reassign_fleets_view(request):
             continue
 
         # Must already be assigned to someone
-        if fleet.assigned_agent is None:
+        if row['assigned_agent_id'] is None:
             errors.append({
                 "fleet_id": fid,
                 "detail": "Fleet is not assigned to any agent. Use the assign endpoint."
             })
             continue
 
-        old_agent = fleet.assigned_agent
+        eligible.append((fid, pk, row['assigned_agent_id']))
 
-        # Reassign
-        fleet.assigned_agent = new_agent_user
-        fleet.save()
-        reassigned_fleets.append({
-            "fleet_id": fid,
-            "old_agent_id": old_agent.pk if old_agent else None
-        })
+    # Reassign all eligible fleets in a single UPDATE
+    updated = update_rows(
+        Fleet.objects.filter(distributor=user, assigned_agent__isnull=False),
+        [pk for _, pk, _ in eligible], assigned_agent=new_agent_user
+    )
+    for fid, pk, old_agent_id in eligible:
+        if pk in updated:
+            reassigned_fleets.append({"fleet_id": fid, "old_agent_id": old_agent_id})
+        else:
+            errors.append({"fleet_id": fid, "detail": CONCURRENT_CHANGE_ERROR})
 
     response_data = {
         "reassigned": reassigned_fleets,
@@ -428,37 +454,11 @@ def create_items_bulk_view(request):
     if not isinstance(data, list):
         return Response({"detail": "'items' must be a list."}, status=status.HTTP_400_BAD_REQUEST)
 
-    created_items = []
-    errors = []
-
-    for idx, item_data in enumerate(data):
-        serializer = ItemSerializer(data=item_data)
-        if serializer.is_valid():
-            try:
-                with transaction.atomic():
-                    fleet_id = item_data.get('fleet_id')
-                    if fleet_id:
-                        fleet = get_object_or_404(Fleet, pk=fleet_id)
-                        if fleet.distributor != user:
-                            raise PermissionDenied(f"You do not own fleet_id={fleet_id}")
-
-                        # Pass fleet to serializer's save method
-                        item_obj = serializer.save(fleet=fleet)
-                    else:
-                        # Create item without fleet
-                        item_obj = serializer.save()
-
-                created_items.append(ItemSerializer(item_obj).data)
-            except Exception as e:
-                errors.append({
-                    "index": idx,
-                    "error": str(e)
-                })
-        else:
-            errors.append({
-                "index": idx,
-                "error": serializer.errors
-            })
+    # Validate the whole payload in memory, then insert in chunks
+    valid, errors = validate_item_rows(user, list(enumerate(data)))
+    created_ids, insert_errors = bulk_insert_items(valid)
+    errors = sorted(errors + insert_errors, key=lambda error: error["index"])
+    created_items = serialize_created_items(created_ids)
 
     return Response({
         "created_items": created_items,
@@ -466,6 +466,86 @@ def create_items_bulk_view(request):
     }, status=status.HTTP_201_CREATED if created_items else status.HTTP_400_BAD_REQUEST)
 
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def import_items_view(request):
+    """
+    POST /items/import/  (multipart/form-data)
+      file: <manifest.csv | manifest.ndjson>
+      format: "csv" | "ndjson"   // Optional, detected from the file name
+      chunk_size: <int>          // Optional, rows committed per transaction
+      import_id: <int>           // Optional, resume a previous import
+
+    CSV columns: serial_number, fleet_id, manufacturers, token_type,
+    token_value, secret_key, starting_code, max_count, token.
+    NDJSON lines use the same shape as one entry of /items/bulk_create/.
+
+    The file is stored and queued (202 Accepted); `manage.py
+    process_item_imports` streams it row by row and commits it in chunks.
+    Poll /items/import/<import_id>/ for progress. If an import failed or
+    its worker died, upload the same file again with its import_id and it
+    continues after the last committed chunk.
+    """
+    user = request.user
+    if user.user_type != 'DISTRIBUTOR':
+        raise PermissionDenied("Only a Distributor can import items.")
+
+    uploaded_file = request.FILES.get('file')
+    if not uploaded_file:
+        return Response({"detail": "file is required."}, status=status.HTTP_400_BAD_REQUEST)
+
+    import_id = request.data.get('import_id')
+    if import_id:
+        item_import = get_object_or_404(ItemImport, pk=import_id, distributor=user)
+        if item_import.status == 'completed':
+            return Response(
+                {"detail": "This import has already completed."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            item_import = requeue_import(item_import, uploaded_file)
+        except ImportFileError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except ImportBusy as e:
+            return Response({"detail": str(e)}, status=status.HTTP_409_CONFLICT)
+    else:
+        try:
+            file_format = detect_file_format(uploaded_file.name, request.data.get('format'))
+        except ImportFileError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        chunk_size = request.data.get('chunk_size', IMPORT_CHUNK_SIZE)
+        try:
+            chunk_size = int(chunk_size)
+        except (TypeError, ValueError):
+            chunk_size = 0
+        if chunk_size <= 0 or chunk_size > MAX_IMPORT_CHUNK_SIZE:
+            return Response(
+                {"detail": f"chunk_size must be between 1 and {MAX_IMPORT_CHUNK_SIZE}."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        item_import = queue_import(user, uploaded_file, file_format, chunk_size)
+
+    return Response(ItemImportSerializer(item_import).data, status=status.HTTP_202_ACCEPTED)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def item_import_detail_view(request, pk):
+    """
+    GET /items/import/<pk>/
+    Progress and stored per-row errors of an import. Can be polled while the
+    upload is still being processed.
+    """
+    user = request.user
+    if user.user_type != 'DISTRIBUTOR':
+        raise PermissionDenied("Only a Distributor can view item imports.")
+
+    item_import = get_object_or_404(ItemImport, pk=pk, distributor=user)
+    return Response(ItemImportSerializer(item_import).data, status=status.HTTP_200_OK)
+
+
 @api_view(['GET', 'PUT', 'PATCH', 'DELETE'])
 @permission_classes([IsAuthenticated])
 def item_detail_view(request, pk):
@@ -480,10 +560,7 @@ def item_detail_view(request, pk):
     
     # Optimize query with fleet relationships
     item = get_object_or_404(
-        Item.objects.select_related(
-            'fleet__distributor',
-            'fleet__assigned_agent'
-        ),
+        ItemSerializer.setup_eager_loading(Item.objects.all()).select_related('fleet__distributor'),
         pk=pk
     )
 
@@ -568,26 +645,35 @@ def assign_item_to_fleet_view(request):
 
     assigned = []
     errors = []
+    eligible = []
 
-    for iid in item_ids:
-        try:
-            item_obj = Item.objects.get(pk=iid)
-        except Item.DoesNotExist:
+    # One query classifies every requested id
+    requested = unique_pks(item_ids)
+    rows = fetch_rows(Item.objects.all(), [pk for _, pk in requested], 'fleet_id')
+
+    for iid, pk in requested:
+        row = rows.get(pk)
+        if row is None:
             errors.append({"item_id": iid, "error": "Item not found."})
             continue
 
         # The item must not already have a fleet.
-        if item_obj.fleet is not None:
+        if row['fleet_id'] is not None:
             errors.append({
                 "item_id": iid,
                 "error": "Item already belongs to a fleet. Use reassign endpoint."
             })
             continue
 
-        # Assign item to this fleet
-        item_obj.fleet = fleet
-        item_obj.save()
-        assigned.append(iid)
+        eligible.append((iid, pk))
+
+    # Assign all eligible items to this fleet in a single UPDATE
+    updated = update_rows(Item.objects.filter(fleet__isnull=True), [pk for _, pk in eligible], fleet=fleet)
+    for iid, pk in eligible:
+        if pk in updated:
+            assigned.append(iid)
+        else:
+            errors.append({"item_id": iid, "error": CONCURRENT_CHANGE_ERROR})
 
     return Response({
         "assigned_items": assigned,
@@ -627,16 +713,20 @@ def reassign_item_to_fleet_view(request):
 
     reassigned = []
     errors = []
+    eligible = []
 
-    for iid in item_ids:
-        try:
-            item_obj = Item.objects.get(pk=iid)
-        except Item.DoesNotExist:
+    # One query classifies every requested id
+    requested = unique_pks(item_ids)
+    rows = fetch_rows(Item.objects.all(), [pk for _, pk in requested], 'fleet_id', 'fleet__distributor_id')
+
+    for iid, pk in requested:
+        row = rows.get(pk)
+        if row is None:
             errors.append({"item_id": iid, "error": "Item not found."})
             continue
 
         # The item must already have a fleet
-        if item_obj.fleet is None:
+        if row['fleet_id'] is None:
             errors.append({
                 "item_id": iid,
                 "error": "Item has no fleet. Use assign endpoint instead."
@@ -644,17 +734,22 @@ def reassign_item_to_fleet_view(request):
             continue
 
         # The item’s current fleet must also belong to the same distributor
-        if item_obj.fleet.distributor != user:
+        if row['fleet__distributor_id'] != user.id:
             errors.append({
                 "item_id": iid,
                 "error": "Item belongs to a fleet owned by a different distributor."
             })
             continue
 
-        # Reassign item to the new fleet
-        item_obj.fleet = new_fleet
-        item_obj.save()
-        reassigned.append(iid)
+        eligible.append((iid, pk))
+
+    # Move all eligible items to the new fleet in a single UPDATE
+    updated = update_rows(Item.objects.filter(fleet__distributor=user), [pk for _, pk in eligible], fleet=new_fleet)
+    for iid, pk in eligible:
+        if pk in updated:
+            reassigned.append(iid)
+        else:
+            errors.append({"item_id": iid, "error": CONCURRENT_CHANGE_ERROR})
 
     return Response({
         "reassigned_items": reassigned,
@@ -689,9 +784,60 @@ def get_items_in_fleet_view(request, fleet_id):
         # raise PermissionDenied("You do not have access.")
         pass
 
-    items = fleet.items.all()
-    serializer = ItemSerializer(items, many=True)
-    return Response(serializer.data, status=200)
+    items = ItemSerializer.setup_eager_loading(fleet.items.all())
+    return keyset_response(request, items, ItemSerializer)
+
+
+# Look-ahead window of the expiring items list, in days
+DEFAULT_EXPIRY_WINDOW = 3
+MAX_EXPIRY_WINDOW = 90
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def expiring_items_view(request):
+    """
+    GET /items/expiring/?days=3&fleet_id=<id>&agent_id=<id>
+    Items whose credit runs out within `days` (default 3), soonest first.
+
+    - AGENT: items in the fleets assigned to them
+    - DISTRIBUTOR: items in their fleets; agent_id narrows to one agent's fleets
+    - SUPER_ADMIN: all items
+
+    Send `page_size` (and then the returned `cursor`) to page through the list.
+    """
+    user = request.user
+    params = {}
+    for name in ['days', 'fleet_id', 'agent_id']:
+        value = request.query_params.get(name)
+        if value:
+            try:
+                params[name] = int(value)
+            except ValueError:
+                return Response({"detail": f"{name} must be an integer."}, status=status.HTTP_400_BAD_REQUEST)
+    days = params.get('days', DEFAULT_EXPIRY_WINDOW)
+    if not 0 < days <= MAX_EXPIRY_WINDOW:
+        return Response(
+            {"detail": f"days must be between 1 and {MAX_EXPIRY_WINDOW}."},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    if user.user_type == 'AGENT':
+        items = Item.objects.filter(fleet__assigned_agent=user)
+    elif user.user_type == 'DISTRIBUTOR':
+        items = Item.objects.filter(fleet__distributor=user)
+    elif user.user_type == 'SUPER_ADMIN':
+        items = Item.objects.all()
+    else:
+        raise PermissionDenied("You don't have permission to view items.")
+    if 'fleet_id' in params:
+        items = items.filter(fleet_id=params['fleet_id'])
+    if 'agent_id' in params and user.user_type != 'AGENT':
+        items = items.filter(fleet__assigned_agent_id=params['agent_id'])
+
+    now = timezone.now()
+    items = items.filter(credit_expires_at__gte=now, credit_expires_at__lt=now + timedelta(days=days))
+    items = ItemSerializer.setup_eager_loading(items).order_by('credit_expires_at', 'id')
+    return keyset_response(request, items, ItemSerializer, keys=('credit_expires_at', 'id'), descending=False)
 
 
 @api_view(['GET'])
@@ -707,9 +853,8 @@ def get_distributor_items_view(request):
 
     # All fleets belonging to user
     fleets = user.fleets.all()
-    items = Item.objects.filter(fleet__in=fleets)
-    serializer = ItemSerializer(items, many=True)
-    return Response(serializer.data, status=200)
+    items = ItemSerializer.setup_eager_loading(Item.objects.filter(fleet__in=fleets))
+    return keyset_response(request, items, ItemSerializer)
 
 
 
@@ -742,18 +887,15 @@ def items_view(request):
         if user.user_type == 'AGENT':
             fleets = user.assigned_fleets.all()  # from Fleet.assigned_agent
             items = Item.objects.filter(fleet__in=fleets)
-            serializer = ItemSerializer(items, many=True)
         elif user.user_type == "DISTRIBUTOR":
             fleets = user.fleets.all()
-            print(user.id)
-            print(fleets)
             items = Item.objects.filter(fleet__in=fleets)
-            serializer = ItemSerializer(items, many=True)
         else:
             raise PermissionDenied("You don't have permission to view items.")
 
-        serializer = ItemSerializer(items, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        items = ItemSerializer.setup_eager_loading(items)
+        # ?page_size=<n>&cursor=<next_cursor> switches to keyset pagination
+        return keyset_response(request, items, ItemSerializer)
     
 
     elif request.method == 'POST':
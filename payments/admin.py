@@ -1,7 +1,7 @@
 # payments/admin.py
 
 from django.contrib import admin
-from .models import PaymentPlan, Payment, GeneratedCode, PaymentMessage
+from .models import PaymentPlan, Payment, GeneratedCode, PaymentMessage, TokenRequest, IdempotencyKey, DailyRevenueRollup
 
 @admin.register(PaymentPlan)
 class PaymentPlanAdmin(admin.ModelAdmin):
@@ -32,6 +32,15 @@ class PaymentAdmin(admin.ModelAdmin):
     readonly_fields = ('paid_at',)
     ordering = ('-paid_at',)
 
+    def delete_model(self, request, obj):
+        """Soft-delete through Payment.delete(), which reverses the item totals and rollup"""
+        obj.delete()
+
+    def delete_queryset(self, request, queryset):
+        """Override bulk delete to soft-delete each payment the same way"""
+        for payment in queryset:
+            payment.delete()
+
     def item_serial_number(self, obj):
         """
         Displays the serial number of the related item.
@@ -83,8 +92,8 @@ class PaymentMessageAdmin(admin.ModelAdmin):
     """
     Admin interface for PaymentMessage model.
     """
-    list_display = ('id', 'message_excerpt')
-    search_fields = ('message',)
+    list_display = ('id', 'key', 'message_excerpt')
+    search_fields = ('key', 'message')
     list_filter = ()
     ordering = ('id',)
 
@@ -94,3 +103,36 @@ class PaymentMessageAdmin(admin.ModelAdmin):
         """
         return (obj.message[:75] + '...') if len(obj.message) > 75 else obj.message
     message_excerpt.short_description = 'Message Excerpt'
+
+@admin.register(TokenRequest)
+class TokenRequestAdmin(admin.ModelAdmin):
+    """
+    Admin interface for the TokenRequest outbox.
+    """
+    list_display = ('id', 'item', 'token_type', 'token_value', 'status', 'attempts', 'created_at', 'processed_at')
+    search_fields = ('item__serial_number',)
+    list_filter = ('status', 'token_type', 'created_at')
+    readonly_fields = ('generated_code', 'claimed_at', 'processed_at', 'created_at')
+    ordering = ('-created_at',)
+
+
+@admin.register(IdempotencyKey)
+class IdempotencyKeyAdmin(admin.ModelAdmin):
+    """
+    Admin interface for stored Idempotency-Key responses.
+    """
+    list_display = ('key', 'user', 'endpoint', 'status', 'response_status', 'created_at', 'expires_at')
+    search_fields = ('key', 'user__email', 'endpoint')
+    list_filter = ('status', 'endpoint')
+    readonly_fields = ('request_fingerprint', 'response_status', 'response_body', 'created_at')
+    ordering = ('-created_at',)
+
+@admin.register(DailyRevenueRollup)
+class DailyRevenueRollupAdmin(admin.ModelAdmin):
+    """
+    Admin interface for daily revenue rollups (maintained automatically).
+    """
+    list_display = ('day', 'distributor', 'fleet', 'payment_plan', 'amount', 'payments_count', 'items_count')
+    list_filter = ('day', 'distributor')
+    readonly_fields = ('bucket', 'updated_at')
+    ordering = ('-day',)
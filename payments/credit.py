@@ -0,0 +1,23 @@
+# credit.py
+"""
+Item.credit_expires_at bookkeeping.
+
+Each issued token moves the unit's expiry the way the device applies it:
+ADD_TIME adds days to the remaining credit (or to now, once it ran out),
+SET_TIME replaces the credit with the given days from now, DISABLE_PAYG
+unlocks the unit for good (no expiry) and COUNTER_SYNC leaves it alone.
+"""
+from datetime import timedelta
+
+from .token_engine import ADD_TIME, DISABLE_PAYG, SET_TIME
+
+
+def credit_expiry(current, token_type, days, now):
+    """The expiry after a `token_type` token for `days` is issued at `now`."""
+    if token_type == ADD_TIME:
+        return max(current or now, now) + timedelta(days=float(days))
+    if token_type == SET_TIME:
+        return now + timedelta(days=float(days))
+    if token_type == DISABLE_PAYG:
+        return None
+    return current
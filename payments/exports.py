@@ -0,0 +1,76 @@
+# exports.py
+"""
+Streaming CSV exports of the payments ledger and generated codes.
+
+Rows are read as flat values() tuples, with item, customer and plan names
+joined in the same query, from a chunked database cursor and written out
+as they arrive, so memory stays flat however many rows are exported and
+the header goes out before the query has run.
+"""
+import csv
+
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+EXPORT_CHUNK_SIZE = 2000
+
+# (CSV header, queryset field) pairs
+PAYMENT_EXPORT_COLUMNS = [
+    ('payment_id', 'id'),
+    ('paid_at', 'paid_at'),
+    ('amount_paid', 'amount_paid'),
+    ('item_id', 'item_id'),
+    ('serial_number', 'item__serial_number'),
+    ('fleet', 'item__fleet__name'),
+    ('customer_id', 'customer_id'),
+    ('customer_name', 'customer__name'),
+    ('customer_phone', 'customer__phone_number'),
+    ('payment_plan_id', 'payment_plan_id'),
+    ('payment_plan', 'payment_plan__name'),
+    ('note', 'note'),
+]
+
+GENERATED_CODE_EXPORT_COLUMNS = [
+    ('code_id', 'id'),
+    ('created_at', 'created_at'),
+    ('item_id', 'item_id'),
+    ('serial_number', 'item__serial_number'),
+    ('fleet', 'item__fleet__name'),
+    ('customer_name', 'item__customer__name'),
+    ('token', 'token'),
+    ('token_type', 'token_type'),
+    ('token_value', 'token_value'),
+    ('max_count', 'max_count'),
+    ('message', 'payment_message__message'),
+]
+
+
+class Echo:
+    """File-like object whose write() hands the line back to csv.writer's caller."""
+
+    def write(self, value):
+        return value
+
+
+def export_value(value):
+    if value is None:
+        return ''
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+
+def iter_csv(queryset, columns):
+    writer = csv.writer(Echo())
+    yield writer.writerow([header for header, _ in columns])
+    rows = queryset.values_list(*[field for _, field in columns]).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    for row in rows:
+        yield writer.writerow([export_value(value) for value in row])
+
+
+def csv_response(queryset, columns, name):
+    """Stream `queryset` as an attachment named `<name>-<date>.csv`."""
+    response = StreamingHttpResponse(iter_csv(queryset, columns), content_type='text/csv')
+    filename = f"{name}-{timezone.now():%Y%m%d}.csv"
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
@@ -0,0 +1,143 @@
+# idempotency.py
+"""
+Idempotency-Key support for write endpoints.
+
+The first request with a key claims an IdempotencyKey row and runs the
+view; its response is stored. Replays with the same key and body get the
+stored response without running the view again, and concurrent
+duplicates wait for the first request to finish instead of racing it.
+"""
+import hashlib
+import json
+import time
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+IDEMPOTENCY_KEY_TTL = timedelta(seconds=getattr(settings, 'IDEMPOTENCY_KEY_TTL', 24 * 60 * 60))
+# How long a duplicate waits for the first request before answering 409
+IDEMPOTENCY_WAIT_TIMEOUT = getattr(settings, 'IDEMPOTENCY_WAIT_TIMEOUT', 30)
+# An in-progress claim older than this belongs to a crashed request and may be taken over
+IDEMPOTENCY_IN_PROGRESS_LEASE = timedelta(seconds=getattr(settings, 'IDEMPOTENCY_IN_PROGRESS_LEASE', 120))
+POLL_INTERVAL = 0.05
+
+
+def request_fingerprint(request):
+    body = json.dumps(request.data, sort_keys=True, cls=DjangoJSONEncoder, default=str)
+    return hashlib.sha256(body.encode('utf-8')).hexdigest()
+
+
+def claim_key(user, endpoint, key, fingerprint):
+    """
+    Insert the in-progress row. Returns (record, True) if this request owns
+    the key, (existing_record, False) otherwise.
+    """
+    now = timezone.now()
+    try:
+        with transaction.atomic():
+            return IdempotencyKey.objects.create(
+                user=user, endpoint=endpoint, key=key, request_fingerprint=fingerprint,
+                expires_at=now + IDEMPOTENCY_KEY_TTL,
+            ), True
+    except IntegrityError:
+        pass
+
+    existing = IdempotencyKey.all_objects.get(user=user, endpoint=endpoint, key=key)
+    expired = existing.expires_at <= now
+    abandoned = existing.status == 'in_progress' and existing.updated_at <= now - IDEMPOTENCY_IN_PROGRESS_LEASE
+    if expired or abandoned:
+        # Take the row over, unless another request got there first
+        taken = IdempotencyKey.all_objects.filter(
+            pk=existing.pk, status=existing.status, updated_at=existing.updated_at
+        ).update(
+            request_fingerprint=fingerprint, status='in_progress', response_status=None,
+            response_body=None, expires_at=now + IDEMPOTENCY_KEY_TTL, updated_at=now,
+        )
+        if taken:
+            existing.refresh_from_db()
+            return existing, True
+        existing.refresh_from_db()
+    return existing, False
+
+
+def wait_for_completion(record):
+    deadline = time.monotonic() + IDEMPOTENCY_WAIT_TIMEOUT
+    while record.status == 'in_progress' and time.monotonic() < deadline:
+        time.sleep(POLL_INTERVAL)
+        try:
+            record.refresh_from_db()
+        except IdempotencyKey.DoesNotExist:
+            # The first request failed and released the key
+            return None
+    return record
+
+
+def replay(record):
+    response = Response(record.response_body, status=record.response_status)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(view):
+    """
+    Honour an Idempotency-Key header on a DRF function view. Place it under
+    @api_view so the request is authenticated. Requests without the header
+    are unaffected.
+
+    Responses below 500 are stored and replayed; server errors and
+    exceptions release the key so the client can retry.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return view(request, *args, **kwargs)
+        if len(key) > 255:
+            return Response({"detail": f"{IDEMPOTENCY_HEADER} must be at most 255 characters."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        endpoint = request.path
+        fingerprint = request_fingerprint(request)
+        while True:
+            record, owned = claim_key(request.user, endpoint, key, fingerprint)
+            if owned:
+                break
+            if record.request_fingerprint != fingerprint:
+                return Response({"detail": f"{IDEMPOTENCY_HEADER} was already used with a different request."},
+                                status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            record = wait_for_completion(record)
+            if record is None:
+                # Released by a failed first attempt; try to claim it ourselves
+                continue
+            if record.status == 'completed':
+                return replay(record)
+            return Response({"detail": f"A request with this {IDEMPOTENCY_HEADER} is still being processed."},
+                            status=status.HTTP_409_CONFLICT)
+
+        try:
+            response = view(request, *args, **kwargs)
+        except Exception:
+            IdempotencyKey.all_objects.filter(pk=record.pk).delete()
+            raise
+
+        if response.status_code >= 500:
+            IdempotencyKey.all_objects.filter(pk=record.pk).delete()
+            return response
+        IdempotencyKey.all_objects.filter(pk=record.pk).update(
+            status='completed',
+            response_status=response.status_code,
+            response_body=json.loads(json.dumps(response.data, cls=DjangoJSONEncoder)),
+            updated_at=timezone.now(),
+        )
+        return response
+
+    return wrapper
@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from payments.token_engine import generate_token
+
+SECRET_KEY = "a29ab82edc5fbbc41ec9530f6dac86b1"
+STARTING_CODE = "123456789"
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the in-process token engine. Cost grows with the counter (one "
+        "SipHash per step), so pass --count close to your devices' max_count."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=1000)
+        parser.add_argument('--count', type=int, default=0, help="Counter the tokens are issued after.")
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        count = options['count']
+
+        started = time.perf_counter()
+        for i in range(iterations):
+            generate_token(SECRET_KEY, count, "ADD_TIME", i % 995 + 1, STARTING_CODE)
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(
+            f"{iterations} ADD_TIME tokens after count={count}: "
+            f"{elapsed * 1e6 / iterations:.1f} us/token ({iterations / elapsed:.0f} tokens/s)"
+        )
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from payments.tokens import drain_outbox
+
+
+class Command(BaseCommand):
+    help = (
+        "Issue outstanding open tokens from the TokenRequest outbox, item by "
+        "item in request order. Run once (e.g. from cron) or with --loop."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help="Keep polling the outbox.")
+        parser.add_argument('--interval', type=float, default=5.0, help="Seconds between polls with --loop.")
+        parser.add_argument('--limit', type=int, default=None, help="Process at most this many items per pass.")
+
+    def handle(self, *args, **options):
+        while True:
+            completed = drain_outbox(limit=options['limit'])
+            if completed or not options['loop']:
+                self.stdout.write(f"Issued {completed} token(s).")
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from payments.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = "Delete Idempotency-Key records whose TTL has passed."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        expired = IdempotencyKey.all_objects.filter(expires_at__lte=timezone.now())
+        deleted = 0
+        while True:
+            pks = list(expired.values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                break
+            deleted += IdempotencyKey.all_objects.filter(pk__in=pks).delete()[0]
+        self.stdout.write(f"Deleted {deleted} expired idempotency key(s).")
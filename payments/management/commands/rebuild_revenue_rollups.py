@@ -0,0 +1,27 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from payments.rollups import rebuild_rollups
+
+
+def parse_day(value):
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f"Invalid date {value!r}; use YYYY-MM-DD.")
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the daily revenue rollups from the payments, for all days "
+        "or the days between --from and --to (inclusive)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='date_from', type=parse_day, help="First day (YYYY-MM-DD).")
+        parser.add_argument('--to', dest='date_to', type=parse_day, help="Last day (YYYY-MM-DD).")
+
+    def handle(self, *args, **options):
+        written = rebuild_rollups(options['date_from'], options['date_to'])
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} daily revenue rollups."))
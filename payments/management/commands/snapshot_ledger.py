@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from payments.snapshots import SNAPSHOT_DIR, TABLES, SnapshotError, write_snapshot
+
+
+class Command(BaseCommand):
+    help = (
+        "Append payments, items, generated codes and customers changed since the "
+        "last run to the Parquet analytics snapshot, partitioned by distributor and month."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--table', action='append', choices=sorted(TABLES), dest='tables',
+            help="Only snapshot this table (repeatable)."
+        )
+        parser.add_argument(
+            '--full', action='store_true',
+            help="Ignore the watermarks and write every row again."
+        )
+
+    def handle(self, *args, **options):
+        try:
+            summary = write_snapshot(options['tables'], full=options['full'])
+        except SnapshotError as e:
+            raise CommandError(str(e))
+        for table, result in summary.items():
+            self.stdout.write(
+                f"{table}: {result['rows']} rows in {result['files']} files "
+                f"(watermark {result['watermark']})"
+            )
+        self.stdout.write(self.style.SUCCESS(f"Snapshot written to {SNAPSHOT_DIR}."))
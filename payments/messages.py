@@ -0,0 +1,84 @@
+# messages.py
+"""
+Keyed catalogue of the PaymentMessage attached to generated codes.
+
+Messages are looked up by key ("interval_daily", "completion",
+"token_ADD_TIME", ...) from a map loaded once per process. The map is
+checked against the table at most every CATALOGUE_RECHECK_SECONDS with one
+aggregate query (latest updated_at and row count), so edits made by any
+process, the admin included, reach the outbox worker without relying on a
+shared cache. Saves in the same process (see signals.py) drop the map
+right away. Queryset .update() calls must bump updated_at to be seen.
+
+A key with no row is created from its default text on first use. Existing
+rows are never overwritten: an admin edit wins over the default, and a
+soft-deleted message keeps its key, so edit its text rather than deleting it.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.db.models import Count, Max
+
+from .models import PaymentMessage
+
+CATALOGUE_RECHECK_SECONDS = getattr(settings, 'PAYMENT_MESSAGE_RECHECK_SECONDS', 1.0)
+
+COMPLETION_MESSAGE_KEY = 'completion'
+COMPLETION_MESSAGE = "Congratulations! Full payment completed."
+
+
+def interval_message(interval_type):
+    """(key, default text) of the message for interval payments."""
+    return f"interval_{interval_type}", f"Code generated for {interval_type} usage."
+
+
+def token_message(token_type):
+    """(key, default text) of the message for manually generated tokens."""
+    return f"token_{token_type}", f"Token generated for {token_type}."
+
+
+class MessageCatalogue:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.messages = None
+        self.version = None
+        self.checked_at = None
+
+    def current_version(self):
+        """Changes whenever any process saves, soft deletes or removes a message."""
+        row = PaymentMessage.all_objects.aggregate(last=Max('updated_at'), rows=Count('pk'))
+        return row['last'], row['rows']
+
+    def get(self, key, default):
+        """The PaymentMessage for `key`, created with `default` text if missing."""
+        if not key:
+            # Requests queued before messages had keys carry only the text
+            message, _ = PaymentMessage.objects.filter(key=None).get_or_create(message=default)
+            return message
+        with self.lock:
+            now = time.monotonic()
+            if self.messages is None or now - self.checked_at >= CATALOGUE_RECHECK_SECONDS:
+                version = self.current_version()
+                if self.messages is None or self.version != version:
+                    self.messages = {
+                        message.key: message
+                        for message in PaymentMessage.all_objects.exclude(key=None)
+                    }
+                    self.version = version
+                self.checked_at = now
+            message = self.messages.get(key)
+        if message is not None:
+            return message
+
+        # The save invalidates the catalogue, so the next lookup reloads it
+        message, _ = PaymentMessage.all_objects.get_or_create(key=key, defaults={'message': default})
+        return message
+
+    def invalidate(self):
+        with self.lock:
+            self.messages = None
+
+
+message_catalogue = MessageCatalogue()
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('items', '0015_item_payment_totals'),
+        ('payments', '0008_generatedcode_deleted_at_payment_deleted_at_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TokenRequest',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated At')),
+                ('deleted_status', models.BooleanField(default=False, verbose_name='Deleted Status')),
+                ('deleted_at', models.DateTimeField(blank=True, null=True)),
+                ('token_type', models.CharField(max_length=20)),
+                ('token_value', models.FloatField()),
+                ('message', models.TextField(blank=True)),
+                ('is_completion', models.BooleanField(default=False)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('completed', 'Completed'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('claimed_at', models.DateTimeField(blank=True, null=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True)),
+                ('generated_code', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='token_requests', to='payments.generatedcode')),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='token_requests', to='items.item')),
+                ('payment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='token_requests', to='payments.payment')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'item', 'id'], name='payments_to_status_256ab2_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:49
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_payment_distributor(apps, schema_editor):
+    Payment = apps.get_model('payments', 'Payment')
+    Item = apps.get_model('items', 'Item')
+
+    Payment.objects.update(
+        distributor=Subquery(Item.objects.filter(pk=OuterRef('item_id')).values('fleet__distributor')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clients', '0003_alter_customer_email_alter_customer_phone_number'),
+        ('items', '0015_item_payment_totals'),
+        ('payments', '0011_payment_message_key'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='distributor',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='received_payments', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['distributor', '-paid_at', '-id'], name='payment_distributor_paid_idx'),
+        ),
+        migrations.RunPython(backfill_payment_distributor, migrations.RunPython.noop),
+    ]
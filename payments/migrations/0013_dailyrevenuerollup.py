@@ -0,0 +1,67 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:55
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+
+
+def backfill_rollups(apps, schema_editor):
+    Payment = apps.get_model('payments', 'Payment')
+    DailyRevenueRollup = apps.get_model('payments', 'DailyRevenueRollup')
+
+    grouped = (
+        Payment.objects.filter(deleted_status=False)
+        .annotate(paid_on=TruncDate('paid_at'))
+        .order_by()
+        .values('paid_on', 'distributor_id', 'item__fleet_id', 'payment_plan_id')
+        .annotate(total=Sum('amount_paid'), count=Count('pk'), items=Count('item', distinct=True))
+    )
+    DailyRevenueRollup.objects.bulk_create([
+        DailyRevenueRollup(
+            bucket=':'.join([row['paid_on'].isoformat()] + [
+                '-' if row[key] is None else str(row[key])
+                for key in ('distributor_id', 'item__fleet_id', 'payment_plan_id')
+            ]),
+            day=row['paid_on'],
+            distributor_id=row['distributor_id'],
+            fleet_id=row['item__fleet_id'],
+            payment_plan_id=row['payment_plan_id'],
+            amount=row['total'],
+            payments_count=row['count'],
+            items_count=row['items'],
+        )
+        for row in grouped.iterator()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('items', '0015_item_payment_totals'),
+        ('payments', '0012_payment_distributor'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyRevenueRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.CharField(max_length=100, unique=True)),
+                ('day', models.DateField()),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('payments_count', models.PositiveIntegerField(default=0)),
+                ('items_count', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('distributor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='revenue_rollups', to=settings.AUTH_USER_MODEL)),
+                ('fleet', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='revenue_rollups', to='items.fleet')),
+                ('payment_plan', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='revenue_rollups', to='payments.paymentplan')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['distributor', 'day'], name='payments_da_distrib_954be0_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
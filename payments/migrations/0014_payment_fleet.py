@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_payment_fleet(apps, schema_editor):
+    Payment = apps.get_model('payments', 'Payment')
+    Item = apps.get_model('items', 'Item')
+
+    # The fleet at payment time is not recorded anywhere else; the item's
+    # current fleet is what the existing rollups were built from
+    Payment.objects.update(
+        fleet=Subquery(Item.objects.filter(pk=OuterRef('item_id')).values('fleet')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('items', '0017_itemimport_file_sha256'),
+        ('payments', '0013_dailyrevenuerollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='fleet',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='payments', to='items.fleet'),
+        ),
+        migrations.RunPython(backfill_payment_fleet, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('items', '0018_keyset_indexes'),
+        ('payments', '0014_payment_fleet'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='generatedcode',
+            index=models.Index(fields=['item', '-created_at', '-id'], name='code_item_created_idx'),
+        ),
+    ]
@@ -1,6 +1,9 @@
 
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, OuterRef, Subquery
+from django.core.serializers.json import DjangoJSONEncoder
 from django.contrib.auth import get_user_model
+from django.utils import timezone
 from utils.models import BaseModel
 User = get_user_model()
 
@@ -14,6 +17,13 @@ class PaymentPlan(BaseModel):
         ('monthly', 'Monthly'),
         # Add more as needed
     ]
+    # Days of credit bought by one interval
+    INTERVAL_DAYS = {
+        'hourly': 1 / 24,
+        'daily': 1,
+        'weekly': 7,
+        'monthly': 30,
+    }
 
     distributor = models.ForeignKey(
         User,
@@ -34,6 +44,11 @@ class PaymentPlan(BaseModel):
     def __str__(self):
         return f"{self.name} ({self.interval_type}) by {self.distributor.username}"
 
+    def interval_debit(self, days):
+        """Balance debited for a `days` interval token (see handle_interval_payment)."""
+        interval_days = self.INTERVAL_DAYS.get(self.interval_type.lower(), 1)
+        return self.interval_amount * round(float(days) / interval_days)
+
 
 class Payment(BaseModel):
     item = models.ForeignKey(
@@ -58,6 +73,59 @@ class Payment(BaseModel):
         related_name='payments'
     )
     note = models.TextField(blank=True)
+    # Owner of the item's fleet when the payment was made, copied here so
+    # the distributor's ledger is an index range scan instead of two joins
+    distributor = models.ForeignKey(
+        User,
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name='received_payments'
+    )
+    # Fleet of the item when the payment was made. Revenue rollups group on
+    # it, so moving an item to another fleet leaves its past revenue alone
+    fleet = models.ForeignKey(
+        'items.Fleet',
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name='payments'
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['distributor', '-paid_at', '-id'], name='payment_distributor_paid_idx'),
+        ]
+
+    def delete(self, *args, **kwargs):
+        """
+        Soft-delete the payment and take it back out of everything
+        create_payment_record() added it to: the item's balance and running
+        totals and its day's revenue rollup. Tokens already issued for it
+        stay debited.
+        """
+        from items.models import Item
+        from items.status import recompute_item_statuses
+        from .rollups import unrecord_payment
+
+        now = timezone.now()
+        with transaction.atomic():
+            # Conditional, so a payment deleted twice is only reversed once
+            if not Payment.objects.filter(pk=self.pk).update(deleted_status=True, deleted_at=now, updated_at=now):
+                return
+            self.deleted_status, self.deleted_at, self.updated_at = True, now, now
+            unrecord_payment(self)
+            items = Item.all_objects.filter(pk=self.item_id)
+            items.update(
+                balance=F('balance') - self.amount_paid,
+                total_paid=F('total_paid') - self.amount_paid,
+                payments_count=F('payments_count') - 1,
+                last_payment_at=Subquery(
+                    Payment.objects.filter(item=OuterRef('pk')).order_by('-paid_at').values('paid_at')[:1]
+                ),
+                updated_at=now,
+            )
+            recompute_item_statuses(items)
 
     def __str__(self):
         return (f"Payment of {self.amount_paid} on item {self.item.serial_number} "
@@ -80,11 +148,158 @@ class GeneratedCode(BaseModel):
         related_name='generated_codes'
     )
 
+    class Meta:
+        indexes = [
+            # Serves the keyset-paged code lists of an item, newest first
+            models.Index(fields=['item', '-created_at', '-id'], name='code_item_created_idx'),
+        ]
+
     def __str__(self):
         return f"Code {self.code} for Item {self.item.serial_number}"
 
 class PaymentMessage(BaseModel):
+    # Catalogue key, e.g. "interval_daily", "completion", "token_ADD_TIME"
+    key = models.CharField(max_length=100, unique=True, null=True, blank=True)
     message = models.TextField()
 
     def __str__(self):
-        return self.message
\ No newline at end of file
+        return self.message
+
+class TokenRequest(BaseModel):
+    """
+    Transactional outbox for open-token calls.
+
+    Rows are written in the same transaction as the payment that needs the
+    token; the remote call happens after commit, either on the request's
+    fast path or by `manage.py process_token_outbox`. Requests for one item
+    are always processed in id order because the encoder counter is
+    sequential. A payment's request that fails for good gives the debited
+    intervals back to the item's balance.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+
+    item = models.ForeignKey(
+        'items.Item',
+        on_delete=models.CASCADE,
+        related_name='token_requests'
+    )
+    payment = models.ForeignKey(
+        Payment,
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name='token_requests'
+    )
+    token_type = models.CharField(max_length=20)
+    token_value = models.FloatField()
+    message_key = models.CharField(max_length=100, blank=True)
+    message = models.TextField(blank=True)
+    is_completion = models.BooleanField(default=False)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    generated_code = models.ForeignKey(
+        GeneratedCode,
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name='token_requests'
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'item', 'id']),
+        ]
+
+    def __str__(self):
+        return f"{self.token_type} request {self.pk} for item {self.item_id} ({self.status})"
+
+
+class IdempotencyKey(BaseModel):
+    """
+    Stored outcome of a request sent with an Idempotency-Key header, so
+    a retried request is answered from here instead of running again.
+    Keys are scoped to the user and endpoint and expire after a TTL
+    (see `manage.py purge_idempotency_keys`).
+    """
+    STATUS_CHOICES = [
+        ('in_progress', 'In progress'),
+        ('completed', 'Completed'),
+    ]
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='idempotency_keys'
+    )
+    endpoint = models.CharField(max_length=255)
+    key = models.CharField(max_length=255)
+    request_fingerprint = models.CharField(max_length=64)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='in_progress')
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'endpoint', 'key'], name='unique_idempotency_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.endpoint} {self.key} ({self.status})"
+
+
+class DailyRevenueRollup(models.Model):
+    """
+    Payments summed per (day, distributor, fleet, payment plan), kept up to
+    date by create_payment_record and Payment.delete() and rebuilt from the
+    payments with `manage.py rebuild_revenue_rollups`. Reports read these
+    rows instead of aggregating the payments.
+
+    `bucket` encodes the four keys as one unique string, because a unique
+    constraint over the nullable foreign keys would not stop duplicate
+    buckets with a NULL fleet or plan.
+    """
+    bucket = models.CharField(max_length=100, unique=True)
+    day = models.DateField()
+    distributor = models.ForeignKey(
+        User,
+        null=True,
+        blank=True,
+        on_delete=models.CASCADE,
+        related_name='revenue_rollups'
+    )
+    fleet = models.ForeignKey(
+        'items.Fleet',
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name='revenue_rollups'
+    )
+    payment_plan = models.ForeignKey(
+        PaymentPlan,
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name='revenue_rollups'
+    )
+    amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    payments_count = models.PositiveIntegerField(default=0)
+    # Distinct items that paid into the bucket that day
+    items_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['distributor', 'day']),
+        ]
+
+    def __str__(self):
+        return f"{self.amount} from {self.payments_count} payments on {self.day}"
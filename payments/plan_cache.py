@@ -0,0 +1,85 @@
+# plan_cache.py
+"""
+Read-through cache of PaymentPlans per distributor.
+
+Each distributor's live plans are cached as one list under a versioned key;
+saving or deleting a plan (soft deletes included, they go through save())
+gives the distributor a new version, so stale lists are simply never read
+again and expire on their own. A plan id -> distributor pointer lets a
+plan be found by id alone.
+
+Queryset .update() calls on PaymentPlan bypass the signals and must call
+invalidate_distributor_plans() themselves.
+"""
+import uuid
+
+from django.core.cache import cache
+
+from .models import PaymentPlan
+
+PLAN_CACHE_TIMEOUT = 60 * 60
+
+
+def new_version():
+    # Random rather than a counter, so a flushed cache can't hand out a
+    # version number some process still has data for
+    return uuid.uuid4().hex
+
+
+def version_key(distributor_id):
+    return f"payments:plans:version:{distributor_id}"
+
+
+def owner_key(plan_id):
+    return f"payments:plan_owner:{plan_id}"
+
+
+def get_distributor_plans(distributor_id):
+    """Live plans of a distributor (newest first), from the cache when possible."""
+    version = cache.get_or_set(version_key(distributor_id), new_version, timeout=None)
+    plans_key = f"payments:plans:{distributor_id}:{version}"
+    plans = cache.get(plans_key)
+    if plans is None:
+        plans = list(PaymentPlan.objects.filter(distributor_id=distributor_id).order_by('-created_at'))
+        cache.set(plans_key, plans, PLAN_CACHE_TIMEOUT)
+    return plans
+
+
+def get_plan(plan_id, include_deleted=False):
+    """
+    A live plan by id from its distributor's cached list, or None.
+    With include_deleted, soft-deleted plans (still referenced by items)
+    are read from the database instead.
+    """
+    if plan_id is None:
+        return None
+    distributor_id = cache.get(owner_key(plan_id))
+    if distributor_id is None:
+        row = PaymentPlan.all_objects.filter(pk=plan_id).values('distributor_id').first()
+        if row is None:
+            return None
+        distributor_id = row['distributor_id']
+        # Plans without a distributor are stored as 'none', since None means a miss
+        cache.set(owner_key(plan_id), 'none' if distributor_id is None else distributor_id, PLAN_CACHE_TIMEOUT)
+    elif distributor_id == 'none':
+        distributor_id = None
+
+    for plan in get_distributor_plans(distributor_id):
+        if plan.pk == plan_id:
+            return plan
+    if include_deleted:
+        return PaymentPlan.all_objects.filter(pk=plan_id).first()
+    return None
+
+
+def invalidate_distributor_plans(distributor_id):
+    cache.set(version_key(distributor_id), new_version(), timeout=None)
+
+
+def invalidate_plan(plan):
+    """Drop the cached lists of the plan's distributor, and of its previous one if it moved."""
+    previous = cache.get(owner_key(plan.pk))
+    if previous is not None:
+        invalidate_distributor_plans(None if previous == 'none' else previous)
+        cache.delete(owner_key(plan.pk))
+    invalidate_distributor_plans(plan.distributor_id)
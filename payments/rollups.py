@@ -0,0 +1,138 @@
+# rollups.py
+"""
+Daily revenue rollups per (day, distributor, fleet, payment plan).
+
+record_payment() adds each payment to its day's bucket inside the payment
+transaction and unrecord_payment() takes a soft-deleted one back out;
+rebuild_rollups() recomputes a date range from the payments with one
+grouped query, for backfills and repairs. Payments are bucketed by the
+fleet stamped on them when they were made. Days are in the project time
+zone.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import DailyRevenueRollup, Payment
+
+REBUILD_BATCH_SIZE = 1000
+
+
+def bucket_key(day, distributor_id, fleet_id, payment_plan_id):
+    keys = [distributor_id, fleet_id, payment_plan_id]
+    return ':'.join([day.isoformat()] + ['-' if key is None else str(key) for key in keys])
+
+
+def payment_bucket(payment):
+    day = timezone.localdate(payment.paid_at)
+    return day, bucket_key(day, payment.distributor_id, payment.fleet_id, payment.payment_plan_id)
+
+
+def other_payments_in_bucket(payment, day):
+    """The item's other live payments in `payment`'s bucket."""
+    return Payment.objects.filter(
+        item_id=payment.item_id,
+        paid_at__date=day,
+        distributor_id=payment.distributor_id,
+        fleet_id=payment.fleet_id,
+        payment_plan_id=payment.payment_plan_id,
+    ).exclude(pk=payment.pk)
+
+
+def record_payment(payment):
+    """
+    Add `payment` to its day's rollup. Call inside the transaction that
+    created the payment.
+    """
+    day, bucket = payment_bucket(payment)
+    # The item counts once per bucket and day
+    new_item = not other_payments_in_bucket(payment, day).exists()
+
+    increments = {
+        'amount': F('amount') + payment.amount_paid,
+        'payments_count': F('payments_count') + 1,
+        'items_count': F('items_count') + int(new_item),
+        'updated_at': timezone.now(),
+    }
+    if DailyRevenueRollup.objects.filter(bucket=bucket).update(**increments):
+        return
+    try:
+        with transaction.atomic():
+            DailyRevenueRollup.objects.create(
+                bucket=bucket, day=day,
+                distributor_id=payment.distributor_id, fleet_id=payment.fleet_id,
+                payment_plan_id=payment.payment_plan_id,
+                amount=payment.amount_paid, payments_count=1, items_count=1,
+            )
+    except IntegrityError:
+        # Another transaction created the bucket first
+        DailyRevenueRollup.objects.filter(bucket=bucket).update(**increments)
+
+
+def unrecord_payment(payment):
+    """
+    Take the soft-deleted `payment` back out of its day's rollup. Call
+    inside the transaction that deleted it.
+    """
+    day, bucket = payment_bucket(payment)
+    last_of_item = not other_payments_in_bucket(payment, day).exists()
+    DailyRevenueRollup.objects.filter(bucket=bucket).update(
+        amount=F('amount') - payment.amount_paid,
+        payments_count=F('payments_count') - 1,
+        items_count=F('items_count') - int(last_of_item),
+        updated_at=timezone.now(),
+    )
+
+
+def rollup_rows(payments):
+    """Unsaved DailyRevenueRollups for `payments`, grouped in the database."""
+    grouped = (
+        payments.annotate(paid_on=TruncDate('paid_at'))
+        .order_by()
+        .values('paid_on', 'distributor_id', 'fleet_id', 'payment_plan_id')
+        .annotate(
+            total=Sum('amount_paid'),
+            count=Count('pk'),
+            items=Count('item', distinct=True),
+        )
+    )
+    for row in grouped.iterator(chunk_size=REBUILD_BATCH_SIZE):
+        yield DailyRevenueRollup(
+            bucket=bucket_key(row['paid_on'], row['distributor_id'], row['fleet_id'], row['payment_plan_id']),
+            day=row['paid_on'],
+            distributor_id=row['distributor_id'],
+            fleet_id=row['fleet_id'],
+            payment_plan_id=row['payment_plan_id'],
+            amount=row['total'],
+            payments_count=row['count'],
+            items_count=row['items'],
+        )
+
+
+def rebuild_rollups(date_from=None, date_to=None):
+    """
+    Replace the rollups of days date_from..date_to (inclusive; open-ended
+    when None) with totals recomputed from the payments. Returns the
+    number of rollup rows written.
+    """
+    payments = Payment.objects.all()
+    rollups = DailyRevenueRollup.objects.all()
+    if date_from is not None:
+        payments = payments.filter(paid_at__date__gte=date_from)
+        rollups = rollups.filter(day__gte=date_from)
+    if date_to is not None:
+        payments = payments.filter(paid_at__date__lte=date_to)
+        rollups = rollups.filter(day__lte=date_to)
+
+    written = 0
+    with transaction.atomic():
+        rollups.delete()
+        batch = []
+        for rollup in rollup_rows(payments):
+            batch.append(rollup)
+            if len(batch) >= REBUILD_BATCH_SIZE:
+                written += len(DailyRevenueRollup.objects.bulk_create(batch))
+                batch = []
+        written += len(DailyRevenueRollup.objects.bulk_create(batch))
+    return written
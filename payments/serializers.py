@@ -1,9 +1,10 @@
 # serializers.py
 
 from rest_framework import serializers
-from .models import GeneratedCode, Payment, PaymentPlan
+from .models import GeneratedCode, Payment, PaymentPlan, TokenRequest
 from items.models import Item 
 from clients.serializers import CustomerSerializer
+from .plan_cache import get_plan
 
 
 class ItemSerializer(serializers.ModelSerializer):
@@ -20,6 +21,16 @@ class GeneratedCodeSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'token', 'token_value', 'token_type', 'max_count', 'payment_message', 'created_at', 'updated_at']
 
 
+class TokenRequestSerializer(serializers.ModelSerializer):
+    token = serializers.CharField(source='generated_code.token', read_only=True, default=None)
+    max_count = serializers.IntegerField(source='generated_code.max_count', read_only=True, default=None)
+
+    class Meta:
+        model = TokenRequest
+        fields = ['id', 'item', 'payment', 'token_type', 'token_value', 'is_completion', 'status',
+                  'attempts', 'last_error', 'token', 'max_count', 'created_at', 'processed_at']
+        read_only_fields = fields
+
 
 class PaymentPlanSerializer(serializers.ModelSerializer):
     class Meta:
@@ -36,6 +47,11 @@ class PaymentSerializer(serializers.ModelSerializer):
         model = Payment
         fields = ['id','payment_plan', 'item', 'amount_paid', 'paid_at', 'customer', 'note']
         read_only_fields = ['id', 'paid_at']  # Removed 'distributor' as it's not in fields
+
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """Join the relations the nested serializers read."""
+        return queryset.select_related('payment_plan', 'customer', 'item')
 # serializers.py
 
 class AssignPaymentPlanSerializer(serializers.Serializer):
@@ -48,15 +64,18 @@ class AssignPaymentPlanSerializer(serializers.Serializer):
         return value
 
     def validate_payment_plan_id(self, value):
-        if not PaymentPlan.objects.filter(pk=value).exists():
+        self.payment_plan = get_plan(value)
+        if self.payment_plan is None:
             raise serializers.ValidationError("PaymentPlan does not exist.")
         return value
 
     def validate(self, attrs):
         user = self.context['request'].user
-        payment_plan = PaymentPlan.objects.get(pk=attrs['payment_plan_id'])
-        if payment_plan.distributor != user and user.user_type != 'SUPER_ADMIN':
+        payment_plan = self.payment_plan
+        if payment_plan.distributor_id != user.id and user.user_type != 'SUPER_ADMIN':
             raise serializers.ValidationError("You can only assign your own PaymentPlans.")
+        # Hand the (cached) plan to the view so it isn't fetched again
+        attrs['payment_plan'] = payment_plan
         return attrs
 
     
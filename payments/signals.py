@@ -0,0 +1,20 @@
+# signals.py
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .messages import message_catalogue
+from .models import PaymentMessage, PaymentPlan
+from .plan_cache import invalidate_plan
+
+
+@receiver(post_save, sender=PaymentMessage)
+@receiver(post_delete, sender=PaymentMessage)
+def invalidate_message_catalogue(sender, **kwargs):
+    # Soft deletes go through save(), so post_save covers them too
+    message_catalogue.invalidate()
+
+
+@receiver(post_save, sender=PaymentPlan)
+@receiver(post_delete, sender=PaymentPlan)
+def invalidate_plan_cache(sender, instance, **kwargs):
+    invalidate_plan(instance)
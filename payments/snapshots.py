@@ -0,0 +1,307 @@
+# snapshots.py
+"""
+Incremental columnar (Parquet) snapshots of the ledger for analytics.
+
+Each table is written as Hive-style partitions,
+
+    <SNAPSHOT_DIR>/<table>/distributor=<id>/month=<YYYY-MM>/part-<run>.parquet
+
+with typed columns (decimal amounts, UTC timestamps, dictionary-encoded
+token types and statuses), so pyarrow/pandas/DuckDB can scan one
+distributor or month without touching the production database.
+
+Every run appends the rows whose updated_at moved past the table's
+watermark (kept in _state.json) as new part files, so a row that changed
+appears once per version: readers keep the latest updated_at per id.
+Soft-deleted rows are exported too, with deleted_status set.
+
+pyarrow is only imported when a snapshot is written, so the web
+processes that list and serve the files never load it.
+"""
+import fcntl
+import json
+import os
+import uuid
+from datetime import datetime, timedelta, timezone as dt_timezone
+from pathlib import Path
+
+from django.conf import settings
+from django.db.models import F
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from clients.models import Customer
+from items.models import Item
+from .models import GeneratedCode, Payment
+
+SNAPSHOT_DIR = Path(getattr(settings, 'ANALYTICS_SNAPSHOT_DIR', settings.BASE_DIR / 'snapshots'))
+SNAPSHOT_BATCH_SIZE = 10000
+# Rows committed by transactions still open at the cutoff may carry an
+# earlier updated_at; stopping a little short keeps them for the next run
+WATERMARK_LAG = timedelta(seconds=5)
+STATE_FILE = '_state.json'
+LOCK_FILE = '_snapshot.lock'
+
+
+class SnapshotError(Exception):
+    pass
+
+
+class SnapshotBusy(SnapshotError):
+    """Another process is writing the snapshot."""
+
+
+def load_pyarrow():
+    import pyarrow
+    import pyarrow.parquet
+    return pyarrow, pyarrow.parquet
+
+
+# (column, queryset field, type) per table. Types: int, string, bool,
+# timestamp, category (dictionary-encoded) or money(precision, scale).
+TABLES = {
+    'payments': {
+        'queryset': lambda: Payment.all_objects.all(),
+        'distributor': 'distributor_id',
+        'month': 'paid_at',
+        'columns': [
+            ('id', 'id', 'int'),
+            ('item_id', 'item_id', 'int'),
+            ('customer_id', 'customer_id', 'int'),
+            ('payment_plan_id', 'payment_plan_id', 'int'),
+            ('distributor_id', 'distributor_id', 'int'),
+            ('fleet_id', 'fleet_id', 'int'),
+            ('amount_paid', 'amount_paid', ('money', 10, 2)),
+            ('paid_at', 'paid_at', 'timestamp'),
+            ('note', 'note', 'string'),
+            ('created_at', 'created_at', 'timestamp'),
+            ('updated_at', 'updated_at', 'timestamp'),
+            ('deleted_status', 'deleted_status', 'bool'),
+        ],
+    },
+    'items': {
+        'queryset': lambda: Item.all_objects.all(),
+        'distributor': 'fleet__distributor_id',
+        'month': 'created_at',
+        'columns': [
+            ('id', 'id', 'int'),
+            ('serial_number', 'serial_number', 'string'),
+            ('fleet_id', 'fleet_id', 'int'),
+            ('customer_id', 'customer_id', 'int'),
+            ('payment_plan_id', 'payment_plan_id', 'int'),
+            ('status', 'status', 'category'),
+            ('balance', 'balance', ('money', 10, 2)),
+            ('total_paid', 'total_paid', ('money', 12, 2)),
+            ('payments_count', 'payments_count', 'int'),
+            ('last_payment_at', 'last_payment_at', 'timestamp'),
+            ('created_at', 'created_at', 'timestamp'),
+            ('updated_at', 'updated_at', 'timestamp'),
+            ('deleted_status', 'deleted_status', 'bool'),
+        ],
+    },
+    'generated_codes': {
+        'queryset': lambda: GeneratedCode.all_objects.all(),
+        'distributor': 'item__fleet__distributor_id',
+        'month': 'created_at',
+        'columns': [
+            ('id', 'id', 'int'),
+            ('item_id', 'item_id', 'int'),
+            ('token', 'token', 'string'),
+            ('token_type', 'token_type', 'category'),
+            ('token_value', 'token_value', 'int'),
+            ('max_count', 'max_count', 'string'),
+            ('payment_message_id', 'payment_message_id', 'int'),
+            ('created_at', 'created_at', 'timestamp'),
+            ('updated_at', 'updated_at', 'timestamp'),
+            ('deleted_status', 'deleted_status', 'bool'),
+        ],
+    },
+    'customers': {
+        'queryset': lambda: Customer.objects.all(),
+        'distributor': 'distributor_id',
+        'month': 'created_at',
+        'columns': [
+            ('id', 'id', 'int'),
+            ('name', 'name', 'string'),
+            ('email', 'email', 'string'),
+            ('phone_number', 'phone_number', 'string'),
+            ('distributor_id', 'distributor_id', 'int'),
+            ('assigned_agent_id', 'assigned_agent_id', 'int'),
+            ('created_at', 'created_at', 'timestamp'),
+            ('updated_at', 'updated_at', 'timestamp'),
+        ],
+    },
+}
+
+
+def arrow_type(pa, kind):
+    if isinstance(kind, tuple):
+        _, precision, scale = kind
+        return pa.decimal128(precision, scale)
+    return {
+        'int': pa.int64(),
+        'string': pa.string(),
+        'bool': pa.bool_(),
+        'timestamp': pa.timestamp('us', tz='UTC'),
+        'category': pa.dictionary(pa.int32(), pa.string()),
+    }[kind]
+
+
+def table_schema(pa, table):
+    return pa.schema([(name, arrow_type(pa, kind)) for name, _, kind in TABLES[table]['columns']])
+
+
+def record_batch(pa, schema, rows):
+    arrays = []
+    for index, field in enumerate(schema):
+        values = [row[index] for row in rows]
+        if pa.types.is_dictionary(field.type):
+            arrays.append(pa.array(values, pa.string()).dictionary_encode())
+        else:
+            arrays.append(pa.array(values, field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def partition_path(table, distributor_id, month):
+    distributor = 'none' if distributor_id is None else distributor_id
+    return Path(table) / f"distributor={distributor}" / f"month={month:%Y-%m}"
+
+
+def read_state():
+    try:
+        with open(SNAPSHOT_DIR / STATE_FILE) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def write_state(state):
+    path = SNAPSHOT_DIR / STATE_FILE
+    tmp = path.with_suffix('.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def changed_rows(table, since, until):
+    """values_list() of `table` rows updated in (since, until], grouped by partition."""
+    spec = TABLES[table]
+    rows = spec['queryset']().filter(updated_at__lte=until)
+    if since is not None:
+        rows = rows.filter(updated_at__gt=since)
+    return (
+        rows.annotate(snapshot_distributor=F(spec['distributor']), snapshot_month=TruncMonth(spec['month']))
+        .order_by('snapshot_distributor', 'snapshot_month', 'pk')
+        .values_list('snapshot_distributor', 'snapshot_month', *[field for _, field, _ in spec['columns']])
+    )
+
+
+def write_table(pa, pq, table, since, until, run_id):
+    """Append the changed rows of `table` as one part file per partition. Returns (rows, files)."""
+    schema = table_schema(pa, table)
+    written = files = 0
+    writer = partition = tmp_path = None
+    batch = []
+
+    def flush():
+        if batch:
+            writer.write_batch(record_batch(pa, schema, batch))
+            batch.clear()
+
+    def close():
+        flush()
+        writer.close()
+        os.replace(tmp_path, tmp_path.with_suffix('.parquet'))
+
+    try:
+        for distributor_id, month, *row in changed_rows(table, since, until).iterator(chunk_size=SNAPSHOT_BATCH_SIZE):
+            if (distributor_id, month) != partition:
+                if writer is not None:
+                    close()
+                partition = (distributor_id, month)
+                directory = SNAPSHOT_DIR / partition_path(table, distributor_id, month)
+                directory.mkdir(parents=True, exist_ok=True)
+                # Written under a temporary name so readers never see half a file
+                tmp_path = directory / f"part-{run_id}.tmp"
+                writer = pq.ParquetWriter(tmp_path, schema)
+                files += 1
+            batch.append(row)
+            written += 1
+            if len(batch) >= SNAPSHOT_BATCH_SIZE:
+                flush()
+        if writer is not None:
+            close()
+            writer = None
+    finally:
+        if writer is not None:
+            writer.close()
+            tmp_path.unlink(missing_ok=True)
+    return written, files
+
+
+def write_snapshot(tables=None, full=False):
+    """
+    Append every row changed since the last run to the snapshot. With
+    `full`, the watermarks are ignored and every row is written again.
+    Returns {table: {"rows": n, "files": n, "watermark": iso}}.
+    """
+    pa, pq = load_pyarrow()
+    tables = tables or list(TABLES)
+    unknown = set(tables) - set(TABLES)
+    if unknown:
+        raise SnapshotError(f"Unknown snapshot tables: {', '.join(sorted(unknown))}.")
+
+    SNAPSHOT_DIR.mkdir(parents=True, exist_ok=True)
+    with open(SNAPSHOT_DIR / LOCK_FILE, 'w') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise SnapshotBusy("Another snapshot is being written.")
+
+        state = read_state()
+        until = timezone.now() - WATERMARK_LAG
+        run_id = f"{until:%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}"
+        summary = {}
+        for table in tables:
+            since = None if full else state.get(table, {}).get('watermark')
+            if since is not None:
+                since = datetime.fromisoformat(since)
+            rows, files = write_table(pa, pq, table, since, until, run_id)
+            # Saved per table, so a failure later in the run keeps this progress
+            state[table] = {'watermark': until.isoformat()}
+            write_state(state)
+            summary[table] = {'rows': rows, 'files': files, 'watermark': until.isoformat()}
+    return summary
+
+
+def list_snapshot_files(distributor_id=None):
+    """Part files under SNAPSHOT_DIR, optionally only one distributor's partitions."""
+    files = []
+    for table in TABLES:
+        root = SNAPSHOT_DIR / table
+        pattern = f"distributor={distributor_id}/month=*/*.parquet" if distributor_id is not None else "*/month=*/*.parquet"
+        for path in sorted(root.glob(pattern)):
+            stat = path.stat()
+            files.append({
+                'table': table,
+                'path': path.relative_to(SNAPSHOT_DIR).as_posix(),
+                'size': stat.st_size,
+                'modified_at': datetime.fromtimestamp(stat.st_mtime, tz=dt_timezone.utc).isoformat(),
+            })
+    return files
+
+
+def resolve_snapshot_file(relative_path, distributor_id=None):
+    """
+    The absolute path of a listed part file, or None if `relative_path`
+    is not one (or, with `distributor_id`, belongs to someone else).
+    """
+    parts = Path(relative_path).parts
+    if len(parts) != 4 or parts[0] not in TABLES or not parts[3].endswith('.parquet'):
+        return None
+    if distributor_id is not None and parts[1] != f"distributor={distributor_id}":
+        return None
+    path = (SNAPSHOT_DIR / relative_path).resolve()
+    if SNAPSHOT_DIR.resolve() not in path.parents or not path.is_file():
+        return None
+    return path
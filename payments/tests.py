@@ -1,3 +1,1101 @@
-from django.test import TestCase
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from pathlib import Path
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db.models import Sum
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase
+from django.utils import timezone
+import pyarrow.parquet as pq
+from rest_framework.test import APIClient
+
+from clients.models import Customer
+from items.models import Fleet, Item, EncoderState
+from .models import DailyRevenueRollup, Payment, PaymentPlan, GeneratedCode, PaymentMessage, TokenRequest
+from .token_client import CircuitBreaker, CircuitOpenError, TokenClient, TokenServiceError
+from .token_engine import TokenEngineError, decode_token, generate_token, siphash_2_4
+from .admin import PaymentAdmin
+from .messages import message_catalogue
+from .plan_cache import get_distributor_plans, get_plan
+from .rollups import rebuild_rollups
+from .views import create_payment_record
+
+User = get_user_model()
+
+
+def reset_caches():
+    # Cached plans and messages outlive each test's database rollback
+    cache.clear()
+    message_catalogue.invalidate()
+
+
+def fake_token_response(encoder_state, token_type, token_value, timeout=None):
+    return {
+        "token": "123456789",
+        "token_type": token_type,
+        "token_value": token_value,
+        "max_count": (encoder_state.max_count or 0) + 1,
+    }
+
+
+class ConcurrentPaymentTests(TransactionTestCase):
+    """
+    Fire many payments at one item in parallel and check that no update to
+    the balance or the running totals is lost.
+    """
+    workers = 8
+    payments = 40
+
+    def setUp(self):
+        reset_caches()
+        self.distributor = User.objects.create_user(
+            email='distributor@example.com', password='pass', user_type='DISTRIBUTOR'
+        )
+        self.fleet = Fleet.objects.create(name='Fleet A', distributor=self.distributor)
+        self.item = Item.objects.create(serial_number='SN000001', fleet=self.fleet)
+        EncoderState.objects.create(
+            item=self.item, secret_key='key', starting_code='123456789', max_count=0
+        )
+
+    def pay(self, amount, idempotency_key=None):
+        client = APIClient()
+        client.force_authenticate(self.distributor)
+        headers = {'Idempotency-Key': idempotency_key} if idempotency_key else None
+        try:
+            response = client.post(
+                '/api/payments/make_payment/',
+                {'item_id': self.item.id, 'amount': str(amount)},
+                format='json', headers=headers
+            )
+            return response.status_code
+        finally:
+            connection.close()
+
+    def pay_in_parallel(self, amount):
+        with mock.patch('payments.tokens.call_external_api', side_effect=fake_token_response):
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                statuses = list(pool.map(self.pay, [amount] * self.payments))
+        self.assertEqual(statuses, [200] * self.payments)
+        self.item.refresh_from_db()
+
+    def test_parallel_payments_without_plan(self):
+        self.pay_in_parallel(Decimal('10.00'))
+
+        expected = Decimal('10.00') * self.payments
+        self.assertEqual(self.item.balance, expected)
+        self.assertEqual(self.item.total_paid, expected)
+        self.assertEqual(self.item.payments_count, self.payments)
+        self.assertEqual(self.item.payments.count(), self.payments)
+
+    def test_parallel_payments_with_interval_plan(self):
+        plan = PaymentPlan.objects.create(
+            distributor=self.distributor, name='Daily', total_amount=Decimal('100000.00'),
+            interval_type='daily', interval_amount=Decimal('25.00')
+        )
+        self.item.payment_plan = plan
+        self.item.save()
+
+        self.pay_in_parallel(Decimal('10.00'))
+
+        total = Decimal('10.00') * self.payments
+        days_issued = GeneratedCode.objects.filter(item=self.item).aggregate(
+            days=Sum('token_value')
+        )['days'] or 0
+        self.assertEqual(self.item.total_paid, total)
+        self.assertEqual(self.item.payments_count, self.payments)
+        # Every unit of money is either still on the balance or became token days
+        self.assertEqual(self.item.balance + plan.interval_amount * days_issued, total)
+        self.assertLess(self.item.balance, plan.interval_amount)
+
+
+    def test_parallel_duplicates_share_one_payment(self):
+        with mock.patch('payments.tokens.call_external_api', side_effect=fake_token_response):
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                statuses = list(pool.map(
+                    lambda _: self.pay(Decimal('10.00'), idempotency_key='retry-1'), range(self.workers)
+                ))
+        self.assertEqual(statuses, [200] * self.workers)
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.payments.count(), 1)
+        self.assertEqual(self.item.total_paid, Decimal('10.00'))
+
+
+class IdempotencyKeyTests(TestCase):
+
+    def setUp(self):
+        reset_caches()
+        self.distributor = User.objects.create_user(
+            email='distributor@example.com', password='pass', user_type='DISTRIBUTOR'
+        )
+        fleet = Fleet.objects.create(name='Fleet A', distributor=self.distributor)
+        self.item = Item.objects.create(serial_number='SN000001', fleet=fleet)
+        self.client = APIClient()
+        self.client.force_authenticate(self.distributor)
+
+    def pay(self, amount, key):
+        return self.client.post(
+            '/api/payments/make_payment/', {'item_id': self.item.id, 'amount': amount},
+            format='json', headers={'Idempotency-Key': key}
+        )
+
+    def test_replay_returns_stored_response(self):
+        first = self.pay('10.00', 'abc')
+        replayed = self.pay('10.00', 'abc')
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(replayed.status_code, 200)
+        self.assertEqual(replayed.data, first.data)
+        self.assertEqual(replayed['Idempotent-Replayed'], 'true')
+        self.assertEqual(self.item.payments.count(), 1)
+
+        self.assertEqual(self.pay('20.00', 'abc').status_code, 422)
+        self.assertEqual(self.pay('10.00', 'other').status_code, 200)
+        self.assertEqual(self.item.payments.count(), 2)
+
+
+class TokenOutboxTests(TestCase):
+    """
+    A failing token service must not lose the payment: the request answers
+    202 and the outbox worker issues the token later.
+    """
+
+    def setUp(self):
+        reset_caches()
+        self.distributor = User.objects.create_user(
+            email='distributor@example.com', password='pass', user_type='DISTRIBUTOR'
+        )
+        self.fleet = Fleet.objects.create(name='Fleet A', distributor=self.distributor)
+        plan = PaymentPlan.objects.create(
+            distributor=self.distributor, name='Daily', total_amount=Decimal('1000.00'),
+            interval_type='daily', interval_amount=Decimal('10.00')
+        )
+        self.item = Item.objects.create(serial_number='SN000001', fleet=self.fleet, payment_plan=plan)
+        EncoderState.objects.create(
+            item=self.item, secret_key='key', starting_code='123456789', max_count=0
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.distributor)
+
+    def test_payment_survives_token_service_outage(self):
+        with mock.patch('payments.tokens.call_external_api', side_effect=Exception("service down")):
+            response = self.client.post(
+                '/api/payments/make_payment/',
+                {'item_id': self.item.id, 'amount': '30.00'},
+                format='json'
+            )
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['token_status'], 'pending')
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.total_paid, Decimal('30.00'))
+        self.assertEqual(self.item.balance, Decimal('0.00'))
+
+        with mock.patch('payments.tokens.call_external_api', side_effect=fake_token_response):
+            call_command('process_token_outbox', stdout=mock.MagicMock())
+
+        response = self.client.get(f"/api/token_requests/{response.data['token_request_id']}/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], 'completed')
+        self.assertEqual(response.data['token'], '123456789')
+        self.assertEqual(GeneratedCode.objects.get(item=self.item).token_value, 3)
+        self.assertFalse(TokenRequest.objects.filter(status='pending').exists())
+
+    def test_permanent_failure_refunds_the_debit(self):
+        with mock.patch('payments.tokens.call_external_api', side_effect=Exception("service down")), \
+                mock.patch('payments.tokens.MAX_TOKEN_ATTEMPTS', 2):
+            response = self.client.post(
+                '/api/payments/make_payment/', {'item_id': self.item.id, 'amount': '35.00'}, format='json'
+            )
+            self.assertEqual(response.status_code, 202)
+            self.assertEqual(response.data['detail'], "Request recorded; the token is still being generated.")
+            self.item.refresh_from_db()
+            self.assertEqual(self.item.balance, Decimal('5.00'))
+            call_command('process_token_outbox', stdout=StringIO())
+
+        token_request = TokenRequest.objects.get(pk=response.data['token_request_id'])
+        self.assertEqual((token_request.status, token_request.attempts), ('failed', 2))
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.balance, Decimal('35.00'))
+        # The refunded request no longer counts as debited
+        call_command('audit_item_balances', stdout=StringIO())
+
+        # The next payment buys the refunded intervals again
+        with mock.patch('payments.tokens.call_external_api', side_effect=fake_token_response):
+            response = self.client.post(
+                '/api/payments/make_payment/', {'item_id': self.item.id, 'amount': '5.00'}, format='json'
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['detail'], "Payment successful, token generated via external API.")
+        self.assertEqual(response.data['days'], 4)
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.balance, Decimal('0.00'))
+
+
+class TokenClientTests(SimpleTestCase):
+
+    def make_client(self, *responses):
+        client = TokenClient(backoff_base=0, breaker=CircuitBreaker(threshold=2, reset_timeout=60))
+        client.session.post = mock.Mock(side_effect=list(responses))
+        return client
+
+    def answer(self, status_code, body=None):
+        return mock.Mock(status_code=status_code, json=mock.Mock(return_value=body),
+                         raise_for_status=mock.Mock())
+
+    def test_retries_server_errors(self):
+        client = self.make_client(self.answer(503), self.answer(200, {"token": "1"}))
+        self.assertEqual(client.issue({}), {"token": "1"})
+        self.assertEqual(client.session.post.call_count, 2)
+        self.assertIn('open_token_retries_total 1', client.metrics.render(client.breaker))
+
+    def test_breaker_fails_fast_after_repeated_failures(self):
+        client = self.make_client(*[self.answer(503)] * 6)
+        for _ in range(2):
+            with self.assertRaises(TokenServiceError):
+                client.issue({})
+        self.assertEqual(client.session.post.call_count, 6)
+        with self.assertRaises(CircuitOpenError):
+            client.issue({})
+        self.assertEqual(client.session.post.call_count, 6)
+        self.assertIn('open_token_circuit_open 1', client.metrics.render(client.breaker))
+
+
+class TokenEngineTests(SimpleTestCase):
+    """
+    Golden vectors produced by the OpenPAYGO reference encoder
+    (openpaygo 0.6.3, OpenPAYGOTokenEncoder.generate_token).
+    """
+    secret_key = "a29ab82edc5fbbc41ec9530f6dac86b1"
+    vectors = [
+        # token_type, count, value, starting_code, new_count, token
+        ("ADD_TIME", 0, 1, "123456789", 2, "662486790"),
+        ("ADD_TIME", 1, 7, "123456789", 2, "016609796"),
+        ("ADD_TIME", 10, 30, "123456789", 12, "873819819"),
+        ("SET_TIME", 4, 995, "123456789", 5, "346344784"),
+        ("DISABLE_PAYG", 11, 1, "123456789", 13, "940655787"),
+        ("COUNTER_SYNC", 20, None, "123456789", 21, "252775788"),
+        ("ADD_TIME", 137, 0, "987654321", 138, "053905321"),
+        ("ADD_TIME", 0, 1, None, 2, "295662004"),
+    ]
+
+    def test_siphash_reference_vector(self):
+        self.assertEqual(siphash_2_4(bytes(range(16)), bytes(range(15))), 0xa129ca6149be45e5)
+
+    def test_golden_vectors(self):
+        for token_type, count, value, starting_code, new_count, token in self.vectors:
+            with self.subTest(token_type=token_type, count=count):
+                self.assertEqual(
+                    generate_token(self.secret_key, count, token_type, value, starting_code),
+                    (new_count, token)
+                )
+
+
+    def test_decode_round_trip(self):
+        for token_type, count, value, starting_code, new_count, token in self.vectors:
+            with self.subTest(token_type=token_type, count=count):
+                decoded_value, decoded_type, decoded_count = decode_token(
+                    self.secret_key, token, count, starting_code
+                )
+                self.assertEqual((decoded_type, decoded_count), (token_type, new_count))
+        self.assertIsNone(decode_token(self.secret_key, "000000000", 10, "123456789"))
+
+    def test_decode_rejects_bad_starting_code(self):
+        with self.assertRaises(TokenEngineError):
+            decode_token(self.secret_key, "662486790", 0, "not-a-number")
+
+    def test_fractional_values_are_rejected(self):
+        self.assertEqual(generate_token(self.secret_key, 0, "ADD_TIME", 1.0, "123456789"), (2, "662486790"))
+        for value in [0.125, 1.5, 2.75]:
+            with self.subTest(value=value), self.assertRaises(TokenEngineError):
+                generate_token(self.secret_key, 0, "ADD_TIME", value, "123456789")
+
+
+class LocalTokenEngineTests(TestCase):
+
+    def test_local_distributor_never_calls_remote_service(self):
+        reset_caches()
+        distributor = User.objects.create_user(
+            email='distributor@example.com', password='pass', user_type='DISTRIBUTOR',
+            token_engine='LOCAL'
+        )
+        fleet = Fleet.objects.create(name='Fleet A', distributor=distributor)
+        item = Item.objects.create(serial_number='SN000001', fleet=fleet)
+        EncoderState.objects.create(
+            item=item, secret_key=TokenEngineTests.secret_key, starting_code='123456789', max_count=0
+        )
+        client = APIClient()
+        client.force_authenticate(distributor)
+
+        with mock.patch('payments.tokens.call_external_api') as remote:
+            response = client.post(
+                '/api/item/generate_token/',
+                {'item_id': item.id, 'token_type': 'ADD_TIME', 'token_value': 1},
+                format='json'
+            )
+        remote.assert_not_called()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['token'], '662486790')
+        self.assertEqual(int(response.data['max_count']), 2)
+
+        verify = client.post(
+            f'/api/items/{item.id}/verify_token/', {'token': '662 486 790'}, format='json'
+        )
+        self.assertEqual(verify.status_code, 200)
+        self.assertEqual(verify.data['status'], 'issued')
+        self.assertEqual(verify.data['count'], 2)
+        self.assertEqual(verify.data['token_value'], 1)
+        self.assertTrue(verify.data['is_latest'])
+
+        EncoderState.objects.filter(item=item).update(starting_code='12a')
+        verify = client.post(f'/api/items/{item.id}/verify_token/', {'token': '662486790'}, format='json')
+        self.assertEqual(verify.status_code, 400)
+
+    def test_hourly_plans_are_debited_in_whole_days(self):
+        reset_caches()
+        distributor = User.objects.create_user(
+            email='distributor@example.com', password='pass', user_type='DISTRIBUTOR',
+            token_engine='LOCAL'
+        )
+        plan = PaymentPlan.objects.create(
+            distributor=distributor, name='Hourly', total_amount=Decimal('1000.00'),
+            interval_type='hourly', interval_amount=Decimal('1.00')
+        )
+        fleet = Fleet.objects.create(name='Fleet A', distributor=distributor)
+        item = Item.objects.create(serial_number='SN000001', fleet=fleet, payment_plan=plan)
+        EncoderState.objects.create(
+            item=item, secret_key=TokenEngineTests.secret_key, starting_code='123456789', max_count=0
+        )
+        client = APIClient()
+        client.force_authenticate(distributor)
+
+        # Five hours is less than a day: nothing is debited or issued
+        response = client.post('/api/payments/make_payment/', {'item_id': item.id, 'amount': '5.00'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('token', response.data)
+        self.assertFalse(TokenRequest.objects.exists())
+
+        # 53 hours buy two days; five hours stay on the balance
+        response = client.post('/api/payments/make_payment/', {'item_id': item.id, 'amount': '48.00'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['days'], 2)
+        self.assertEqual(response.data['detail'], "Payment successful, token generated by the local token engine.")
+        item.refresh_from_db()
+        self.assertEqual(item.balance, Decimal('5.00'))
+        self.assertAlmostEqual(
+            (item.credit_expires_at - timezone.now()).total_seconds(), timedelta(days=2).total_seconds(), delta=60
+        )
+
+
+class BatchTokenTests(TestCase):
+
+    def setUp(self):
+        reset_caches()
+        self.distributor = User.objects.create_user(
+            email='distributor@example.com', password='pass', user_type='DISTRIBUTOR'
+        )
+        self.fleet = Fleet.objects.create(name='Fleet A', distributor=self.distributor)
+        self.items = []
+        for n in range(3):
+            item = Item.objects.create(serial_number=f'SN00000{n}', fleet=self.fleet)
+            EncoderState.objects.create(
+                item=item, secret_key='key', starting_code='123456789', max_count=0
+            )
+            self.items.append(item)
+        self.client = APIClient()
+        self.client.force_authenticate(self.distributor)
+
+    def test_batch_keeps_per_item_order(self):
+        first, second, _ = self.items
+        tokens = [
+            {'item_id': first.id, 'token_type': 'ADD_TIME', 'token_value': 1},
+            {'item_id': second.id, 'token_type': 'ADD_TIME', 'token_value': 2},
+            {'item_id': first.id, 'token_type': 'ADD_TIME', 'token_value': 3},
+            {'item_id': 999999, 'token_type': 'ADD_TIME', 'token_value': 1},
+        ]
+        with mock.patch('payments.tokens.call_external_api', side_effect=fake_token_response):
+            response = self.client.post('/api/items/generate_tokens/', {'tokens': tokens}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        results = response.data['results']
+        self.assertEqual([r['status'] for r in results], ['completed'] * 3)
+        self.assertEqual([int(r['max_count']) for r in results], [1, 1, 2])
+        self.assertEqual([e['index'] for e in response.data['errors']], [3])
+        self.assertEqual(
+            list(GeneratedCode.objects.filter(item=first).order_by('pk').values_list('token_value', flat=True)),
+            [1, 3]
+        )
+        first.encoder_state.refresh_from_db()
+        self.assertEqual(first.encoder_state.max_count, 2)
+
+    def test_batch_for_fleet(self):
+        with mock.patch('payments.tokens.call_external_api', side_effect=fake_token_response):
+            response = self.client.post(
+                '/api/items/generate_tokens/',
+                {'fleet_id': self.fleet.id, 'token_type': 'ADD_TIME', 'token_value': 3},
+                format='json'
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 3)
+        self.assertEqual(GeneratedCode.objects.filter(token_value=3).count(), 3)
+        self.assertFalse(TokenRequest.objects.exclude(status='completed').exists())
+
+
+class MessageCatalogueTests(TestCase):
+
+    def setUp(self):
+        reset_caches()
+
+    def test_keyed_lookup_is_cached_and_refreshed_on_edit(self):
+        daily = message_catalogue.get('interval_daily', "Code generated for daily usage.")
+        completion = message_catalogue.get('completion', "Congratulations! Full payment completed.")
+        self.assertNotEqual(daily.pk, completion.pk)
+
+        message_catalogue.get('interval_daily', "ignored")
+        with self.assertNumQueries(0):
+            self.assertEqual(message_catalogue.get('interval_daily', "ignored").pk, daily.pk)
+
+        # A soft-deleted message keeps its key and is neither undeleted nor recreated
+        PaymentMessage.objects.filter(pk=daily.pk).get().delete()
+        kept = message_catalogue.get('interval_daily', "Code generated for daily usage.")
+        self.assertEqual(kept.pk, daily.pk)
+        self.assertTrue(PaymentMessage.all_objects.get(pk=daily.pk).deleted_status)
+
+        completion.message = "Paid in full!"
+        completion.save()
+        self.assertEqual(message_catalogue.get('completion', "ignored").message, "Paid in full!")
+
+    def test_existing_rows_are_not_overwritten_with_defaults(self):
+        PaymentMessage.objects.create(key='token_ADD_TIME', message="Edited by an admin")
+        message_catalogue.invalidate()
+        self.assertEqual(message_catalogue.get('token_ADD_TIME', "Default").message, "Edited by an admin")
+        self.assertEqual(PaymentMessage.all_objects.filter(key='token_ADD_TIME').count(), 1)
+
+    def test_edits_from_other_processes_are_picked_up(self):
+        completion = message_catalogue.get('completion', "Congratulations! Full payment completed.")
+        # Another process edits the row: no signal reaches this one
+        PaymentMessage.objects.filter(pk=completion.pk).update(message="Paid in full!", updated_at=timezone.now())
+        with mock.patch('payments.messages.CATALOGUE_RECHECK_SECONDS', 0):
+            self.assertEqual(message_catalogue.get('completion', "ignored").message, "Paid in full!")
+
+
+class PaymentPlanCacheTests(TestCase):
+
+    def setUp(self):
+        reset_caches()
+        self.distributor = User.objects.create_user(
+            email='distributor@example.com', password='pass', user_type='DISTRIBUTOR'
+        )
+        self.plan = PaymentPlan.objects.create(
+            distributor=self.distributor, name='Daily', total_amount=Decimal('1000.00'),
+            interval_type='daily', interval_amount=Decimal('10.00')
+        )
+
+    def test_plans_are_served_from_cache_until_changed(self):
+        self.assertEqual(get_plan(self.plan.pk).name, 'Daily')
+        with self.assertNumQueries(0):
+            self.assertEqual(get_plan(self.plan.pk).name, 'Daily')
+            self.assertEqual(len(get_distributor_plans(self.distributor.id)), 1)
+
+        self.plan.name = 'Daily v2'
+        self.plan.save()
+        self.assertEqual(get_plan(self.plan.pk).name, 'Daily v2')
+
+        self.plan.delete()
+        self.assertIsNone(get_plan(self.plan.pk))
+        self.assertEqual(get_distributor_plans(self.distributor.id), [])
+        self.assertEqual(get_plan(self.plan.pk, include_deleted=True).pk, self.plan.pk)
+
+    def test_assign_plan_uses_cached_plan(self):
+        fleet = Fleet.objects.create(name='Fleet A', distributor=self.distributor)
+        item = Item.objects.create(serial_number='SN000001', fleet=fleet)
+        client = APIClient()
+        client.force_authenticate(self.distributor)
+        get_plan(self.plan.pk)
+
+        with self.assertNumQueries(3):
+            # Item exists check, item with its fleet, UPDATE; none for the plan
+            response = client.post(
+                '/api/items/assign_payment_plan/',
+                {'item_id': item.id, 'payment_plan_id': self.plan.pk}, format='json'
+            )
+        self.assertEqual(response.status_code, 200)
+        item.refresh_from_db()
+        self.assertEqual(item.payment_plan_id, self.plan.pk)
+
+
+class BulkPlanAssignmentTests(TestCase):
+
+    def setUp(self):
+        reset_caches()
+        self.distributor = User.objects.create_user(
+            email='distributor@example.com', password='pass', user_type='DISTRIBUTOR'
+        )
+        other = User.objects.create_user(
+            email='other@example.com', password='pass', user_type='DISTRIBUTOR'
+        )
+        self.fleet = Fleet.objects.create(name='Fleet A', distributor=self.distributor)
+        self.plan = PaymentPlan.objects.create(
+            distributor=self.distributor, name='Daily', total_amount=Decimal('100.00'),
+            interval_type='daily', interval_amount=Decimal('10.00')
+        )
+        self.paid = Item.objects.create(serial_number='SN000001', fleet=self.fleet, total_paid=Decimal('150.00'))
+        self.part = Item.objects.create(serial_number='SN000002', fleet=self.fleet, total_paid=Decimal('20.00'))
+        self.unpaid = Item.objects.create(serial_number='SN000003', fleet=self.fleet)
+        self.foreign = Item.objects.create(
+            serial_number='SN000004', fleet=Fleet.objects.create(name='Fleet B', distributor=other)
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.distributor)
+
+    def assert_statuses(self):
+        for item, expected in [(self.paid, 'fully_paid'), (self.part, 'partially_paid'), (self.unpaid, 'pending')]:
+            item.refresh_from_db()
+            self.assertEqual(item.payment_plan_id, self.plan.id)
+            self.assertEqual(item.status, expected)
+
+    def test_assign_by_item_ids(self):
+        item_ids = [self.paid.id, self.part.id, self.unpaid.id, self.foreign.id, 999999]
+        get_plan(self.plan.id)
+        with self.assertNumQueries(5):
+            # Classify, then in one transaction: UPDATE plan, UPDATE statuses
+            response = self.client.post(
+                '/api/items/bulk_assign_payment_plan/',
+                {'payment_plan_id': self.plan.id, 'item_ids': item_ids}, format='json'
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['assigned_count'], 3)
+        self.assertEqual(response.data['status_changed'], 2)
+        self.assertEqual([e['item_id'] for e in response.data['errors']], [self.foreign.id, 999999])
+        self.assert_statuses()
+        self.foreign.refresh_from_db()
+        self.assertIsNone(self.foreign.payment_plan_id)
+
+    def test_assign_by_fleet(self):
+        response = self.client.post(
+            '/api/items/bulk_assign_payment_plan/',
+            {'payment_plan_id': self.plan.id, 'fleet_id': self.fleet.id}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['assigned_count'], 3)
+        self.assert_statuses()
+
+    def test_plan_total_change_recomputes_statuses(self):
+        Item.objects.filter(pk__in=[self.paid.pk, self.part.pk, self.unpaid.pk]).update(payment_plan=self.plan)
+        call_command('recompute_item_statuses', plan=self.plan.id, stdout=StringIO())
+        self.assert_statuses()
+
+        response = self.client.patch(
+            f'/api/payment_plans/{self.plan.id}/', {'total_amount': '200.00'}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.paid.refresh_from_db()
+        self.assertEqual(self.paid.status, 'partially_paid')
+
+    def test_recompute_from_ledger(self):
+        Item.objects.filter(pk=self.unpaid.pk).update(payment_plan=self.plan)
+        Payment.objects.create(item=self.unpaid, amount_paid=Decimal('60.00'))
+        Payment.objects.create(item=self.unpaid, amount_paid=Decimal('40.00'))
+
+        call_command('recompute_item_statuses', fleet=self.fleet.id, stdout=StringIO())
+        self.unpaid.refresh_from_db()
+        self.assertEqual(self.unpaid.status, 'pending')
+
+        call_command('recompute_item_statuses', distributor=self.distributor.id, from_ledger=True, stdout=StringIO())
+        self.unpaid.refresh_from_db()
+        self.assertEqual(self.unpaid.status, 'fully_paid')
+
+
+class BalanceAuditTests(TestCase):
+
+    def setUp(self):
+        distributor = User.objects.create_user(
+            email='distributor@example.com', password='pass', user_type='DISTRIBUTOR'
+        )
+        self.fleet = Fleet.objects.create(name='Fleet A', distributor=distributor)
+        daily = PaymentPlan.objects.create(
+            distributor=distributor, name='Daily', total_amount=Decimal('1000.00'),
+            interval_type='daily', interval_amount=Decimal('10.00')
+        )
+        hourly = PaymentPlan.objects.create(
+            distributor=distributor, name='Hourly', total_amount=Decimal('1000.00'),
+            interval_type='hourly', interval_amount=Decimal('0.50')
+        )
+        # 25 paid, two days debited; 2.00 paid, three hours debited
+        self.daily_item = self.make_item('SN000001', daily, Decimal('25.00'), 2, Decimal('5.00'))
+        self.hourly_item = self.make_item('SN000002', hourly, Decimal('2.00'), 3 / 24, Decimal('0.50'))
+        # A manual token carries no payment and debits nothing
+        TokenRequest.objects.create(item=self.daily_item, token_type='ADD_TIME', token_value=7)
+
+    def make_item(self, serial_number, plan, amount, days, balance):
+        item = Item.objects.create(serial_number=serial_number, fleet=self.fleet, payment_plan=plan, balance=balance)
+        payment = Payment.objects.create(item=item, payment_plan=plan, amount_paid=amount)
+        TokenRequest.objects.create(item=item, payment=payment, token_type='ADD_TIME', token_value=days)
+        return item
+
+    def test_consistent_balances_pass(self):
+        out = StringIO()
+        call_command('audit_item_balances', stdout=out)
+        self.assertIn('All item balances match', out.getvalue())
+
+    def test_drift_is_reported_and_repaired(self):
+        Item.objects.filter(pk=self.daily_item.pk).update(balance=Decimal('15.00'))
+        out = StringIO()
+        with self.assertRaises(CommandError):
+            call_command('audit_item_balances', stdout=out)
+        self.assertIn(f"Item {self.daily_item.pk} (SN000001)", out.getvalue())
+
+        call_command('audit_item_balances', repair=True, stdout=StringIO())
+        self.daily_item.refresh_from_db()
+        self.assertEqual(self.daily_item.balance, Decimal('5.00'))
+        call_command('audit_item_balances', stdout=StringIO())
+
+    def test_codes_issued_before_the_outbox_count_as_debits(self):
+        # Paid 30, then a 2-day code was issued without a TokenRequest
+        legacy = Item.objects.create(
+            serial_number='SN000003', fleet=self.fleet, payment_plan=self.daily_item.payment_plan,
+            balance=Decimal('10.00')
+        )
+        Payment.objects.create(item=legacy, payment_plan=legacy.payment_plan, amount_paid=Decimal('30.00'))
+        GeneratedCode.objects.create(
+            item=legacy, token='123456789', token_type='ADD_TIME', token_value=2,
+            payment_message=PaymentMessage.objects.create(message="Code generated for daily usage.")
+        )
+        call_command('audit_item_balances', stdout=StringIO())
+
+        Item.objects.filter(pk=legacy.pk).update(balance=Decimal('0.00'))
+        Item.objects.filter(pk=self.daily_item.pk).update(balance=Decimal('15.00'))
+        out = StringIO()
+        with self.assertRaises(CommandError):
+            call_command('audit_item_balances', stdout=out)
+        self.assertIn(f"Item {legacy.pk} (SN000003)", out.getvalue())
+        self.assertIn('[pre-outbox codes, estimated]', out.getvalue())
+
+        # The estimate may count a manual code as a debit, so it is not repaired
+        out = StringIO()
+        call_command('audit_item_balances', repair=True, stdout=out)
+        self.assertIn('Repaired the balance of 1 items', out.getvalue())
+        self.assertIn('Skipped 1 items', out.getvalue())
+        self.assertEqual(Item.objects.get(pk=legacy.pk).balance, Decimal('0.00'))
+        self.assertEqual(Item.objects.get(pk=self.daily_item.pk).balance, Decimal('5.00'))
+
+
+class ItemPaymentTotalsTests(TestCase):
+
+    def setUp(self):
+        distributor = User.objects.create_user(
+            email='distributor@example.com', password='pass', user_type='DISTRIBUTOR'
+        )
+        fleet = Fleet.objects.create(name='Fleet A', distributor=distributor)
+        self.item = Item.objects.create(serial_number='SN000001', fleet=fleet)
+        self.other = Item.objects.create(serial_number='SN000002', fleet=fleet)
+
+    def pay(self, item, amount):
+        with transaction.atomic():
+            return create_payment_record(item, None, Decimal(amount), None, '')
+
+    def test_payments_increment_running_totals(self):
+        self.pay(self.item, '10.00')
+        # The stale instance must not matter, the UPDATE works on the row
+        last = self.pay(self.item, '2.50')
+        self.item.refresh_from_db()
+        self.assertEqual(
+            (self.item.balance, self.item.total_paid, self.item.payments_count, self.item.last_payment_at),
+            (Decimal('12.50'), Decimal('12.50'), 2, last.paid_at)
+        )
+        self.assertEqual(Item.objects.get(pk=self.other.pk).payments_count, 0)
+
+    def test_backfill_and_verify(self):
+        self.pay(self.item, '10.00')
+        last = self.pay(self.item, '5.00')
+        call_command('sync_item_payment_totals', verify=True, stdout=StringIO())
+
+        for drift in [
+            {'total_paid': Decimal('0.00')},
+            {'payments_count': 7},
+            {'last_payment_at': last.paid_at - timedelta(days=1)},
+            {'last_payment_at': None},
+        ]:
+            with self.subTest(drift=drift):
+                Item.objects.filter(pk=self.item.pk).update(**drift)
+                Item.objects.filter(pk=self.other.pk).update(last_payment_at=timezone.now())
+                out = StringIO()
+                with self.assertRaises(CommandError):
+                    call_command('sync_item_payment_totals', verify=True, stdout=out)
+                self.assertIn(f"Item {self.item.pk} (SN000001)", out.getvalue())
+                self.assertIn(f"Item {self.other.pk} (SN000002)", out.getvalue())
+
+                call_command('sync_item_payment_totals', stdout=StringIO())
+                call_command('sync_item_payment_totals', verify=True, stdout=StringIO())
+                self.item.refresh_from_db()
+                self.assertEqual(
+                    (self.item.total_paid, self.item.payments_count, self.item.last_payment_at),
+                    (Decimal('15.00'), 2, last.paid_at)
+                )
+                self.assertIsNone(Item.objects.get(pk=self.other.pk).last_payment_at)
+
+    def test_deleting_a_payment_reverses_its_totals(self):
+        first = self.pay(self.item, '10.00')
+        last = self.pay(self.item, '2.50')
+        last.delete()
+        self.item.refresh_from_db()
+        self.assertEqual(
+            (self.item.balance, self.item.total_paid, self.item.payments_count, self.item.last_payment_at),
+            (Decimal('10.00'), Decimal('10.00'), 1, first.paid_at)
+        )
+
+        # Deleting it again changes nothing
+        Payment.all_objects.get(pk=last.pk).delete()
+        first.delete()
+        self.item.refresh_from_db()
+        self.assertEqual(
+            (self.item.balance, self.item.total_paid, self.item.payments_count, self.item.last_payment_at),
+            (Decimal('0.00'), Decimal('0.00'), 0, None)
+        )
+        call_command('sync_item_payment_totals', verify=True, stdout=StringIO())
+
+
+class DistributorPaymentLedgerTests(TestCase):
+
+    def setUp(self):
+        reset_caches()
+        self.distributor = User.objects.create_user(
+            email='distributor@example.com', password='pass', user_type='DISTRIBUTOR'
+        )
+        other = User.objects.create_user(email='other@example.com', password='pass', user_type='DISTRIBUTOR')
+        self.fleet = Fleet.objects.create(name='Fleet A', distributor=self.distributor)
+        fleet_b = Fleet.objects.create(name='Fleet B', distributor=self.distributor)
+        self.plan = PaymentPlan.objects.create(
+            distributor=self.distributor, name='Daily', total_amount=Decimal('100.00'),
+            interval_type='daily', interval_amount=Decimal('10.00')
+        )
+        self.customer = Customer.objects.create(
+            name='Jane', email='jane@example.com', phone_number='0700000001', distributor=self.distributor
+        )
+        item_a = Item.objects.create(
+            serial_number='SN000001', fleet=self.fleet, payment_plan=self.plan, customer=self.customer
+        )
+        item_b = Item.objects.create(serial_number='SN000002', fleet=fleet_b)
+        foreign = Item.objects.create(
+            serial_number='SN000003', fleet=Fleet.objects.create(name='Fleet C', distributor=other)
+        )
+
+        self.payments = {}
+        for name, item, plan, day in [
+            ('march', item_a, self.plan, '2026-03-31T23:00:00Z'),
+            ('april', item_a, self.plan, '2026-04-01T08:00:00Z'),
+            ('other_fleet', item_b, None, '2026-04-15T08:00:00Z'),
+            ('foreign', foreign, None, '2026-04-15T08:00:00Z'),
+        ]:
+            with transaction.atomic():
+                payment = create_payment_record(item, plan, Decimal('10.00'), item.customer, '')
+            Payment.objects.filter(pk=payment.pk).update(paid_at=day)
+            self.payments[name] = payment.pk
+        self.client = APIClient()
+        self.client.force_authenticate(self.distributor)
+
+    def ids(self, response):
+        self.assertEqual(response.status_code, 200)
+        rows = response.data['results'] if 'results' in response.data else response.data
+        return [row['id'] for row in rows]
+
+    def test_payments_are_stamped_with_distributor(self):
+        self.assertEqual(
+            Payment.objects.filter(distributor=self.distributor).count(), 3
+        )
+
+    def test_filters(self):
+        p = self.payments
+        self.assertEqual(self.ids(self.client.get('/api/payments/')), [p['other_fleet'], p['april'], p['march']])
+        self.assertEqual(
+            self.ids(self.client.get('/api/payments/', {'date_from': '2026-04-01', 'date_to': '2026-04-01'})),
+            [p['april']]
+        )
+        self.assertEqual(self.ids(self.client.get('/api/payments/', {'date_to': '2026-03-31'})), [p['march']])
+        self.assertEqual(self.ids(self.client.get('/api/payments/', {'fleet_id': self.fleet.id})), [p['april'], p['march']])
+        self.assertEqual(
+            self.ids(self.client.get('/api/payments/', {'payment_plan_id': self.plan.id, 'customer_id': self.customer.id})),
+            [p['april'], p['march']]
+        )
+        self.assertEqual(self.client.get('/api/payments/', {'date_from': 'April'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/payments/', {'fleet_id': 'x'}).status_code, 400)
+
+    def test_pages_in_one_query_each(self):
+        with self.assertNumQueries(1):
+            first = self.client.get('/api/payments/', {'page_size': 2})
+        self.assertEqual(self.ids(first), [self.payments['other_fleet'], self.payments['april']])
+        second = self.client.get('/api/payments/', {'page_size': 2, 'cursor': first.data['next_cursor']})
+        self.assertEqual(self.ids(second), [self.payments['march']])
+        self.assertIsNone(second.data['next_cursor'])
+
+    def test_csv_exports(self):
+        response = self.client.get('/api/payments/export/', {'fleet_id': self.fleet.id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0].split(',')[:3], ['payment_id', 'paid_at', 'amount_paid'])
+        self.assertEqual(len(lines), 3)
+        self.assertIn('SN000001,Fleet A,%d,Jane,0700000001,%d,Daily' % (self.customer.id, self.plan.id), lines[1])
+
+        item = Item.objects.get(serial_number='SN000001')
+        GeneratedCode.objects.create(
+            item=item, token='123456789', token_type='ADD_TIME', token_value=2, max_count='2',
+            payment_message=PaymentMessage.objects.create(message='Code generated for daily usage.')
+        )
+        response = self.client.get('/api/generated_codes/export/')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[1].endswith('SN000001,Fleet A,Jane,123456789,ADD_TIME,2,2,Code generated for daily usage.'))
+
+
+class AnalyticsSnapshotTests(TestCase):
+
+    def setUp(self):
+        self.distributor = User.objects.create_user(
+            email='distributor@example.com', password='pass', user_type='DISTRIBUTOR'
+        )
+        self.admin = User.objects.create_user(email='admin@example.com', password='pass', user_type='SUPER_ADMIN')
+        fleet = Fleet.objects.create(name='Fleet A', distributor=self.distributor)
+        self.item = Item.objects.create(serial_number='SN000001', fleet=fleet)
+        with transaction.atomic():
+            create_payment_record(self.item, None, Decimal('12.50'), None, '')
+
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = Path(tmp.name)
+        for patcher in [
+            mock.patch('payments.snapshots.SNAPSHOT_DIR', self.root),
+            mock.patch('payments.snapshots.WATERMARK_LAG', timedelta(0)),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.client = APIClient()
+
+    def make_part(self, distributor):
+        directory = self.root / 'payments' / f'distributor={distributor}' / 'month=2026-04'
+        directory.mkdir(parents=True)
+        (directory / 'part-1.parquet').write_bytes(b'PAR1')
+        return f'payments/distributor={distributor}/month=2026-04/part-1.parquet'
+
+    def test_files_are_scoped_to_the_distributor(self):
+        own = self.make_part(self.distributor.id)
+        other = self.make_part(self.distributor.id + 1)
+        self.client.force_authenticate(self.distributor)
+
+        response = self.client.get('/api/analytics/snapshots/')
+        self.assertEqual([f['path'] for f in response.data], [own])
+        response = self.client.get(f'/api/analytics/snapshots/{own}')
+        self.assertEqual(b''.join(response.streaming_content), b'PAR1')
+        self.assertEqual(self.client.get(f'/api/analytics/snapshots/{other}').status_code, 404)
+        self.assertEqual(self.client.get('/api/analytics/snapshots/payments/../../etc/passwd').status_code, 404)
+
+        self.client.force_authenticate(self.admin)
+        self.assertEqual(len(self.client.get('/api/analytics/snapshots/').data), 2)
+        # Snapshots are only written by the snapshot_ledger command
+        self.assertEqual(self.client.post('/api/analytics/snapshots/').status_code, 405)
+
+    def test_incremental_snapshot(self):
+        call_command('snapshot_ledger', stdout=StringIO())
+        parts = list(self.root.glob(f'payments/distributor={self.distributor.id}/month=*/*.parquet'))
+        self.assertEqual(len(parts), 1)
+        table = pq.read_table(parts[0])
+        self.assertEqual(str(table.schema.field('amount_paid').type), 'decimal128(10, 2)')
+        self.assertEqual(table.column('amount_paid').to_pylist(), [Decimal('12.50')])
+        self.assertEqual(table.column('fleet_id').to_pylist(), [self.item.fleet_id])
+        items = pq.read_table(next(self.root.glob('items/*/*/*.parquet')))
+        self.assertTrue(str(items.schema.field('status').type).startswith('dictionary'))
+
+        # Nothing changed: nothing appended
+        call_command('snapshot_ledger', stdout=StringIO())
+        self.assertEqual(len(list(self.root.glob('payments/*/*/*.parquet'))), 1)
+
+
+class RevenueRollupTests(TestCase):
+
+    def setUp(self):
+        reset_caches()
+        self.distributor = User.objects.create_user(
+            email='distributor@example.com', password='pass', user_type='DISTRIBUTOR'
+        )
+        self.fleet = Fleet.objects.create(name='Fleet A', distributor=self.distributor)
+        self.plan = PaymentPlan.objects.create(
+            distributor=self.distributor, name='Daily', total_amount=Decimal('1000.00'),
+            interval_type='daily', interval_amount=Decimal('10.00')
+        )
+        self.item_a = Item.objects.create(serial_number='SN000001', fleet=self.fleet, payment_plan=self.plan)
+        self.item_b = Item.objects.create(serial_number='SN000002', fleet=self.fleet, payment_plan=self.plan)
+        self.client = APIClient()
+        self.client.force_authenticate(self.distributor)
+
+    def pay(self, item, amount):
+        with transaction.atomic():
+            return create_payment_record(item, self.plan, Decimal(amount), None, '')
+
+    def rollups(self):
+        return list(DailyRevenueRollup.objects.order_by('day').values_list(
+            'day', 'fleet_id', 'payment_plan_id', 'amount', 'payments_count', 'items_count'
+        ))
+
+    def test_payments_roll_up_incrementally_and_rebuild_matches(self):
+        self.pay(self.item_a, '10.00')
+        self.pay(self.item_a, '5.00')
+        self.pay(self.item_b, '20.00')
+        today = timezone.localdate()
+        incremental = self.rollups()
+        self.assertEqual(incremental, [(today, self.fleet.id, self.plan.id, Decimal('35.00'), 3, 2)])
+
+        call_command('rebuild_revenue_rollups', stdout=StringIO())
+        self.assertEqual(self.rollups(), incremental)
+
+    def test_payments_stay_in_the_fleet_they_were_made_in(self):
+        self.pay(self.item_a, '10.00')
+        other_fleet = Fleet.objects.create(name='Fleet B', distributor=self.distributor)
+        self.item_a.fleet = other_fleet
+        self.item_a.save()
+        self.pay(self.item_a, '5.00')
+        today = timezone.localdate()
+        incremental = self.rollups()
+        self.assertEqual(sorted(incremental, key=lambda row: row[1]), [
+            (today, self.fleet.id, self.plan.id, Decimal('10.00'), 1, 1),
+            (today, other_fleet.id, self.plan.id, Decimal('5.00'), 1, 1),
+        ])
+
+        rebuild_rollups()
+        self.assertEqual(sorted(self.rollups()), sorted(incremental))
+
+    def test_deleted_payments_leave_their_rollup(self):
+        first = self.pay(self.item_a, '10.00')
+        self.pay(self.item_a, '5.00')
+        other = self.pay(self.item_b, '20.00')
+        today = timezone.localdate()
+
+        other.delete()
+        self.assertEqual(self.rollups(), [(today, self.fleet.id, self.plan.id, Decimal('15.00'), 2, 1)])
+        # item_a still has a payment that day, so it keeps counting
+        first.delete()
+        self.assertEqual(self.rollups(), [(today, self.fleet.id, self.plan.id, Decimal('5.00'), 1, 1)])
+        first.delete()
+        self.assertEqual(self.rollups(), [(today, self.fleet.id, self.plan.id, Decimal('5.00'), 1, 1)])
+
+        rebuild_rollups()
+        self.assertEqual(self.rollups(), [(today, self.fleet.id, self.plan.id, Decimal('5.00'), 1, 1)])
+
+    def test_admin_deletes_reverse_the_payments(self):
+        first = self.pay(self.item_a, '10.00')
+        self.pay(self.item_a, '5.00')
+        other = self.pay(self.item_b, '20.00')
+        admin_user = User.objects.create_superuser(email='admin@example.com', password='pass')
+        client = Client()
+        client.force_login(admin_user)
+
+        response = client.post(f'/admin/payments/payment/{other.pk}/delete/', {'post': 'yes'})
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(Payment.all_objects.get(pk=other.pk).deleted_status)
+        self.item_b.refresh_from_db()
+        self.assertEqual(
+            (self.item_b.balance, self.item_b.total_paid, self.item_b.payments_count),
+            (Decimal('0.00'), Decimal('0.00'), 0)
+        )
+
+        request = RequestFactory().post('/admin/payments/payment/')
+        request.user = admin_user
+        PaymentAdmin(Payment, admin.site).delete_queryset(request, Payment.objects.filter(item=self.item_a))
+        self.assertEqual(Payment.all_objects.filter(deleted_status=True).count(), 3)
+        self.item_a.refresh_from_db()
+        self.assertEqual(
+            (self.item_a.balance, self.item_a.total_paid, self.item_a.payments_count, self.item_a.last_payment_at),
+            (Decimal('0.00'), Decimal('0.00'), 0, None)
+        )
+        self.assertEqual(self.rollups(), [(timezone.localdate(), self.fleet.id, self.plan.id, Decimal('0.00'), 0, 0)])
+        self.assertFalse(Payment.objects.filter(pk=first.pk).exists())
+
+    def test_report_groups_rollups_by_period(self):
+        for day, amount in [('2026-01-05', '10.00'), ('2026-02-10', '20.00'), ('2026-02-11', '30.00')]:
+            payment = self.pay(self.item_a, amount)
+            Payment.objects.filter(pk=payment.pk).update(paid_at=f'{day}T10:00:00Z')
+        rebuild_rollups()
+
+        response = self.client.get('/api/reports/revenue/', {'period': 'month', 'breakdown': 'fleet'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(str(r['period']), r['fleet_id'], r['total_amount'], r['total_payments']) for r in response.data['results']],
+            [('2026-01-01', self.fleet.id, Decimal('10.00'), 1), ('2026-02-01', self.fleet.id, Decimal('50.00'), 2)]
+        )
+        response = self.client.get('/api/reports/revenue/', {'period': 'quarter', 'date_from': '2026-02-11'})
+        self.assertEqual([r['total_amount'] for r in response.data['results']], [Decimal('30.00')])
+        # A datetime bound still covers its whole day
+        response = self.client.get('/api/reports/revenue/', {'period': 'day', 'date_to': '2026-02-10T08:00:00Z'})
+        self.assertEqual([r['total_amount'] for r in response.data['results']], [Decimal('10.00'), Decimal('20.00')])
+        self.assertEqual(self.client.get('/api/reports/revenue/', {'period': 'decade'}).status_code, 400)
+
+
+class CreditExpiryTests(TestCase):
+
+    def setUp(self):
+        reset_caches()
+        self.distributor = User.objects.create_user(
+            email='distributor@example.com', password='pass', user_type='DISTRIBUTOR'
+        )
+        fleet = Fleet.objects.create(name='Fleet A', distributor=self.distributor)
+        self.item = Item.objects.create(serial_number='SN000001', fleet=fleet)
+        EncoderState.objects.create(item=self.item, secret_key='key', starting_code='123456789', max_count=0)
+        self.client = APIClient()
+        self.client.force_authenticate(self.distributor)
+
+    def issue(self, token_type, token_value):
+        with mock.patch('payments.tokens.call_external_api', side_effect=fake_token_response):
+            response = self.client.post(
+                '/api/item/generate_token/',
+                {'item_id': self.item.id, 'token_type': token_type, 'token_value': token_value},
+                format='json'
+            )
+        self.assertEqual(response.status_code, 200)
+        self.item.refresh_from_db()
+        return self.item.credit_expires_at
+
+    def assert_days_from_now(self, expires_at, days):
+        self.assertAlmostEqual(
+            (expires_at - timezone.now()).total_seconds(), timedelta(days=days).total_seconds(), delta=60
+        )
+
+    def test_tokens_move_the_expiry(self):
+        self.assert_days_from_now(self.issue('ADD_TIME', 2), 2)
+        # Added to the remaining credit
+        self.assert_days_from_now(self.issue('ADD_TIME', 3), 5)
+        self.assert_days_from_now(self.issue('SET_TIME', 1), 1)
+        self.assertIsNone(self.issue('DISABLE_PAYG', 1))
+
+    def test_expiry_follows_the_issued_value(self):
+        def rounding_service(encoder_state, token_type, token_value, timeout=None):
+            return {**fake_token_response(encoder_state, token_type, token_value), "token_value": round(token_value)}
+
+        plan = PaymentPlan.objects.create(
+            distributor=self.distributor, name='Hourly', total_amount=Decimal('1000.00'),
+            interval_type='hourly', interval_amount=Decimal('1.00')
+        )
+        Item.objects.filter(pk=self.item.pk).update(payment_plan=plan)
+        with mock.patch('payments.tokens.call_external_api', side_effect=rounding_service):
+            response = self.client.post(
+                '/api/payments/make_payment/', {'item_id': self.item.id, 'amount': '36.00'}, format='json'
+            )
+        self.assertEqual(response.status_code, 200)
+        self.item.refresh_from_db()
+        # 1.5 days were asked for, the service issued 2
+        self.assert_days_from_now(self.item.credit_expires_at, 2)
+
+    def test_batch_tokens_accumulate_per_item(self):
+        tokens = [
+            {'item_id': self.item.id, 'token_type': 'ADD_TIME', 'token_value': 1},
+            {'item_id': self.item.id, 'token_type': 'ADD_TIME', 'token_value': 6},
+        ]
+        with mock.patch('payments.tokens.call_external_api', side_effect=fake_token_response):
+            response = self.client.post('/api/items/generate_tokens/', {'tokens': tokens}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.item.refresh_from_db()
+        self.assert_days_from_now(self.item.credit_expires_at, 7)
@@ -0,0 +1,238 @@
+# token_client.py
+"""
+Client for the open-token service.
+
+One pooled keep-alive session is shared by the process. Every call has
+connect and read timeouts and is retried with jittered exponential backoff
+on connection errors, timeouts and 5xx answers (token generation is a pure
+function of the payload, so a retry cannot double-issue). A circuit
+breaker fails calls fast while the service is down, and call outcomes and
+latencies are counted for the Prometheus metrics endpoint.
+"""
+import random
+import threading
+import time
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+OPEN_TOKEN_URL = getattr(settings, 'OPEN_TOKEN_URL', "https://open-token.omnivoltaic.com/operate_token/")
+CONNECT_TIMEOUT = getattr(settings, 'OPEN_TOKEN_CONNECT_TIMEOUT', 3.05)
+READ_TIMEOUT = getattr(settings, 'OPEN_TOKEN_READ_TIMEOUT', 10)
+MAX_RETRIES = getattr(settings, 'OPEN_TOKEN_RETRIES', 2)
+BACKOFF_BASE = getattr(settings, 'OPEN_TOKEN_BACKOFF', 0.25)
+POOL_SIZE = getattr(settings, 'OPEN_TOKEN_POOL_SIZE', 10)
+# Consecutive failed calls that open the breaker, and how long it stays open
+BREAKER_THRESHOLD = getattr(settings, 'OPEN_TOKEN_BREAKER_THRESHOLD', 5)
+BREAKER_RESET_TIMEOUT = getattr(settings, 'OPEN_TOKEN_BREAKER_RESET_TIMEOUT', 30)
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class TokenServiceError(Exception):
+    pass
+
+
+class CircuitOpenError(TokenServiceError):
+    pass
+
+
+class RetryableError(TokenServiceError):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Closed: calls go through. After `threshold` consecutive failures the
+    breaker opens and calls fail immediately; after `reset_timeout` seconds
+    one trial call is let through (half-open) and its outcome closes or
+    re-opens the breaker.
+    """
+
+    def __init__(self, threshold=BREAKER_THRESHOLD, reset_timeout=BREAKER_RESET_TIMEOUT):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half_open'
+        return 'open'
+
+    def allow(self):
+        with self.lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half_open' and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial_in_flight or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+            self.trial_in_flight = False
+
+
+class TokenClientMetrics:
+    """Process-local counters rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.calls = {}
+        self.retries = 0
+        self.bucket_counts = [0] * len(LATENCY_BUCKETS)
+        self.latency_sum = 0.0
+        self.latency_count = 0
+
+    def record_call(self, outcome, latency=None):
+        with self.lock:
+            self.calls[outcome] = self.calls.get(outcome, 0) + 1
+            if latency is None:
+                return
+            self.latency_sum += latency
+            self.latency_count += 1
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if latency <= bound:
+                    self.bucket_counts[i] += 1
+
+    def record_retry(self):
+        with self.lock:
+            self.retries += 1
+
+    def render(self, breaker):
+        with self.lock:
+            lines = [
+                "# HELP open_token_calls_total Open-token calls by outcome.",
+                "# TYPE open_token_calls_total counter",
+            ]
+            for outcome, count in sorted(self.calls.items()):
+                lines.append(f'open_token_calls_total{{outcome="{outcome}"}} {count}')
+            lines += [
+                "# HELP open_token_retries_total Retried open-token HTTP attempts.",
+                "# TYPE open_token_retries_total counter",
+                f"open_token_retries_total {self.retries}",
+                "# HELP open_token_call_seconds Latency of open-token calls, retries included.",
+                "# TYPE open_token_call_seconds histogram",
+            ]
+            for bound, count in zip(LATENCY_BUCKETS, self.bucket_counts):
+                lines.append(f'open_token_call_seconds_bucket{{le="{bound}"}} {count}')
+            lines += [
+                f'open_token_call_seconds_bucket{{le="+Inf"}} {self.latency_count}',
+                f"open_token_call_seconds_sum {self.latency_sum}",
+                f"open_token_call_seconds_count {self.latency_count}",
+            ]
+        lines += [
+            "# HELP open_token_circuit_open 1 while the circuit breaker fails calls fast.",
+            "# TYPE open_token_circuit_open gauge",
+            f"open_token_circuit_open {int(breaker.state == 'open')}",
+        ]
+        return "\n".join(lines) + "\n"
+
+
+class TokenClient:
+
+    def __init__(self, url=OPEN_TOKEN_URL, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT,
+                 max_retries=MAX_RETRIES, backoff_base=BACKOFF_BASE, pool_size=POOL_SIZE,
+                 breaker=None, metrics=None):
+        self.url = url
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.breaker = breaker or CircuitBreaker()
+        self.metrics = metrics or TokenClientMetrics()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def post_once(self, payload, read_timeout):
+        try:
+            response = self.session.post(
+                self.url, json=payload, timeout=(self.connect_timeout, read_timeout)
+            )
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            raise RetryableError(e)
+        except requests.exceptions.RequestException as e:
+            raise TokenServiceError(e)
+        if response.status_code >= 500:
+            raise RetryableError(f"{response.status_code} Server Error for url: {self.url}")
+        try:
+            response.raise_for_status()
+            return response.json()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            raise TokenServiceError(e)
+
+    def issue(self, payload, timeout=None):
+        """
+        POST `payload` and return the decoded JSON answer. `timeout` caps
+        the total time spent, retries and backoff included.
+        """
+        if not self.breaker.allow():
+            self.metrics.record_call('circuit_open')
+            raise CircuitOpenError("Token service circuit is open; failing fast.")
+
+        started = time.monotonic()
+        deadline = started + timeout if timeout is not None else None
+        attempt = 0
+        while True:
+            read_timeout = self.read_timeout
+            if deadline is not None:
+                read_timeout = max(min(read_timeout, deadline - time.monotonic()), 0.001)
+            try:
+                result = self.post_once(payload, read_timeout)
+            except RetryableError as e:
+                delay = random.uniform(0, self.backoff_base * 2 ** attempt)
+                out_of_time = deadline is not None and time.monotonic() + delay >= deadline
+                if attempt >= self.max_retries or out_of_time:
+                    self.breaker.record_failure()
+                    self.metrics.record_call('error', time.monotonic() - started)
+                    raise TokenServiceError(e)
+                attempt += 1
+                self.metrics.record_retry()
+                time.sleep(delay)
+            except TokenServiceError:
+                # The service answered (e.g. 4xx), so it is up: the
+                # breaker only counts transport failures and 5xx.
+                self.breaker.record_success()
+                self.metrics.record_call('error', time.monotonic() - started)
+                raise
+            else:
+                self.breaker.record_success()
+                self.metrics.record_call('success', time.monotonic() - started)
+                return result
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_token_client():
+    """The process-wide client, created on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = TokenClient()
+    return _client
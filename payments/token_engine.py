@@ -0,0 +1,273 @@
+# token_engine.py
+"""
+In-process OpenPAYGO Token (standard 9-digit tokens) encoder and decoder.
+
+Produces the same tokens as the OpenPAYGO reference implementation that the
+open-token service wraps, from the inputs already held in EncoderState:
+the hex secret key, the starting code and the last used counter.
+
+A token is the starting code with its last three digits replaced by
+(starting base + value) mod 1000, hashed forward once per counter step
+with SipHash-2-4 and folded to 29.5 bits. Even counters carry ADD_TIME
+tokens, odd counters SET_TIME, DISABLE_PAYG and COUNTER_SYNC.
+"""
+import struct
+from itertools import islice
+
+MAX_ACTIVATION_VALUE = 995
+PAYG_DISABLE_VALUE = 998
+COUNTER_SYNC_VALUE = 999
+TOKEN_VALUE_OFFSET = 1000
+
+ADD_TIME = "ADD_TIME"
+SET_TIME = "SET_TIME"
+DISABLE_PAYG = "DISABLE_PAYG"
+COUNTER_SYNC = "COUNTER_SYNC"
+TOKEN_TYPES = (ADD_TIME, SET_TIME, DISABLE_PAYG, COUNTER_SYNC)
+
+# How far past the last issued counter a device accepts a token
+MAX_TOKEN_JUMP = 64
+MAX_TOKEN_JUMP_COUNTER_SYNC = 100
+
+MASK_64 = 0xFFFFFFFFFFFFFFFF
+MASK_29_5 = ((1 << 31) - 1) << 2
+
+
+class TokenEngineError(ValueError):
+    pass
+
+
+def _rotl(x, b):
+    return ((x << b) | (x >> (64 - b))) & MASK_64
+
+
+def siphash_2_4(key, data):
+    """SipHash-2-4 of `data` under the 16-byte `key`, as an unsigned 64-bit int."""
+    k0, k1 = struct.unpack('<QQ', key)
+    v0 = k0 ^ 0x736f6d6570736575
+    v1 = k1 ^ 0x646f72616e646f6d
+    v2 = k0 ^ 0x6c7967656e657261
+    v3 = k1 ^ 0x7465646279746573
+
+    length = len(data)
+    tail = length & 7
+    blocks = struct.unpack_from('<%dQ' % (length >> 3), data) if length >= 8 else ()
+    last = (length & 0xff) << 56
+    for i, byte in enumerate(data[length - tail:]):
+        last |= byte << (8 * i)
+
+    def rounds(v0, v1, v2, v3, n):
+        for _ in range(n):
+            v0 = (v0 + v1) & MASK_64
+            v1 = _rotl(v1, 13) ^ v0
+            v0 = _rotl(v0, 32)
+            v2 = (v2 + v3) & MASK_64
+            v3 = _rotl(v3, 16) ^ v2
+            v0 = (v0 + v3) & MASK_64
+            v3 = _rotl(v3, 21) ^ v0
+            v2 = (v2 + v1) & MASK_64
+            v1 = _rotl(v1, 17) ^ v2
+            v2 = _rotl(v2, 32)
+        return v0, v1, v2, v3
+
+    for m in blocks + (last,):
+        v3 ^= m
+        v0, v1, v2, v3 = rounds(v0, v1, v2, v3, 2)
+        v0 ^= m
+    v2 ^= 0xff
+    v0, v1, v2, v3 = rounds(v0, v1, v2, v3, 4)
+    return v0 ^ v1 ^ v2 ^ v3
+
+
+def load_secret_key(secret_key):
+    try:
+        key = bytes.fromhex(secret_key or '')
+    except ValueError:
+        key = b''
+    if len(key) != 16:
+        raise TokenEngineError("The secret key must be 32 hexadecimal characters.")
+    return key
+
+
+def hash_to_token(value):
+    """Fold a 64-bit hash to 32 bits, then to a number of at most 9 digits."""
+    folded = (value >> 32) ^ (value & 0xFFFFFFFF)
+    token = (folded & MASK_29_5) >> 2
+    if token > 999999999:
+        token -= 73741825
+    return token
+
+
+def next_token(token, key):
+    packed = struct.pack('>L', token)
+    return hash_to_token(siphash_2_4(key, packed + packed))
+
+
+def iter_chain(token, key):
+    """
+    Yield next_token(token), next_token(next_token(token)), ... Each step
+    hashes one fixed 8-byte message, so this is siphash_2_4 specialised to
+    that length with the rounds unrolled; the key schedule is computed once
+    for the whole chain.
+    """
+    k0, k1 = struct.unpack('<QQ', key)
+    i0 = k0 ^ 0x736f6d6570736575
+    i1 = k1 ^ 0x646f72616e646f6d
+    i2 = k0 ^ 0x6c7967656e657261
+    i3 = k1 ^ 0x7465646279746573
+    M = MASK_64
+    # Length byte of an 8-byte message; its final block is otherwise empty
+    last = 8 << 56
+
+    while True:
+        # The token packed big-endian twice, read as one little-endian word
+        t = ((token >> 24) & 0xff) | ((token >> 8) & 0xff00) | ((token << 8) & 0xff0000) | ((token & 0xff) << 24)
+        m = t | (t << 32)
+        v0, v1, v2, v3 = i0, i1, i2, i3 ^ m
+        for n in (2, 2, 4):
+            for _ in range(n):
+                v0 = (v0 + v1) & M
+                v1 = ((v1 << 13) | (v1 >> 51)) & M ^ v0
+                v0 = ((v0 << 32) | (v0 >> 32)) & M
+                v2 = (v2 + v3) & M
+                v3 = ((v3 << 16) | (v3 >> 48)) & M ^ v2
+                v0 = (v0 + v3) & M
+                v3 = ((v3 << 21) | (v3 >> 43)) & M ^ v0
+                v2 = (v2 + v1) & M
+                v1 = ((v1 << 17) | (v1 >> 47)) & M ^ v2
+                v2 = ((v2 << 32) | (v2 >> 32)) & M
+            if n == 2 and m is not None:
+                # Finish the message block, then absorb the length block
+                v0 ^= m
+                v3 ^= last
+                m = None
+            elif n == 2:
+                v0 ^= last
+                v2 ^= 0xff
+        h = v0 ^ v1 ^ v2 ^ v3
+        folded = (h >> 32) ^ (h & 0xFFFFFFFF)
+        token = (folded & MASK_29_5) >> 2
+        if token > 999999999:
+            token -= 73741825
+        yield token
+
+
+def hash_chain(token, key, steps):
+    """Apply next_token `steps` times."""
+    for token in islice(iter_chain(token, key), steps):
+        pass
+    return token
+
+
+def starting_code_from_key(key):
+    return hash_to_token(siphash_2_4(key, key))
+
+
+def put_base(token, base):
+    return token - token % TOKEN_VALUE_OFFSET + base
+
+
+def next_count(count, token_type):
+    """Smallest counter above `count` with the parity of `token_type`."""
+    if token_type == ADD_TIME:
+        return count + 1 if count % 2 else count + 2
+    return count + 2 if count % 2 else count + 1
+
+
+def token_value_for(token_type, value):
+    """The 0-999 value encoded in the token's base."""
+    if token_type == DISABLE_PAYG:
+        return PAYG_DISABLE_VALUE
+    if token_type == COUNTER_SYNC:
+        return COUNTER_SYNC_VALUE
+    if token_type not in (ADD_TIME, SET_TIME):
+        raise TokenEngineError("The token type provided is not supported.")
+    try:
+        whole = int(value)
+    except (TypeError, ValueError):
+        raise TokenEngineError("token_value must be a number.")
+    # Tokens carry whole days; rounding would issue more or less credit than was paid for
+    if whole != value:
+        raise TokenEngineError(f"token_value must be a whole number of days, got {value}.")
+    value = whole
+    if value < 0 or value > MAX_ACTIVATION_VALUE:
+        raise TokenEngineError(f"token_value must be between 0 and {MAX_ACTIVATION_VALUE}.")
+    return value
+
+
+def generate_token(secret_key, count, token_type, value=None, starting_code=None):
+    """
+    Encode the next token after counter `count`.
+    Returns (new_count, token) with the token as a 9-digit string.
+    """
+    key = load_secret_key(secret_key)
+    starting_code = int(starting_code) if starting_code else starting_code_from_key(key)
+    encoded_value = token_value_for(token_type, value)
+
+    base = (starting_code % TOKEN_VALUE_OFFSET + encoded_value) % TOKEN_VALUE_OFFSET
+    new_count = next_count(count or 0, token_type)
+    token = hash_chain(put_base(starting_code, base), key, new_count)
+    return new_count, "{:09d}".format(put_base(token, base))
+
+
+def issue_token(encoder_state, token_type, token_value):
+    """
+    Same contract as the open-token service: returns the response dict
+    update_encoder_state / create_generated_code expect.
+    """
+    try:
+        new_count, token = generate_token(
+            encoder_state.secret_key, encoder_state.max_count, token_type,
+            token_value, encoder_state.starting_code,
+        )
+    except (TypeError, ValueError) as e:
+        raise TokenEngineError(str(e))
+    return {
+        "token": token,
+        "token_type": token_type,
+        "token_value": token_value,
+        "max_count": new_count,
+    }
+
+
+def token_type_for(count, value):
+    if count % 2 == 0:
+        return ADD_TIME
+    if value == COUNTER_SYNC_VALUE:
+        return COUNTER_SYNC
+    if value == PAYG_DISABLE_VALUE:
+        return DISABLE_PAYG
+    return SET_TIME
+
+
+def decode_token(secret_key, token, last_count, starting_code=None):
+    """
+    Find the counter `token` was generated for, searching the counters a
+    device would accept: up to last_count + MAX_TOKEN_JUMP (or
+    MAX_TOKEN_JUMP_COUNTER_SYNC for sync tokens). The chain has to be
+    walked from counter 0, so the cost is one hash per counter.
+
+    Returns (value, token_type, count), or None if no counter matches.
+    """
+    key = load_secret_key(secret_key)
+    token = str(token).replace(' ', '').replace('-', '')
+    if not token.isdigit() or len(token) > 9:
+        raise TokenEngineError("A token is at most 9 digits.")
+    token = int(token)
+    try:
+        starting_code = int(starting_code) if starting_code else starting_code_from_key(key)
+    except (TypeError, ValueError):
+        raise TokenEngineError("The item's starting_code is not a number.")
+
+    base = token % TOKEN_VALUE_OFFSET
+    value = (base - starting_code % TOKEN_VALUE_OFFSET) % TOKEN_VALUE_OFFSET
+    jump = MAX_TOKEN_JUMP_COUNTER_SYNC if value == COUNTER_SYNC_VALUE else MAX_TOKEN_JUMP
+    max_count = (last_count or 0) + jump
+
+    current = put_base(starting_code, base)
+    chain = iter_chain(current, key)
+    for count in range(max_count + 1):
+        if put_base(current, base) == token:
+            return value, token_type_for(count, value), count
+        current = next(chain)
+    return None
@@ -0,0 +1,415 @@
+# tokens.py
+"""
+Token issuance: the open-token API call (or the in-process engine, per
+distributor), the EncoderState/GeneratedCode bookkeeping around it, and
+the TokenRequest outbox that keeps the network call out of the payment
+transaction.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from items.models import EncoderState, Item
+from .credit import credit_expiry
+from .messages import message_catalogue, token_message
+from .models import GeneratedCode, TokenRequest
+from .token_client import TokenServiceError, get_token_client
+from .token_engine import TokenEngineError, issue_token as issue_local_token
+
+# Seconds a request handler may spend issuing its own token before it
+# answers 202 and leaves the request to the outbox worker.
+SYNC_TOKEN_TIMEOUT = getattr(settings, 'OPEN_TOKEN_SYNC_TIMEOUT', 5)
+# Timeout for a single call made by the outbox worker.
+WORKER_TOKEN_TIMEOUT = getattr(settings, 'OPEN_TOKEN_WORKER_TIMEOUT', 30)
+MAX_TOKEN_ATTEMPTS = getattr(settings, 'OPEN_TOKEN_MAX_ATTEMPTS', 5)
+# A request stuck in "processing" longer than this is assumed to belong to
+# a dead worker and can be claimed again.
+PROCESSING_LEASE = timedelta(seconds=getattr(settings, 'OPEN_TOKEN_PROCESSING_LEASE', 300))
+# Items issued in parallel by one batch request
+BATCH_TOKEN_WORKERS = getattr(settings, 'OPEN_TOKEN_BATCH_WORKERS', 8)
+BATCH_WRITE_SIZE = 500
+
+
+def call_external_api(encoder_state, token_type, token_value, timeout=None):
+    """Call the external API to generate a token."""
+    payload = {
+        "token_type": token_type,
+        "token_value": token_value,
+        "max_count": encoder_state.max_count,
+        "starting_code": encoder_state.starting_code,
+        "secret_key": encoder_state.secret_key,
+    }
+    try:
+        return get_token_client().issue(payload, timeout=timeout)
+    except TokenServiceError as e:
+        raise Exception(f"Failed to generate token via external API: {e}")
+
+def uses_local_engine(item):
+    fleet = item.fleet
+    return fleet is not None and fleet.distributor.token_engine == 'LOCAL'
+
+def generate_token(encoder_state, token_type, token_value, timeout=None):
+    """Generate a token with the engine chosen by the item's distributor."""
+    if uses_local_engine(encoder_state.item):
+        return issue_local_token(encoder_state, token_type, token_value)
+    return call_external_api(encoder_state, token_type, token_value, timeout=timeout)
+
+def apply_token_response(encoder_state, token_response):
+    """Copy the new token and counter onto the EncoderState without saving."""
+    encoder_state.token = token_response.get("token")
+    encoder_state.token_type = token_response.get("token_type")
+    encoder_state.token_value = token_response.get("token_value")
+    encoder_state.max_count = token_response.get("max_count")
+
+def update_encoder_state(encoder_state, token_response):
+    """Update the EncoderState with the new token and other data."""
+    apply_token_response(encoder_state, token_response)
+    encoder_state.save()
+
+def build_generated_code(item, token_response, payment_message):
+    return GeneratedCode(
+        item=item,
+        token=token_response.get("token"),
+        token_value=token_response.get("token_value"),
+        token_type=token_response.get("token_type"),
+        max_count=token_response.get("max_count"),
+        payment_message=payment_message
+    )
+
+def create_generated_code(item, token_response, payment_message):
+    """Create a GeneratedCode record."""
+    generated_code = build_generated_code(item, token_response, payment_message)
+    generated_code.save()
+    return generated_code
+
+def get_payment_message(token_request):
+    return message_catalogue.get(token_request.message_key, token_request.message)
+
+def request_token_value(token_request):
+    token_value = float(token_request.token_value)
+    if token_value.is_integer():
+        # Whole days go out as ints, exactly as the synchronous call did
+        token_value = int(token_value)
+    return token_value
+
+
+def issued_token_value(token_request, token_response):
+    """The value the issued token carries, which the engine may not have taken as requested."""
+    token_value = token_response.get("token_value")
+    return token_request.token_value if token_value is None else token_value
+
+
+def lock_items(item_ids):
+    """
+    Take the row locks of `item_ids`, in pk order so concurrent callers
+    cannot deadlock. Held until the surrounding transaction ends, so the
+    TokenRequests queued for these items are created one writer at a time.
+    """
+    list(Item.objects.select_for_update().filter(pk__in=item_ids).order_by('pk').values_list('pk', flat=True))
+
+
+def enqueue_token_request(item, token_type, token_value, message, payment=None, is_completion=False):
+    """
+    Record that `item` needs a token. `message` is the (key, default text)
+    pair of its PaymentMessage. Call inside the transaction that decided
+    it, so the request commits (or rolls back) with it.
+    """
+    if not EncoderState.objects.filter(item=item).exists():
+        raise EncoderState.DoesNotExist("EncoderState matching query does not exist.")
+    lock_items([item.pk])
+    message_key, message = message
+    return TokenRequest.objects.create(
+        item=item,
+        payment=payment,
+        token_type=token_type,
+        token_value=token_value,
+        message_key=message_key,
+        message=message,
+        is_completion=is_completion,
+    )
+
+
+def claimable(now=None):
+    now = now or timezone.now()
+    return Q(status='pending') | Q(status='processing', claimed_at__lt=now - PROCESSING_LEASE)
+
+
+def claim_token_request(token_request):
+    """Compare-and-set the request to processing. Returns False if someone else has it."""
+    now = timezone.now()
+    claimed = TokenRequest.objects.filter(claimable(now), pk=token_request.pk).update(
+        status='processing', claimed_at=now, attempts=F('attempts') + 1, updated_at=now
+    )
+    return claimed == 1
+
+
+def process_token_request(token_request, timeout=WORKER_TOKEN_TIMEOUT):
+    """
+    Issue the token for an already claimed request. The remote call runs
+    with no transaction open; only the bookkeeping afterwards is atomic.
+    """
+    token_request.refresh_from_db()
+    try:
+        encoder_state = EncoderState.objects.select_related('item__fleet__distributor').get(
+            item_id=token_request.item_id
+        )
+        token_response = generate_token(
+            encoder_state, token_request.token_type, request_token_value(token_request), timeout=timeout
+        )
+        payment_message = get_payment_message(token_request)
+        with transaction.atomic():
+            update_encoder_state(encoder_state, token_response)
+            generated_code = create_generated_code(token_request.item, token_response, payment_message)
+
+            now = timezone.now()
+            item = encoder_state.item
+            item.credit_expires_at = credit_expiry(
+                item.credit_expires_at, token_request.token_type,
+                issued_token_value(token_request, token_response), now
+            )
+            Item.objects.filter(pk=item.pk).update(credit_expires_at=item.credit_expires_at, updated_at=now)
+
+            token_request.status = 'completed'
+            token_request.generated_code = generated_code
+            token_request.processed_at = now
+            token_request.last_error = ''
+            token_request.save(update_fields=[
+                'status', 'generated_code', 'processed_at', 'last_error', 'updated_at'
+            ])
+    except Exception as e:
+        record_token_failure(token_request, e)
+        with transaction.atomic():
+            token_request.save(update_fields=['status', 'last_error', 'updated_at'])
+            if token_request.status == 'failed':
+                refund_token_debit(token_request)
+    return token_request
+
+
+def record_token_failure(token_request, error):
+    # Local engine errors (bad key, value out of range) won't go away on retry
+    give_up = isinstance(error, TokenEngineError) or token_request.attempts >= MAX_TOKEN_ATTEMPTS
+    token_request.status = 'failed' if give_up else 'pending'
+    token_request.last_error = str(error)
+
+
+def refund_token_debit(token_request):
+    """
+    Credit back the intervals a payment debited for a token that will never
+    be issued, so the money stays on the balance for the next payment.
+    Call in the transaction that marks the request failed.
+    """
+    if token_request.payment_id is None or token_request.is_completion or token_request.token_type != 'ADD_TIME':
+        return
+    payment_plan = token_request.payment.payment_plan
+    if payment_plan is None:
+        return
+    Item.objects.filter(pk=token_request.item_id).update(
+        balance=F('balance') + payment_plan.interval_debit(token_request.token_value),
+        updated_at=timezone.now(),
+    )
+
+
+def next_token_request_for_item(item_id):
+    """Oldest request of the item that still has to be issued."""
+    return (
+        TokenRequest.objects.filter(item_id=item_id, status__in=['pending', 'processing'])
+        .order_by('pk')
+        .first()
+    )
+
+
+def drain_item(item_id, deadline=None, timeout=WORKER_TOKEN_TIMEOUT):
+    """
+    Process the item's outstanding requests strictly in order. Stops at the
+    first failure, or when an earlier request is being handled elsewhere
+    and the deadline passes. Returns how many requests were completed.
+    """
+    completed = 0
+    while True:
+        token_request = next_token_request_for_item(item_id)
+        if token_request is None:
+            return completed
+        if deadline is not None:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                return completed
+        if not claim_token_request(token_request):
+            if deadline is None:
+                return completed
+            time.sleep(0.05)
+            continue
+        token_request = process_token_request(token_request, timeout=timeout)
+        if token_request.status != 'completed':
+            return completed
+        completed += 1
+
+
+def fulfil_token_request(token_request, budget=SYNC_TOKEN_TIMEOUT):
+    """
+    Fast path used by request handlers after their transaction committed:
+    try to issue this request (and any older ones of the same item) within
+    `budget` seconds, then return its current state.
+    """
+    drain_item(token_request.item_id, deadline=time.monotonic() + budget)
+    token_request.refresh_from_db()
+    return token_request
+
+
+def drain_outbox(limit=None):
+    """Process outstanding requests item by item (at most `limit` items). Returns how many were completed."""
+    item_ids = (
+        TokenRequest.objects.filter(claimable())
+        .order_by('item_id').values_list('item_id', flat=True).distinct()
+    )
+    if limit:
+        item_ids = item_ids[:limit]
+    return sum(drain_item(item_id) for item_id in list(item_ids))
+
+
+def create_batch_token_requests(entries, message_for=None):
+    """
+    Queue tokens for a batch of (item, token_type, token_value) entries in
+    one bulk_create. Call inside a transaction.
+
+    Requests of items with nothing older outstanding are created already
+    claimed ("processing") by the caller, so no other worker can issue
+    them out of order; the rest are left pending behind the item's queue.
+    Returns the TokenRequests in entry order.
+    """
+    message_for = message_for or token_message
+    item_ids = {item.pk for item, _, _ in entries}
+    # Locked first, so no other writer queues a request for these items
+    # between the busy check and the insert
+    lock_items(item_ids)
+    busy_item_ids = set(
+        TokenRequest.objects.filter(item_id__in=item_ids, status__in=['pending', 'processing'])
+        .values_list('item_id', flat=True)
+    )
+    now = timezone.now()
+    token_requests = []
+    for item, token_type, token_value in entries:
+        claim = item.pk not in busy_item_ids
+        message_key, message = message_for(token_type)
+        token_requests.append(TokenRequest(
+            item=item,
+            token_type=token_type,
+            token_value=token_value,
+            message_key=message_key,
+            message=message,
+            status='processing' if claim else 'pending',
+            claimed_at=now if claim else None,
+            attempts=1 if claim else 0,
+        ))
+    return TokenRequest.objects.bulk_create(token_requests, batch_size=BATCH_WRITE_SIZE)
+
+
+def issue_item_chain(encoder_state, token_requests, timeout):
+    """
+    Worker body for one item: issue its requests in order against an
+    in-memory EncoderState, each call starting from the counter the
+    previous one returned. Touches no database. Stops at the first failure.
+
+    Returns [(token_request, token_response, error)], with neither set
+    for the requests skipped after a failure.
+    """
+    results = []
+    failed = False
+    for token_request in token_requests:
+        if failed:
+            results.append((token_request, None, None))
+            continue
+        try:
+            token_response = generate_token(
+                encoder_state, token_request.token_type, request_token_value(token_request), timeout=timeout
+            )
+        except Exception as e:
+            failed = True
+            results.append((token_request, None, e))
+            continue
+        apply_token_response(encoder_state, token_response)
+        results.append((token_request, token_response, None))
+    return results
+
+
+def process_token_batch(token_requests, max_workers=BATCH_TOKEN_WORKERS, timeout=WORKER_TOKEN_TIMEOUT):
+    """
+    Issue claimed batch requests: items fan out over a bounded thread pool,
+    each item's requests run sequentially in one worker, and the results
+    are written back with bulk_create/bulk_update in one transaction.
+    Requests skipped or failed go back to the outbox.
+    """
+    chains = {}
+    for token_request in sorted(token_requests, key=lambda tr: tr.pk):
+        if token_request.status == 'processing':
+            chains.setdefault(token_request.item_id, []).append(token_request)
+    if not chains:
+        return token_requests
+
+    encoder_states = {
+        encoder_state.item_id: encoder_state
+        for encoder_state in EncoderState.objects.select_related('item__fleet__distributor')
+        .filter(item_id__in=chains)
+    }
+    results = []
+    for item_id in set(chains) - set(encoder_states):
+        missing = EncoderState.DoesNotExist("EncoderState matching query does not exist.")
+        results.extend((token_request, None, missing) for token_request in chains.pop(item_id))
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(chains)))) as pool:
+        futures = [
+            pool.submit(issue_item_chain, encoder_states[item_id], chain, timeout)
+            for item_id, chain in chains.items()
+        ]
+        results += [result for future in futures for result in future.result()]
+
+    now = timezone.now()
+    issued = []
+    for token_request, token_response, error in results:
+        if token_response is not None:
+            item = encoder_states[token_request.item_id].item
+            issued.append((token_request, build_generated_code(
+                item, token_response, get_payment_message(token_request)
+            )))
+            # Each item's results are in chain order, so its expiry accumulates
+            item.credit_expires_at = credit_expiry(
+                item.credit_expires_at, token_request.token_type,
+                issued_token_value(token_request, token_response), now
+            )
+            item.updated_at = now
+            token_request.status = 'completed'
+            token_request.processed_at = now
+            token_request.last_error = ''
+        elif error is not None:
+            record_token_failure(token_request, error)
+        else:
+            token_request.status = 'pending'
+        token_request.updated_at = now
+
+    with transaction.atomic():
+        GeneratedCode.objects.bulk_create([code for _, code in issued], batch_size=BATCH_WRITE_SIZE)
+        for token_request, generated_code in issued:
+            token_request.generated_code = generated_code
+        advanced = {token_request.item_id for token_request, _ in issued}
+        for item_id in advanced:
+            encoder_states[item_id].updated_at = now
+        EncoderState.objects.bulk_update(
+            [encoder_states[item_id] for item_id in advanced],
+            ['token', 'token_type', 'token_value', 'max_count', 'updated_at'],
+            batch_size=BATCH_WRITE_SIZE
+        )
+        Item.objects.bulk_update(
+            [encoder_states[item_id].item for item_id in advanced],
+            ['credit_expires_at', 'updated_at'],
+            batch_size=BATCH_WRITE_SIZE
+        )
+        TokenRequest.objects.bulk_update(
+            [token_request for token_request, _, _ in results],
+            ['status', 'generated_code', 'processed_at', 'last_error', 'updated_at'],
+            batch_size=BATCH_WRITE_SIZE
+        )
+    return token_requests
@@ -8,9 +8,19 @@ urlpatterns = [
     path('payments/make_payment/', views.make_payment_view, name='make-payment-view'),
     path('items/<int:item_id>/generated_codes/', views.get_generated_codes_for_item, name='get-generated-codes-for-item'),
     path('items/<int:item_id>/payments/', views.get_payments_for_item, name='get-payments-for-item'),
+    path('items/<int:item_id>/verify_token/', views.verify_token_view, name='verify-token'),
+    path('items/generate_tokens/', views.generate_tokens_batch_view, name='generate-tokens-batch'),
     path('item/generate_token/', views.generate_token_view, name='get-payments-for-item'),
+    path('token_requests/<int:pk>/', views.token_request_detail_view, name='token-request-detail'),
+    path('token_service/metrics/', views.token_service_metrics_view, name='token-service-metrics'),
     path('payments/', views.get_payments_for_distributor, name='get-payments-for-distributor'),
+    path('payments/export/', views.export_payments_view, name='export-payments'),
+    path('generated_codes/export/', views.export_generated_codes_view, name='export-generated-codes'),
+    path('reports/revenue/', views.revenue_report_view, name='revenue-report'),
+    path('analytics/snapshots/', views.analytics_snapshots_view, name='analytics-snapshots'),
+    path('analytics/snapshots/<path:path>', views.analytics_snapshot_file_view, name='analytics-snapshot-file'),
     path('payment_plans/', views.get_all_payment_plans, name='get-all-payment-plans'),
+    path('items/bulk_assign_payment_plan/', views.bulk_assign_payment_plan_view, name='bulk-assign-payment-plan'),
     path('items/assign_payment_plan/', views.assign_payment_plan_to_item, name='assign-payment-plan-to-item'),
     path('payment_plans/create/', views.create_payment_plan, name='create-payment-plan'),
     path('payment_plans/<int:pk>/', views.payment_plan_detail_view, name='payment_plan_detail_view'),
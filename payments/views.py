@@ -1,23 +1,43 @@
 # views_payments.py
-import requests
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework import status
 from rest_framework.response import Response
-from rest_framework.exceptions import PermissionDenied
+from rest_framework.exceptions import PermissionDenied, ValidationError
 from django.shortcuts import get_object_or_404
+from django.http import FileResponse, Http404, HttpResponse
 from decimal import Decimal
 from django.db import transaction
+from django.db.models import F, Sum
+from django.db.models.functions import TruncMonth, TruncQuarter, TruncWeek, TruncYear
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from datetime import datetime, time, timedelta
 import uuid  # For generating unique codes
 
 from .models import ( PaymentPlan, Payment, 
-    GeneratedCode, PaymentMessage, 
+    GeneratedCode, TokenRequest, DailyRevenueRollup,
 )
 
 from .serializers import GeneratedCodeSerializer, PaymentPlanSerializer, AssignPaymentPlanSerializer, CreatePaymentPlanSerializer
-from items.models import Item, EncoderState
+from items.models import Item, EncoderState, Fleet
 from django.contrib.auth import get_user_model
-from .serializers import PaymentSerializer
+from .serializers import PaymentSerializer, TokenRequestSerializer
+from .tokens import (
+    enqueue_token_request, fulfil_token_request, create_batch_token_requests, process_token_batch,
+    uses_local_engine,
+)
+from .token_client import get_token_client
+from .idempotency import idempotent
+from .exports import GENERATED_CODE_EXPORT_COLUMNS, PAYMENT_EXPORT_COLUMNS, csv_response
+from .rollups import record_payment
+from .snapshots import list_snapshot_files, resolve_snapshot_file
+from .plan_cache import get_distributor_plans, get_plan
+from .messages import COMPLETION_MESSAGE, COMPLETION_MESSAGE_KEY, interval_message, token_message
+from .token_engine import TokenEngineError, decode_token
+from utils.pagination import keyset_response
+from utils.bulk import to_pk, unique_pks, fetch_rows
+from items.status import recompute_item_statuses, recompute_statuses_for
 
 User = get_user_model()
 
@@ -43,128 +63,153 @@ def authorize_user(user, item):
         raise PermissionDenied("You do not own this item (through its fleet).")
 
 def create_payment_record(item, payment_plan, amount, customer, note):
-    """Create a Payment record."""
-    return Payment.objects.create(
+    """
+    Create a Payment record, credit the item's balance and roll the payment
+    into its running totals and its day's revenue rollup.
+
+    Must run inside transaction.atomic(). The balance is credited with an
+    atomic F() UPDATE, which also takes the item's row lock (the database
+    write lock on SQLite), so concurrent payments for the same item are
+    serialized here instead of overwriting each other.
+    """
+    payment = Payment.objects.create(
         item=item,
         payment_plan=payment_plan,
         amount_paid=amount,
         customer=customer,
-        note=note
+        note=note,
+        distributor_id=item.fleet.distributor_id if item.fleet_id else None,
+        fleet_id=item.fleet_id,
     )
-
-def call_external_api(encoder_state, token_type, token_value):
-    """Call the external API to generate a token."""
-    api_url = "https://open-token.omnivoltaic.com/operate_token/"
-    payload = {
-        "token_type": token_type,
-        "token_value": token_value,
-        "max_count": encoder_state.max_count,
-        "starting_code": encoder_state.starting_code,
-        "secret_key": encoder_state.secret_key,
-    }
-    try:
-        response = requests.post(api_url, json=payload)
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        raise Exception(f"Failed to generate token via external API: {e}")
-
-def update_encoder_state(encoder_state, token_response):
-    """Update the EncoderState with the new token and other data."""
-    encoder_state.token = token_response.get("token")
-    encoder_state.token_type = token_response.get("token_type")
-    encoder_state.token_value = token_response.get("token_value")
-    encoder_state.max_count = token_response.get("max_count")
-    encoder_state.save()
-
-def create_generated_code(item, token_response, payment_message):
-    """Create a GeneratedCode record."""
-    return GeneratedCode.objects.create(
-        item=item,
-        token=token_response.get("token"),
-        token_value=token_response.get("token_value"),
-        token_type=token_response.get("token_type"),
-        max_count=token_response.get("max_count"),
-        payment_message=payment_message
+    record_payment(payment)
+    Item.objects.filter(pk=item.pk).update(
+        balance=F('balance') + amount,
+        total_paid=F('total_paid') + amount,
+        payments_count=F('payments_count') + 1,
+        last_payment_at=payment.paid_at,
+        updated_at=timezone.now(),
     )
+    return payment
+
+def lock_item(item_pk):
+    """Re-read an item inside the payment transaction, holding its row lock."""
+    return (
+        Item.objects.select_for_update()
+        .select_related('customer', 'fleet')
+        .get(pk=item_pk)
+    )
+
+# Response keys filled from the GeneratedCode once a payment's token is issued
+INTERVAL_TOKEN_FIELDS = {"token": "token", "days": "token_value"}
+COMPLETION_TOKEN_FIELDS = {"completion_code": "token"}
 
-def handle_payment_plan_logic(item, payment_plan, total_paid, amount):
-    """Handle the logic for applying the PaymentPlan."""
+def handle_payment_plan_logic(item, payment_plan, total_paid, amount, payment=None):
+    """
+    Handle the logic for applying the PaymentPlan.
+    Returns (response_data, token_request); token_request is None when no
+    code is due.
+    """
     if total_paid >= payment_plan.total_amount:
-        return Response({
+        return {
             "detail": "Payment recorded for fully paid item. No code generated.",
             "current_balance": str(item.balance),
             "status": item.status
-        }, status=status.HTTP_200_OK)
+        }, None
 
     interval_amount = payment_plan.interval_amount
     if (total_paid + amount) >= payment_plan.total_amount:
-        return handle_completion_code(item, payment_plan)
+        return handle_completion_code(item, payment_plan, payment)
 
     if item.balance >= interval_amount:
-        return handle_interval_payment(item, payment_plan)
+        return handle_interval_payment(item, payment_plan, payment)
 
-    return Response({
+    return {
         "detail": "Payment added to item balance but not enough to cover plan cost. No code generated.",
         "current_balance": str(item.balance)
-    }, status=status.HTTP_200_OK)
-
-def handle_completion_code(item, payment_plan):
-    """Handle the logic for generating a completion code."""
-    encoder_state = EncoderState.objects.get(item=item)
-    token_response = call_external_api(encoder_state, "DISABLE_PAYG", 1)
-    update_encoder_state(encoder_state, token_response)
+    }, None
 
-    payment_message, _ = PaymentMessage.objects.get_or_create(
-        defaults={'message': "Congratulations! Full payment completed."}
+def handle_completion_code(item, payment_plan, payment=None):
+    """Queue the completion code and mark the item as paid."""
+    token_request = enqueue_token_request(
+        item, "DISABLE_PAYG", 1, (COMPLETION_MESSAGE_KEY, COMPLETION_MESSAGE),
+        payment=payment, is_completion=True
     )
-    create_generated_code(item, token_response, payment_message)
 
     item.update_status()
 
-    return Response({
+    return {
         "detail": "Congratulations! Item fully paid.",
-        "completion_code": token_response.get("token"),
         "remaining_balance": str(item.balance),
         "status": item.status,
         "is_completion": True
-    }, status=status.HTTP_200_OK)
+    }, token_request
 
-def handle_interval_payment(item, payment_plan):
-    """Handle the logic for generating a token for interval payments."""
+def handle_interval_payment(item, payment_plan, payment=None):
+    """Debit whole intervals from the balance and queue a token for them."""
+    days = PaymentPlan.INTERVAL_DAYS.get(payment_plan.interval_type.lower(), 1)
     num_intervals = int(item.balance // payment_plan.interval_amount)
+    local_engine = uses_local_engine(item)
+    # The local engine only encodes whole days, so sub-day intervals are
+    # debited a full day at a time and the rest stays on the balance
+    whole_days_only = days < 1 and local_engine
+    if whole_days_only:
+        intervals_per_day = round(1 / days)
+        num_intervals -= num_intervals % intervals_per_day
+        if not num_intervals:
+            return {
+                "detail": "Payment added to item balance but not enough to cover a whole day. No code generated.",
+                "current_balance": str(item.balance)
+            }, None
+
     total_debit = payment_plan.interval_amount * num_intervals
+    # The row is locked by the payment transaction, so only write the balance
     item.balance -= total_debit
-    item.save()
+    item.save(update_fields=['balance', 'updated_at'])
 
-    interval_type_to_days = {
-        'hourly': 1 / 24,
-        'daily': 1,
-        'weekly': 7,
-        'monthly': 30,
-    }
-    days = interval_type_to_days.get(payment_plan.interval_type.lower(), 1)
     total_days = days * num_intervals
+    if whole_days_only:
+        total_days = round(total_days)
 
-    encoder_state = EncoderState.objects.get(item=item)
-    token_response = call_external_api(encoder_state, "ADD_TIME", total_days)
-    update_encoder_state(encoder_state, token_response)
-
-    payment_message, _ = PaymentMessage.objects.get_or_create(
-        defaults={'message': f"Code generated for {payment_plan.interval_type} usage."}
+    token_request = enqueue_token_request(
+        item, "ADD_TIME", total_days,
+        interval_message(payment_plan.interval_type), payment=payment
     )
-    generated_code = create_generated_code(item, token_response, payment_message)
 
-    return Response({
-        "detail": "Payment successful, token generated via external API.",
-        "token": generated_code.token,
-        "days": generated_code.token_value,
+    # respond_with_token() replaces the detail if the token is not issued in time
+    return {
+        "detail": "Payment successful, token generated "
+                  + ("by the local token engine." if local_engine else "via external API."),
         "remaining_balance": str(item.balance)
-    }, status=status.HTTP_200_OK)
+    }, token_request
+
+def respond_with_token(data, token_request, fields):
+    """
+    Issue a committed TokenRequest within the synchronous budget and answer
+    with the token merged into `data` (`fields` maps response keys to
+    GeneratedCode attributes). If the token is not ready in time, answer
+    202 with the id to poll on /token_requests/<id>/; the outbox worker
+    finishes it.
+    """
+    token_request = fulfil_token_request(token_request)
+    if token_request.status == 'completed':
+        generated_code = token_request.generated_code
+        for key, attr in fields.items():
+            data[key] = getattr(generated_code, attr)
+        return Response(data, status=status.HTTP_200_OK)
+
+    data.update({
+        "detail": "Request recorded; the token is still being generated.",
+        "token_request_id": token_request.id,
+        "token_status": token_request.status,
+    })
+    if token_request.last_error:
+        data["error"] = token_request.last_error
+    return Response(data, status=status.HTTP_202_ACCEPTED)
 
 # Main view
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@idempotent
 def make_payment_view(request):
     """
     POST /payments/make_payment/
@@ -173,6 +218,13 @@ def make_payment_view(request):
       "amount": <decimal>,
       "note": "optional note"  // Optional
     }
+
+    Send an Idempotency-Key header to make retries safe: a replay gets
+    the first response back without recording another payment.
+
+    The payment and the TokenRequest for any code it earns commit together;
+    the open-token call happens after commit. Answers 200 with the token,
+    or 202 with token_request_id if the token isn't issued in time.
     """
     user = request.user
 
@@ -189,32 +241,33 @@ def make_payment_view(request):
     note = request.data.get('note', '')
 
     # 3) Retrieve and validate the item
-    item = get_object_or_404(Item, pk=item_id)
+    item = get_object_or_404(Item.objects.select_related('fleet'), pk=item_id)
     authorize_user(user, item)
 
-    # Infer customer from item
-    customer = item.customer
-
-    # 4) Determine PaymentPlan associated with the Item
-    payment_plan = item.payment_plan
-
-    # Calculate total paid so far
-    total_paid = item.calculate_total_paid()
-
     try:
         with transaction.atomic():
-            # 5) Create the Payment record and credit the item's balance
-            create_payment_record(item, payment_plan, amount, customer, note)
-            item.balance += amount
-            item.save()
-
-            # 6) Apply PaymentPlan logic if PaymentPlan exists
+            # 4) Create the Payment record and credit the item's balance.
+            #    This write comes first so the item is locked before we read
+            #    its balance; everything below sees the serialized state.
+            payment_plan = get_plan(item.payment_plan_id, include_deleted=True)
+            payment = create_payment_record(item, payment_plan, amount, item.customer, note)
+            item = lock_item(item.pk)
+            # Plans change rarely; reuse the cached one unless it was swapped meanwhile
+            if item.payment_plan_id != getattr(payment_plan, 'pk', None):
+                payment_plan = get_plan(item.payment_plan_id, include_deleted=True)
+
+            # Total paid before this payment, from the running total on the item
+            total_paid = item.total_paid - amount
+
+            # 5) Apply PaymentPlan logic if PaymentPlan exists
             if payment_plan:
-                return handle_payment_plan_logic(item, payment_plan, total_paid, amount)
+                data, token_request = handle_payment_plan_logic(
+                    item, payment_plan, total_paid, amount, payment
+                )
             else:
-                return Response({
+                data, token_request = {
                     "detail": "Payment successful, but no PaymentPlan to apply."
-                }, status=status.HTTP_200_OK)
+                }, None
 
     except Exception as e:
         return Response({
@@ -222,8 +275,15 @@ def make_payment_view(request):
             "error": str(e)
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    # 6) Issue the token, if one is due, outside the transaction
+    if token_request is None:
+        return Response(data, status=status.HTTP_200_OK)
+    fields = COMPLETION_TOKEN_FIELDS if token_request.is_completion else INTERVAL_TOKEN_FIELDS
+    return respond_with_token(data, token_request, fields)
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@idempotent
 def generate_token_view(request):
     """
     POST /payments/generate_token/
@@ -237,11 +297,10 @@ def generate_token_view(request):
     1) Authenticate and authorize the user.
     2) Validate the input data.
     3) Retrieve the item and ensure ownership.
-    4) Retrieve the EncoderState for the item.
-    5) Call the external API to generate a token.
-    6) Update the EncoderState with the new token.
-    7) Create a GeneratedCode record for history.
-    8) Respond with the generated token and details.
+    4) Ensure the item has an EncoderState.
+    5) Queue a TokenRequest, behind any earlier ones for the item.
+    6) Issue it (API call, EncoderState update, GeneratedCode record).
+    7) Respond with the generated token, or 202 with the request to poll.
     """
     user = request.user
 
@@ -266,36 +325,251 @@ def generate_token_view(request):
     if user.user_type == 'DISTRIBUTOR' and item.fleet.distributor != user:
         raise PermissionDenied("You do not own this item (through its fleet).")
 
-    # 4) Retrieve the EncoderState for the item
-    encoder_state = get_object_or_404(EncoderState, item=item)
+    # 4) Ensure the EncoderState exists
+    get_object_or_404(EncoderState, item=item)
 
     try:
-        # 5) Call the external API to generate a token
-        token_response = call_external_api(encoder_state, token_type, token_value)
+        # 5) Queue the request
+        token_request = enqueue_token_request(item, token_type, token_value, token_message(token_type))
+    except Exception as e:
+        return Response({
+            "detail": "An error occurred while generating the token.",
+            "error": str(e)
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    # 6-7) Issue it and respond
+    return respond_with_token(
+        {"detail": "Token generated successfully."},
+        token_request,
+        {"token": "token", "token_type": "token_type", "token_value": "token_value", "max_count": "max_count"},
+    )
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def token_request_detail_view(request, pk):
+    """
+    GET /token_requests/<pk>/
+    Poll a queued token; `token` is set once the request is completed.
+    """
+    token_request = get_object_or_404(
+        TokenRequest.objects.select_related('item__fleet', 'generated_code'), pk=pk
+    )
+
+    user = request.user
+    if user.user_type not in ['DISTRIBUTOR', 'SUPER_ADMIN']:
+        raise PermissionDenied("You do not have permission to view token requests.")
+    fleet = token_request.item.fleet
+    if user.user_type == 'DISTRIBUTOR' and (fleet is None or fleet.distributor_id != user.id):
+        raise PermissionDenied("You do not own this item (through its fleet).")
+
+    serializer = TokenRequestSerializer(token_request)
+    return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+TOKEN_TYPES = ["ADD_TIME", "DISABLE_PAYG", "SET_TIME", "COUNTER_SYNC"]
+MAX_BATCH_TOKENS = 5000
+
+def validate_token_spec(token_type, token_value):
+    """Same rules as generate_token_view; returns an error message or None."""
+    if not token_type or token_type not in TOKEN_TYPES:
+        return "token_type must be either 'ADD_TIME' or 'DISABLE_PAYG' or SET_TIME or COUNTER_SYNC."
+    if not token_value or not isinstance(token_value, int) or isinstance(token_value, bool) or token_value <= 0:
+        return "token_value must be a positive integer."
+    return None
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def generate_tokens_batch_view(request):
+    """
+    POST /items/generate_tokens/
+    {
+      "tokens": [
+        {"item_id": <int>, "token_type": "ADD_TIME", "token_value": <int>},
+        ...
+      ]
+    }
+    or, for every item of a fleet that has an EncoderState:
+    {
+      "fleet_id": <int>,
+      "token_type": "ADD_TIME",
+      "token_value": <int>
+    }
+
+    Items are issued in parallel over a bounded worker pool; several tokens
+    for the same item are issued one after another in request order.
+    Returns one result per entry: "completed" with the token, "queued"
+    (left to the outbox, poll token_request_id) or an error.
+    """
+    user = request.user
+    if user.user_type not in ['DISTRIBUTOR', 'SUPER_ADMIN']:
+        raise PermissionDenied("You do not have permission to generate tokens.")
+
+    errors = []
+    entries = []  # (index, item, token_type, token_value)
+    fleet_id = request.data.get('fleet_id')
+
+    if fleet_id is not None:
+        token_type = request.data.get('token_type')
+        token_value = request.data.get('token_value')
+        error = validate_token_spec(token_type, token_value)
+        if error:
+            return Response({"detail": error}, status=status.HTTP_400_BAD_REQUEST)
+        fleet = get_object_or_404(Fleet, pk=fleet_id)
+        if user.user_type == 'DISTRIBUTOR' and fleet.distributor_id != user.id:
+            raise PermissionDenied("You do not own this fleet.")
+        items = Item.objects.filter(fleet=fleet, encoder_state__isnull=False).order_by('pk')
+        entries = [(index, item, token_type, token_value) for index, item in enumerate(items)]
+    else:
+        data = request.data.get('tokens')
+        if not isinstance(data, list) or not data:
+            return Response({"detail": "Provide 'tokens' (a non-empty list) or 'fleet_id'."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if len(data) > MAX_BATCH_TOKENS:
+            return Response({"detail": f"At most {MAX_BATCH_TOKENS} tokens per request."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        pairs = unique_pks(entry.get('item_id') for entry in data if isinstance(entry, dict))
+        items = Item.objects.select_related('fleet').in_bulk([pk for _, pk in pairs if pk is not None])
+        with_encoder = set(
+            EncoderState.objects.filter(item_id__in=items).values_list('item_id', flat=True)
+        )
+        for index, entry in enumerate(data):
+            if not isinstance(entry, dict):
+                errors.append({"index": index, "error": "Invalid data. Expected a dictionary."})
+                continue
+            error = validate_token_spec(entry.get('token_type'), entry.get('token_value'))
+            if error:
+                errors.append({"index": index, "error": error})
+                continue
+            item = items.get(to_pk(entry.get('item_id')))
+            if item is None:
+                errors.append({"index": index, "error": "No Item matches the given query."})
+            elif user.user_type == 'DISTRIBUTOR' and (item.fleet is None or item.fleet.distributor_id != user.id):
+                errors.append({"index": index, "error": "You do not own this item (through its fleet)."})
+            elif item.pk not in with_encoder:
+                errors.append({"index": index, "error": "No EncoderState matches the given query."})
+            else:
+                entries.append((index, item, entry['token_type'], entry['token_value']))
 
-        # 6) Update the EncoderState with the new token
-        update_encoder_state(encoder_state, token_response)
+    if len(entries) > MAX_BATCH_TOKENS:
+        return Response({"detail": f"At most {MAX_BATCH_TOKENS} tokens per request."},
+                        status=status.HTTP_400_BAD_REQUEST)
 
-        # 7) Create a GeneratedCode record for history
-        payment_message, _ = PaymentMessage.objects.get_or_create(
-            defaults={'message': f"Token generated for {token_type}."}
+    with transaction.atomic():
+        token_requests = create_batch_token_requests(
+            [(item, token_type, token_value) for _, item, token_type, token_value in entries]
         )
-        generated_code = create_generated_code(item, token_response, payment_message)
+    process_token_batch(token_requests)
+
+    results = []
+    for (index, item, _, _), token_request in zip(entries, token_requests):
+        result = {
+            "index": index,
+            "item_id": item.pk,
+            "token_request_id": token_request.pk,
+            "token_type": token_request.token_type,
+        }
+        if token_request.status == 'completed':
+            generated_code = token_request.generated_code
+            result.update({
+                "status": "completed",
+                "token": generated_code.token,
+                "token_value": generated_code.token_value,
+                "max_count": generated_code.max_count,
+            })
+        elif token_request.status == 'failed':
+            result.update({"status": "failed", "error": token_request.last_error})
+        else:
+            result.update({"status": "queued", "error": token_request.last_error or None})
+        results.append(result)
+
+    return Response({
+        "results": results,
+        "errors": errors
+    }, status=status.HTTP_200_OK if results else status.HTTP_400_BAD_REQUEST)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def verify_token_view(request, item_id):
+    """
+    POST /items/<item_id>/verify_token/
+    {
+      "token": "123 456 789"
+    }
+
+    Decode a customer-entered token against the item's EncoderState
+    in-process: which counter it was generated for, its type and value,
+    and whether that counter has been issued. Reads only the EncoderState,
+    never the GeneratedCode history or the remote service.
+
+    - SUPER_ADMIN => any item
+    - DISTRIBUTOR => items in their fleets
+    - AGENT => items in fleets assigned to them
+    """
+    user = request.user
+    item = get_object_or_404(Item.objects.select_related('fleet', 'encoder_state'), pk=item_id)
+
+    if user.user_type == 'SUPER_ADMIN':
+        pass
+    elif user.user_type == 'DISTRIBUTOR':
+        if not item.fleet or item.fleet.distributor_id != user.id:
+            raise PermissionDenied("You don't own this item's fleet.")
+    elif user.user_type == 'AGENT':
+        if not item.fleet or item.fleet.assigned_agent_id != user.id:
+            raise PermissionDenied("This item's fleet isn't assigned to you.")
+    else:
+        raise PermissionDenied("You do not have permission to verify tokens.")
+
+    token = request.data.get('token')
+    if not token:
+        return Response({"detail": "token is required."}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        encoder_state = item.encoder_state
+    except EncoderState.DoesNotExist:
+        return Response({"detail": "This item has no encoder state."}, status=status.HTTP_400_BAD_REQUEST)
+
+    last_count = encoder_state.max_count or 0
+    try:
+        decoded = decode_token(encoder_state.secret_key, token, last_count, encoder_state.starting_code)
+    except TokenEngineError as e:
+        return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-        # 8) Respond with the generated token and details
+    if decoded is None:
         return Response({
-            "detail": "Token generated successfully.",
-            "token": generated_code.token,
-            "token_type": generated_code.token_type,
-            "token_value": generated_code.token_value,
-            "max_count": generated_code.max_count,
+            "valid": False,
+            "status": "invalid",
+            "detail": "This token was not generated for this item.",
         }, status=status.HTTP_200_OK)
 
-    except Exception as e:
-        return Response({
-            "detail": "An error occurred while generating the token.",
-            "error": str(e)
-        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    value, token_type, count = decoded
+    issued = count <= last_count
+    return Response({
+        "valid": True,
+        "status": "issued" if issued else "not_issued",
+        "token_type": token_type,
+        "token_value": value if token_type in ('ADD_TIME', 'SET_TIME') else None,
+        "count": count,
+        "current_count": last_count,
+        "is_latest": count == last_count,
+    }, status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def token_service_metrics_view(request):
+    """
+    GET /token_service/metrics/
+    Open-token client counters of this process, in the Prometheus text format.
+    """
+    if request.user.user_type != 'SUPER_ADMIN':
+        raise PermissionDenied("Only super admins can view token service metrics.")
+    client = get_token_client()
+    return HttpResponse(
+        client.metrics.render(client.breaker),
+        content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
 
 
 @api_view(['GET'])
@@ -312,8 +586,7 @@ def get_generated_codes_for_item(request, item_id):
         return Response({"detail": "You do not have permission to view codes for this item."}, status=status.HTTP_403_FORBIDDEN)
 
     codes = GeneratedCode.objects.filter(item=item)
-    serializer = GeneratedCodeSerializer(codes, many=True)
-    return Response(serializer.data, status=status.HTTP_200_OK)
+    return keyset_response(request, codes, GeneratedCodeSerializer)
 
 
 @api_view(['GET'])
@@ -351,11 +624,83 @@ def get_payments_for_item(request, item_id):
 #     serializer = PaymentSerializer(payments, many=True)
 #     return Response(serializer.data, status=status.HTTP_200_OK)
 
+def parse_date_param(request, name, end_of_day=False):
+    """
+    An aware datetime from a `YYYY-MM-DD` or ISO datetime query parameter.
+    A bare date means the start of that day, or the start of the next one
+    with `end_of_day` (for exclusive upper bounds).
+    """
+    value = request.query_params.get(name)
+    if not value:
+        return None
+    try:
+        # Dates first: parse_datetime() also accepts a bare date, as midnight
+        day = parse_date(value)
+        moment = None if day else parse_datetime(value)
+    except ValueError:
+        moment = day = None
+    if moment is None and day is None:
+        raise ValidationError({name: "Use YYYY-MM-DD or an ISO 8601 datetime."})
+    if day is not None:
+        moment = datetime.combine(day + timedelta(days=1) if end_of_day else day, time.min)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+def parse_id_param(request, name):
+    value = request.query_params.get(name)
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValidationError({name: f"{name} must be an integer."})
+
+# Query parameters of the distributor ledger and the Payment field each filters
+PAYMENT_ID_FILTERS = {
+    'fleet_id': 'item__fleet_id',
+    'payment_plan_id': 'payment_plan_id',
+    'customer_id': 'customer_id',
+}
+
+# Query parameters of the generated-codes export and the field each filters
+GENERATED_CODE_ID_FILTERS = {
+    'fleet_id': 'item__fleet_id',
+    'item_id': 'item_id',
+}
+
+def filter_by_query(request, queryset, date_field, id_filters):
+    """Apply date_from/date_to on `date_field` and the `id_filters` from the query string."""
+    date_from = parse_date_param(request, 'date_from')
+    date_to = parse_date_param(request, 'date_to', end_of_day=True)
+    if date_from:
+        queryset = queryset.filter(**{f'{date_field}__gte': date_from})
+    if date_to:
+        # A bare date_to includes the whole day; a datetime is exclusive
+        queryset = queryset.filter(**{f'{date_field}__lt': date_to})
+    for param, field in id_filters.items():
+        value = parse_id_param(request, param)
+        if value is not None:
+            queryset = queryset.filter(**{field: value})
+    return queryset
+
+def filter_payments(request, payments):
+    """Apply the ledger's date-range and id filters from the query string."""
+    return filter_by_query(request, payments, 'paid_at', PAYMENT_ID_FILTERS)
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_payments_for_distributor(request):
     """
-    Retrieve all Payments related to the authenticated Distributor.
+    GET /payments/
+    Payments received by the authenticated Distributor, newest first.
+
+    Optional filters:
+      - date_from / date_to: YYYY-MM-DD (inclusive) or ISO datetimes
+      - fleet_id, payment_plan_id, customer_id
+
+    Send `page_size` (and then the returned `cursor`) to page through large
+    ledgers; the (distributor, paid_at, id) index serves each page.
     """
     user = request.user
 
@@ -366,13 +711,165 @@ def get_payments_for_distributor(request):
             status=status.HTTP_403_FORBIDDEN
         )
 
-    payments = Payment.objects.filter(item__fleet__distributor=user).order_by('-paid_at')
-    serializer = PaymentSerializer(payments, many=True)
-    return Response(serializer.data, status=status.HTTP_200_OK)
+    payments = filter_payments(request, Payment.objects.filter(distributor=user))
+    payments = PaymentSerializer.setup_eager_loading(payments).order_by('-paid_at', '-id')
+    return keyset_response(request, payments, PaymentSerializer, keys=('paid_at', 'id'))
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def export_payments_view(request):
+    """
+    GET /payments/export/
+    The authenticated Distributor's payments as a streamed CSV, newest
+    first, with item serial, customer and plan names. Takes the same
+    filters as GET /payments/.
+    """
+    user = request.user
+    if user.user_type != 'DISTRIBUTOR':
+        raise PermissionDenied("You do not have permission to export payments.")
+
+    payments = filter_payments(request, Payment.objects.filter(distributor=user))
+    return csv_response(payments.order_by('-paid_at', '-id'), PAYMENT_EXPORT_COLUMNS, 'payments')
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def export_generated_codes_view(request):
+    """
+    GET /generated_codes/export/
+    Codes generated for the authenticated Distributor's items as a streamed
+    CSV, newest first.
+
+    Optional filters: date_from / date_to (on created_at), fleet_id, item_id
+    """
+    user = request.user
+    if user.user_type != 'DISTRIBUTOR':
+        raise PermissionDenied("You do not have permission to export generated codes.")
+
+    codes = filter_by_query(
+        request, GeneratedCode.objects.filter(item__fleet__distributor=user),
+        'created_at', GENERATED_CODE_ID_FILTERS
+    )
+    return csv_response(codes.order_by('-created_at', '-id'), GENERATED_CODE_EXPORT_COLUMNS, 'generated-codes')
+
+# Report periods and the function truncating a rollup day to each
+REVENUE_PERIODS = {
+    'day': None,
+    'week': TruncWeek,
+    'month': TruncMonth,
+    'quarter': TruncQuarter,
+    'year': TruncYear,
+}
+REVENUE_BREAKDOWNS = {
+    'fleet': 'fleet_id',
+    'payment_plan': 'payment_plan_id',
+}
+REVENUE_ID_FILTERS = {
+    'fleet_id': 'fleet_id',
+    'payment_plan_id': 'payment_plan_id',
+}
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def revenue_report_view(request):
+    """
+    GET /reports/revenue/
+    Collections per period from the daily revenue rollups.
+
+    Query parameters (all optional):
+      - period: day | week | month (default) | quarter | year
+      - breakdown: fleet | payment_plan, to split each period
+      - date_from / date_to: YYYY-MM-DD (or ISO datetimes, for their day), inclusive
+      - fleet_id, payment_plan_id
+      - distributor_id: SUPER_ADMIN only; admins see every distributor otherwise
+
+    Each row has total_amount, total_payments and total_items. total_items
+    sums the distinct paying items of each day, so over longer periods it
+    counts item-days.
+    """
+    user = request.user
+    if user.user_type == 'DISTRIBUTOR':
+        rollups = DailyRevenueRollup.objects.filter(distributor=user)
+    elif user.user_type == 'SUPER_ADMIN':
+        rollups = DailyRevenueRollup.objects.all()
+        distributor_id = parse_id_param(request, 'distributor_id')
+        if distributor_id is not None:
+            rollups = rollups.filter(distributor_id=distributor_id)
+    else:
+        raise PermissionDenied("You do not have permission to view revenue reports.")
+
+    period = request.query_params.get('period', 'month')
+    if period not in REVENUE_PERIODS:
+        raise ValidationError({"period": f"period must be one of {', '.join(REVENUE_PERIODS)}."})
+    breakdown = request.query_params.get('breakdown')
+    if breakdown is not None and breakdown not in REVENUE_BREAKDOWNS:
+        raise ValidationError({"breakdown": f"breakdown must be one of {', '.join(REVENUE_BREAKDOWNS)}."})
+
+    date_from = parse_date_param(request, 'date_from')
+    date_to = parse_date_param(request, 'date_to')
+    # Rollups are whole days: a bound includes the day it falls on
+    if date_from:
+        rollups = rollups.filter(day__gte=timezone.localdate(date_from))
+    if date_to:
+        rollups = rollups.filter(day__lte=timezone.localdate(date_to))
+    for param, field in REVENUE_ID_FILTERS.items():
+        value = parse_id_param(request, param)
+        if value is not None:
+            rollups = rollups.filter(**{field: value})
+
+    trunc = REVENUE_PERIODS[period]
+    rollups = rollups.annotate(period=trunc('day') if trunc else F('day'))
+    group_by = ['period'] + ([REVENUE_BREAKDOWNS[breakdown]] if breakdown else [])
+    rows = (
+        rollups.order_by().values(*group_by)
+        .annotate(
+            total_amount=Sum('amount'),
+            total_payments=Sum('payments_count'),
+            total_items=Sum('items_count'),
+        )
+        .order_by(*group_by)
+    )
+    return Response({"period": period, "results": list(rows)}, status=status.HTTP_200_OK)
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def analytics_snapshots_view(request):
+    """
+    GET /analytics/snapshots/
+    Parquet part files of the analytics snapshot: a Distributor's own
+    partitions, or every partition for a SUPER_ADMIN. The snapshot is
+    written by `manage.py snapshot_ledger`, run on a schedule.
+    """
+    user = request.user
+    if user.user_type not in ['SUPER_ADMIN', 'DISTRIBUTOR']:
+        raise PermissionDenied("You do not have permission to view analytics snapshots.")
+
+    distributor_id = None if user.user_type == 'SUPER_ADMIN' else user.id
+    return Response(list_snapshot_files(distributor_id), status=status.HTTP_200_OK)
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def analytics_snapshot_file_view(request, path):
+    """
+    GET /analytics/snapshots/<table>/distributor=<id>/month=<YYYY-MM>/<part>.parquet
+    Download one part file listed by GET /analytics/snapshots/.
+    """
+    user = request.user
+    if user.user_type not in ['SUPER_ADMIN', 'DISTRIBUTOR']:
+        raise PermissionDenied("You do not have permission to view analytics snapshots.")
+
+    distributor_id = None if user.user_type == 'SUPER_ADMIN' else user.id
+    file_path = resolve_snapshot_file(path, distributor_id)
+    if file_path is None:
+        raise Http404("No such snapshot file.")
+    return FileResponse(
+        open(file_path, 'rb'), as_attachment=True, filename=file_path.name,
+        content_type='application/vnd.apache.parquet'
+    )
 
 
 # views.py
 
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_all_payment_plans(request):
@@ -385,7 +882,7 @@ def get_all_payment_plans(request):
     if user.user_type == 'SUPER_ADMIN':
         payment_plans = PaymentPlan.objects.all().order_by('-created_at')
     elif user.user_type == 'DISTRIBUTOR' or user.user_type == 'AGENT':
-        payment_plans = PaymentPlan.objects.filter(distributor=user).order_by('-created_at')
+        payment_plans = get_distributor_plans(user.id)
     else:
         return Response({"detail": "You do not have permission to view payment plans."}, status=status.HTTP_403_FORBIDDEN)
 
@@ -410,14 +907,13 @@ def assign_payment_plan_to_item(request):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     item_id = serializer.validated_data['item_id']
-    payment_plan_id = serializer.validated_data['payment_plan_id']
 
-    item = get_object_or_404(Item, pk=item_id)
-    payment_plan = get_object_or_404(PaymentPlan, pk=payment_plan_id)
+    item = get_object_or_404(Item.objects.select_related('fleet'), pk=item_id)
+    payment_plan = serializer.validated_data['payment_plan']
 
     # Permission Check: Only SUPER_ADMIN or Distributor owning the Item can assign a payment plan
     user = request.user
-    if user.user_type == 'DISTRIBUTOR' and item.fleet.distributor != user:
+    if user.user_type == 'DISTRIBUTOR' and item.fleet.distributor_id != user.id:
         return Response({"detail": "You do not have permission to assign a payment plan to this item."}, status=status.HTTP_403_FORBIDDEN)
 
     # Assign the PaymentPlan to the Item
@@ -431,6 +927,75 @@ def assign_payment_plan_to_item(request):
     }, status=status.HTTP_200_OK)
 
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def bulk_assign_payment_plan_view(request):
+    """
+    POST /items/bulk_assign_payment_plan/
+    {
+      "payment_plan_id": <int>,
+      "item_ids": [<int>, <int>, ...]   // or "fleet_id": <int>
+    }
+    Assign one PaymentPlan to many items with a single UPDATE, then
+    recompute the statuses of those items set-wise.
+    - SUPER_ADMIN => any plan, any item
+    - DISTRIBUTOR => own plans, items in own fleets
+    """
+    user = request.user
+    if user.user_type not in ['SUPER_ADMIN', 'DISTRIBUTOR']:
+        raise PermissionDenied("You do not have permission to assign payment plans.")
+
+    payment_plan = get_plan(to_pk(request.data.get('payment_plan_id')))
+    if payment_plan is None:
+        return Response({"detail": "PaymentPlan does not exist."}, status=status.HTTP_404_NOT_FOUND)
+    if user.user_type == 'DISTRIBUTOR' and payment_plan.distributor_id != user.id:
+        raise PermissionDenied("You can only assign your own PaymentPlans.")
+
+    fleet_id = request.data.get('fleet_id')
+    item_ids = request.data.get('item_ids')
+    assigned = []
+    errors = []
+
+    if fleet_id is not None:
+        fleet = get_object_or_404(Fleet, pk=fleet_id)
+        if user.user_type == 'DISTRIBUTOR' and fleet.distributor_id != user.id:
+            raise PermissionDenied("You do not own this fleet.")
+        items = Item.objects.filter(fleet=fleet)
+    elif isinstance(item_ids, list) and item_ids:
+        # One query classifies every requested id
+        requested = unique_pks(item_ids)
+        rows = fetch_rows(Item.objects.all(), [pk for _, pk in requested], 'fleet__distributor_id')
+        eligible = []
+        for iid, pk in requested:
+            row = rows.get(pk)
+            if row is None:
+                errors.append({"item_id": iid, "error": "Item not found."})
+            elif user.user_type == 'DISTRIBUTOR' and row['fleet__distributor_id'] != user.id:
+                errors.append({"item_id": iid, "error": "You do not own this item (through its fleet)."})
+            else:
+                eligible.append(pk)
+                assigned.append(iid)
+        items = Item.objects.filter(pk__in=eligible)
+    else:
+        return Response({"detail": "Provide a non-empty list of item_ids or a fleet_id."},
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    with transaction.atomic():
+        assigned_count = items.update(payment_plan=payment_plan, updated_at=timezone.now())
+        status_changed = recompute_item_statuses(items)
+
+    response = {
+        "detail": f"PaymentPlan '{payment_plan.name}' assigned to {assigned_count} item(s).",
+        "payment_plan_id": payment_plan.id,
+        "assigned_count": assigned_count,
+        "status_changed": status_changed,
+        "errors": errors,
+    }
+    if fleet_id is None:
+        response["assigned_items"] = assigned
+    return Response(response, status=status.HTTP_200_OK)
+
+
 # views.py
 
 @api_view(['POST'])
@@ -509,7 +1074,12 @@ def payment_plan_detail_view(request, pk):
             if new_distributor != payment_plan.distributor:
                 raise PermissionDenied("You cannot transfer payment plans to other distributors.")
 
-        serializer.save()
+        previous_total = payment_plan.total_amount
+        with transaction.atomic():
+            serializer.save()
+            if payment_plan.total_amount != previous_total:
+                # Items may cross the fully-paid line either way
+                recompute_statuses_for(plan=payment_plan)
         return Response(serializer.data)
 
     elif request.method == 'DELETE':
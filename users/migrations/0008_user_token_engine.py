@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0007_user_deleted_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='token_engine',
+            field=models.CharField(choices=[('REMOTE', 'Remote open-token service'), ('LOCAL', 'In-process OpenPAYGO engine')], default='REMOTE', max_length=10),
+        ),
+    ]
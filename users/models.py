@@ -78,6 +78,12 @@ class User(AbstractUser, BaseModel):
     )
     is_active = models.BooleanField(default=True)
     email_verified = models.BooleanField(default=False)
+    # Where this distributor's open tokens are generated
+    TOKEN_ENGINE_CHOICES = (
+        ('REMOTE', 'Remote open-token service'),
+        ('LOCAL', 'In-process OpenPAYGO engine'),
+    )
+    token_engine = models.CharField(max_length=10, choices=TOKEN_ENGINE_CHOICES, default='REMOTE')
     # Manager
     objects = UserManager()
 
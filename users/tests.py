@@ -1,3 +1,86 @@
+from django.contrib.auth import get_user_model
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
 
-# Create your tests here.
+from clients.models import Customer
+from items.models import Fleet
+
+User = get_user_model()
+
+
+class TransferAgentPortfolioTests(TestCase):
+
+    def setUp(self):
+        self.distributor = User.objects.create_user(
+            email='distributor@example.com', password='pass', user_type='DISTRIBUTOR'
+        )
+        self.leaving, self.first, self.second, self.third = [
+            User.objects.create_user(
+                email=f'agent{n}@example.com', password='pass', user_type='AGENT', distributor=self.distributor
+            )
+            for n in range(4)
+        ]
+        self.fleets = [
+            Fleet.objects.create(name=f'Fleet {n}', distributor=self.distributor, assigned_agent=self.leaving)
+            for n in range(4)
+        ]
+        self.customers = [
+            Customer.objects.create(
+                name=f'Customer {n}', email=f'c{n}@example.com', phone_number=f'070000000{n}',
+                distributor=self.distributor, assigned_agent=self.leaving
+            )
+            for n in range(6)
+        ]
+        # The first agent already holds two fleets
+        Fleet.objects.create(name='Held 1', distributor=self.distributor, assigned_agent=self.first)
+        Fleet.objects.create(name='Held 2', distributor=self.distributor, assigned_agent=self.first)
+        self.client = APIClient()
+        self.client.force_authenticate(self.distributor)
+
+    def transfer(self, **data):
+        return self.client.post('/api/agents/transfer_portfolio/', {'from_agent_id': self.leaving.id, **data}, format='json')
+
+    def loads(self, rows, agents):
+        """How many of the transferred `rows` each of `agents` now holds."""
+        model = type(rows[0])
+        return [model.objects.filter(pk__in=[row.pk for row in rows], assigned_agent=agent).count() for agent in agents]
+
+    def distribution(self, response):
+        return {row['agent_id']: (row['fleets'], row['customers']) for row in response.data['distribution']}
+
+    def test_single_target_takes_everything(self):
+        response = self.transfer(to_agent_id=self.second.id)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['fleets_moved'], response.data['customers_moved']), (4, 6))
+        self.assertEqual(self.distribution(response), {self.second.id: (4, 6)})
+        self.assertFalse(Fleet.objects.filter(assigned_agent=self.leaving).exists())
+        self.assertFalse(Customer.objects.filter(assigned_agent=self.leaving).exists())
+
+    def test_least_loaded_counts_existing_portfolios(self):
+        response = self.transfer(to_agent_ids=[self.first.id, self.second.id, self.third.id])
+        self.assertEqual((response.data['fleets_moved'], response.data['customers_moved']), (4, 6))
+        self.assertEqual(self.distribution(response), {
+            self.first.id: (0, 2), self.second.id: (2, 2), self.third.id: (2, 2),
+        })
+        self.assertEqual(self.loads(self.fleets, [self.first, self.second, self.third]), [0, 2, 2])
+        self.assertEqual(self.loads(self.customers, [self.first, self.second, self.third]), [2, 2, 2])
+
+    def test_round_robin_uses_one_update_per_table(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.transfer(to_agent_ids=[self.first.id, self.second.id], strategy='round_robin')
+        self.assertEqual(self.distribution(response), {self.first.id: (2, 3), self.second.id: (2, 3)})
+        self.assertEqual(self.loads(self.fleets, [self.first, self.second]), [2, 2])
+        self.assertEqual(self.loads(self.customers, [self.first, self.second]), [3, 3])
+        updates = [query['sql'] for query in ctx.captured_queries if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 2)
+
+    def test_rejects_foreign_or_leaving_targets(self):
+        other = User.objects.create_user(email='other@example.com', password='pass', user_type='DISTRIBUTOR')
+        foreign_agent = User.objects.create_user(
+            email='foreign@example.com', password='pass', user_type='AGENT', distributor=other
+        )
+        self.assertEqual(self.transfer(to_agent_ids=[self.first.id, foreign_agent.id]).status_code, 400)
+        self.assertEqual(self.transfer(to_agent_ids=[self.first.id, self.leaving.id]).status_code, 400)
+        self.assertEqual(Fleet.objects.filter(assigned_agent=self.leaving).count(), 4)
@@ -9,4 +9,5 @@ urlpatterns = [
     path('register/agent/', views.register_agent, name='register-agent'),
     path('register/superadmin/', views.register_super_admin, name='register_super_admin'),
     path('distributor/agents/', views.get_agents_for_distributor, name='get_agents_for_distributor'),
+    path('agents/transfer_portfolio/', views.transfer_agent_portfolio_view, name='transfer-agent-portfolio'),
 ]
\ No newline at end of file
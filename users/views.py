@@ -17,6 +17,14 @@ from .serializers import (
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.exceptions import PermissionDenied
 from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Case, Count, IntegerField, Value, When
+from django.utils import timezone
+import heapq
+
+from clients.models import Customer
+from items.models import Fleet
+from utils.bulk import to_pk, unique_pks
 User = get_user_model()
 # @api_view(['POST'])
 # @permission_classes([AllowAny])
@@ -130,3 +138,143 @@ def get_agents_for_distributor(request):
 
     return Response(serializer.data)
 
+
+
+def plan_balanced_transfer(pks, target_ids, current_loads, strategy):
+    """
+    Spread `pks` over `target_ids` and return {agent_id: [pk, ...]}.
+
+    - round_robin  => deal ids out in turn
+    - least_loaded => give each id to whoever currently holds the fewest,
+                      counting what they already own
+    """
+    plan = {agent_id: [] for agent_id in target_ids}
+    if strategy == 'round_robin':
+        for position, pk in enumerate(pks):
+            plan[target_ids[position % len(target_ids)]].append(pk)
+        return plan
+
+    heap = [(current_loads.get(agent_id, 0), position, agent_id) for position, agent_id in enumerate(target_ids)]
+    heapq.heapify(heap)
+    for pk in pks:
+        load, position, agent_id = heapq.heappop(heap)
+        plan[agent_id].append(pk)
+        heapq.heappush(heap, (load + 1, position, agent_id))
+    return plan
+
+
+def apply_transfer_plan(queryset, plan):
+    """
+    Apply a plan_balanced_transfer() result with a single UPDATE that picks
+    each row's new agent with CASE WHEN. Returns the number of rows moved.
+    """
+    whens = [When(pk__in=pks, then=Value(agent_id)) for agent_id, pks in plan.items() if pks]
+    if not whens:
+        return 0
+    return queryset.filter(pk__in=[pk for pks in plan.values() for pk in pks]).update(
+        assigned_agent_id=Case(*whens, output_field=IntegerField()), updated_at=timezone.now()
+    )
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def transfer_agent_portfolio_view(request):
+    """
+    POST /agents/transfer_portfolio/
+    {
+      "from_agent_id": <int>,
+      "to_agent_id": <int>                  // move everything to one agent
+      -- or --
+      "to_agent_ids": [<int>, <int>, ...],  // spread across several agents
+      "strategy": "least_loaded" | "round_robin"   // Optional, default least_loaded
+    }
+
+    Moves every Fleet.assigned_agent and Customer.assigned_agent of the
+    leaving agent, inside one transaction, using set-based UPDATEs.
+    Only the Distributor owning the agents can do this.
+    """
+    user = request.user
+    if user.user_type != 'DISTRIBUTOR':
+        raise PermissionDenied("Only a Distributor can transfer an agent's portfolio.")
+
+    from_agent_id = request.data.get('from_agent_id')
+    to_agent_ids = request.data.get('to_agent_ids')
+    if to_agent_ids is None and request.data.get('to_agent_id'):
+        to_agent_ids = [request.data.get('to_agent_id')]
+    strategy = request.data.get('strategy', 'least_loaded')
+
+    if not from_agent_id:
+        return Response({"detail": "from_agent_id is required."}, status=status.HTTP_400_BAD_REQUEST)
+    if not isinstance(to_agent_ids, list) or len(to_agent_ids) == 0:
+        return Response(
+            {"detail": "to_agent_id or a non-empty to_agent_ids list is required."},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if strategy not in ['least_loaded', 'round_robin']:
+        return Response(
+            {"detail": "strategy must be either 'least_loaded' or 'round_robin'."},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    from_agent = User.objects.filter(pk=to_pk(from_agent_id), user_type='AGENT', distributor=user).first()
+    if from_agent is None:
+        return Response(
+            {"detail": "Invalid from_agent_id or agent does not belong to you."},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    target_ids = [pk for _, pk in unique_pks(to_agent_ids)]
+    valid_targets = set(
+        User.objects.filter(pk__in=[pk for pk in target_ids if pk is not None], user_type='AGENT', distributor=user)
+        .values_list('pk', flat=True)
+    )
+    if None in target_ids or set(target_ids) != valid_targets:
+        return Response(
+            {"detail": "Every target must be an AGENT that belongs to you."},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if from_agent.pk in valid_targets:
+        return Response(
+            {"detail": "The leaving agent cannot also be a target."},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    fleets = Fleet.objects.filter(distributor=user, assigned_agent=from_agent)
+    customers = Customer.objects.filter(distributor=user, assigned_agent=from_agent)
+    distribution = {agent_id: {"agent_id": agent_id, "fleets": 0, "customers": 0} for agent_id in target_ids}
+
+    with transaction.atomic():
+        if len(target_ids) == 1:
+            # Straight handover: one UPDATE per table
+            agent_id = target_ids[0]
+            fleets_moved = fleets.update(assigned_agent_id=agent_id, updated_at=timezone.now())
+            customers_moved = customers.update(assigned_agent_id=agent_id, updated_at=timezone.now())
+            distribution[agent_id].update(fleets=fleets_moved, customers=customers_moved)
+        else:
+            fleet_ids = list(fleets.select_for_update().values_list('pk', flat=True))
+            customer_ids = list(customers.select_for_update().values_list('pk', flat=True))
+
+            fleet_loads = dict(
+                Fleet.objects.filter(assigned_agent_id__in=target_ids)
+                .values_list('assigned_agent_id').annotate(total=Count('pk'))
+            )
+            customer_loads = dict(
+                Customer.objects.filter(assigned_agent_id__in=target_ids)
+                .values_list('assigned_agent_id').annotate(total=Count('pk'))
+            )
+
+            fleet_plan = plan_balanced_transfer(fleet_ids, target_ids, fleet_loads, strategy)
+            fleets_moved = apply_transfer_plan(Fleet.objects.all(), fleet_plan)
+            customer_plan = plan_balanced_transfer(customer_ids, target_ids, customer_loads, strategy)
+            customers_moved = apply_transfer_plan(Customer.objects.all(), customer_plan)
+            for agent_id in target_ids:
+                distribution[agent_id].update(
+                    fleets=len(fleet_plan[agent_id]), customers=len(customer_plan[agent_id])
+                )
+
+    return Response({
+        "from_agent_id": from_agent.pk,
+        "fleets_moved": fleets_moved,
+        "customers_moved": customers_moved,
+        "distribution": list(distribution.values()),
+    }, status=status.HTTP_200_OK)
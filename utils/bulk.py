@@ -0,0 +1,61 @@
+from django.db import transaction
+from django.utils import timezone
+
+# Reported for rows that were eligible when classified but that another
+# request changed before the UPDATE
+CONCURRENT_CHANGE_ERROR = "Changed by another request. Try again."
+
+def to_pk(value):
+    """Coerce a user supplied id to int, returning None for anything unusable."""
+    if isinstance(value, bool):
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def unique_pks(raw_ids):
+    """
+    Return [(raw_id, pk)] for a request's id list, dropping repeats but keeping
+    the client's order. pk is None when the raw id is not an integer.
+    """
+    seen = set()
+    result = []
+    for raw_id in raw_ids:
+        pk = to_pk(raw_id)
+        key = pk if pk is not None else repr(raw_id)
+        if key in seen:
+            continue
+        seen.add(key)
+        result.append((raw_id, pk))
+    return result
+
+
+def fetch_rows(queryset, pks, *fields):
+    """
+    One query returning {pk: {field: value}} for the given pks, used to classify
+    a whole id list before a single set-based UPDATE.
+    """
+    pks = [pk for pk in pks if pk is not None]
+    if not pks:
+        return {}
+    return {row['id']: row for row in queryset.filter(pk__in=pks).values('id', *fields)}
+
+
+def update_rows(queryset, pks, **values):
+    """
+    One guarded UPDATE of the `queryset` rows among `pks`, returning the set
+    of pks it actually changed. Those are re-selected by the updated_at the
+    UPDATE stamped, so rows a concurrent request changed in between (and the
+    guard in `queryset` therefore skipped) are not reported as updated.
+    """
+    if not pks:
+        return set()
+    now = timezone.now()
+    with transaction.atomic():
+        queryset.filter(pk__in=pks).update(updated_at=now, **values)
+        return set(
+            queryset.model.objects.filter(pk__in=pks, updated_at=now, **values)
+            .values_list('pk', flat=True)
+        )
@@ -0,0 +1,105 @@
+import base64
+import json
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(values):
+    """Turn the (timestamp, id) of the last row on a page into an opaque cursor."""
+    timestamp, pk = values
+    raw = json.dumps([timestamp.isoformat(), pk]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor):
+    """Reverse of encode_cursor. Raises ValidationError on anything we did not issue."""
+    try:
+        timestamp, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        timestamp = parse_datetime(timestamp)
+        pk = int(pk)
+    except (ValueError, TypeError, json.JSONDecodeError):
+        raise ValidationError({"cursor": "Invalid cursor."})
+    if timestamp is None:
+        raise ValidationError({"cursor": "Invalid cursor."})
+    return timestamp, pk
+
+
+def get_page_size(request):
+    page_size = request.query_params.get('page_size')
+    if page_size is None:
+        return DEFAULT_PAGE_SIZE
+    try:
+        page_size = int(page_size)
+    except ValueError:
+        raise ValidationError({"page_size": "page_size must be an integer."})
+    if page_size <= 0:
+        raise ValidationError({"page_size": "page_size must be a positive integer."})
+    return min(page_size, MAX_PAGE_SIZE)
+
+
+def is_paginated_request(request):
+    """
+    Pagination is opt-in so existing clients keep getting the plain list.
+    Sending either `page_size` or `cursor` switches to the paged envelope.
+    """
+    return 'page_size' in request.query_params or 'cursor' in request.query_params
+
+
+def paginate_keyset(request, queryset, keys=('created_at', 'id'), descending=True):
+    """
+    Return (rows, next_cursor) for one page of `queryset`, newest first
+    (oldest first with descending=False).
+
+    Rows are ordered by `keys` and the cursor carries the key values of the
+    last row, so the next page is a `WHERE (ts, id) < (cursor)` range scan
+    instead of an OFFSET that grows with the tenant.
+    """
+    time_key, id_key = keys
+    page_size = get_page_size(request)
+
+    direction, after = ('-', 'lt') if descending else ('', 'gt')
+    queryset = queryset.order_by(f'{direction}{time_key}', f'{direction}{id_key}')
+    cursor = request.query_params.get('cursor')
+    if cursor:
+        timestamp, pk = decode_cursor(cursor)
+        queryset = queryset.filter(
+            Q(**{f'{time_key}__{after}': timestamp}) |
+            Q(**{time_key: timestamp, f'{id_key}__{after}': pk})
+        )
+
+    # Fetch one extra row to know whether there is a next page.
+    rows = list(queryset[:page_size + 1])
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        next_cursor = encode_cursor((getattr(last, time_key), getattr(last, id_key)))
+    return rows, next_cursor
+
+
+def keyset_response(request, queryset, serializer_class, keys=('created_at', 'id'), descending=True,
+                    **serializer_kwargs):
+    """
+    Serialize `queryset` as a list endpoint response.
+
+    - Without `page_size`/`cursor` => the full list, as before.
+    - With them => {"results": [...], "next_cursor": <str|null>, "page_size": <int>}
+    """
+    if not is_paginated_request(request):
+        serializer = serializer_class(queryset, many=True, **serializer_kwargs)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+    rows, next_cursor = paginate_keyset(request, queryset, keys=keys, descending=descending)
+    serializer = serializer_class(rows, many=True, **serializer_kwargs)
+    return Response({
+        "results": serializer.data,
+        "next_cursor": next_cursor,
+        "page_size": get_page_size(request),
+    }, status=status.HTTP_200_OK)
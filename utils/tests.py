@@ -1,3 +1,89 @@
-from django.test import TestCase
+from datetime import datetime, timezone
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase
+from rest_framework.exceptions import ValidationError
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from clients.models import Customer
+from clients.serializers import CustomerSerializer
+from .pagination import decode_cursor, encode_cursor, keyset_response, paginate_keyset
+
+User = get_user_model()
+
+
+def make_request(params=None):
+    return Request(APIRequestFactory().get('/', params or {}))
+
+
+class CursorTests(SimpleTestCase):
+
+    def test_round_trip(self):
+        timestamp = datetime(2026, 4, 1, 8, 30, 15, 123456, tzinfo=timezone.utc)
+        self.assertEqual(decode_cursor(encode_cursor((timestamp, 42))), (timestamp, 42))
+
+    def test_invalid_cursors_are_rejected(self):
+        for cursor in ['not-base64!', 'W10=', encode_cursor((datetime(2026, 1, 1), 1))[:-4], 'WyJ4IiwgMV0=']:
+            with self.subTest(cursor=cursor), self.assertRaises(ValidationError):
+                decode_cursor(cursor)
+
+    def test_page_size_validation(self):
+        for page_size in ['0', '-1', 'ten']:
+            with self.subTest(page_size=page_size), self.assertRaises(ValidationError):
+                paginate_keyset(make_request({'page_size': page_size}), Customer.objects.none())
+
+
+class KeysetPaginationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.distributor = User.objects.create_user(
+            email='distributor@example.com', password='pass', user_type='DISTRIBUTOR'
+        )
+        for n in range(5):
+            Customer.objects.create(
+                name=f'Customer {n}', email=f'c{n}@example.com', phone_number=f'070000000{n}',
+                distributor=cls.distributor
+            )
+        # Three rows share a created_at, so only the id breaks the tie
+        tied = datetime(2026, 1, 1, tzinfo=timezone.utc)
+        Customer.objects.filter(pk__in=list(Customer.objects.order_by('pk').values_list('pk', flat=True)[1:4])).update(
+            created_at=tied
+        )
+
+    def walk(self, page_size, descending=True):
+        seen, cursor = [], None
+        while True:
+            params = {'page_size': page_size}
+            if cursor:
+                params['cursor'] = cursor
+            rows, cursor = paginate_keyset(make_request(params), Customer.objects.all(), descending=descending)
+            self.assertLessEqual(len(rows), page_size)
+            seen += [row.pk for row in rows]
+            if cursor is None:
+                return seen
+
+    def test_pages_cover_every_row_once_across_ties(self):
+        expected = list(Customer.objects.order_by('-created_at', '-id').values_list('pk', flat=True))
+        for page_size in [1, 2, 3, 5, 10]:
+            with self.subTest(page_size=page_size):
+                self.assertEqual(self.walk(page_size), expected)
+
+    def test_ascending_order(self):
+        expected = list(Customer.objects.order_by('created_at', 'id').values_list('pk', flat=True))
+        self.assertEqual(self.walk(2, descending=False), expected)
+
+    def test_last_full_page_has_no_cursor(self):
+        rows, cursor = paginate_keyset(make_request({'page_size': 5}), Customer.objects.all())
+        self.assertEqual(len(rows), 5)
+        self.assertIsNone(cursor)
+
+    def test_unpaginated_fallback_returns_plain_list(self):
+        response = keyset_response(make_request(), Customer.objects.order_by('pk'), CustomerSerializer)
+        self.assertIsInstance(response.data, list)
+        self.assertEqual(len(response.data), 5)
+
+        response = keyset_response(make_request({'page_size': 2}), Customer.objects.all(), CustomerSerializer)
+        self.assertEqual(set(response.data), {'results', 'next_cursor', 'page_size'})
+        self.assertEqual(response.data['page_size'], 2)